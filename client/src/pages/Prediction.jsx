@@ -139,7 +139,7 @@ const Prediction = () => {
               </h2>
               <FileDrop
                 onFileSelect={handleFileSelect}
-                accept=".txt,.csv"
+                accept=".txt,.csv,.tsv,.mzML"
                 maxSize={10 * 1024 * 1024} // 10MB
               />
               {selectedFile && (
@@ -9,6 +9,79 @@ import OrganismDistributionChart from '../components/OrganismDistributionChart'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
+// Resistance rate as the server computes it: summed per-prediction rates over `count`, 0.25 without any
+const rateOf = (sum, count) => (count > 0 ? Number((sum / count).toFixed(3)) : 0.25)
+
+// Add a live-feed delta to the /regions entries; provinces not listed yet are added
+const applyRegionDeltas = (regions, deltas) => {
+  const updated = regions.map((entry) => {
+    const delta = deltas[entry.region]
+    if (!delta) return entry
+    const ratedCases = entry.rated_cases + delta.rated_cases
+    const rateSum = entry.resistance_rate_sum + delta.resistance_rate_sum
+    return {
+      ...entry,
+      cases: entry.cases + delta.cases,
+      // /regions averages over the predictions that tested any antibiotic
+      avg_resistance_rate: rateOf(rateSum, ratedCases),
+      rated_cases: ratedCases,
+      resistance_rate_sum: rateSum,
+      organisms: Array.from(new Set([...(entry.organisms || []), ...delta.organisms])).sort(),
+    }
+  })
+  const added = Object.entries(deltas)
+    .filter(([name]) => !regions.some((entry) => entry.region === name))
+    .map(([name, delta]) => ({
+      region: name,
+      lat: delta.lat,
+      lng: delta.lng,
+      cases: delta.cases,
+      avg_resistance_rate: rateOf(delta.resistance_rate_sum, delta.rated_cases),
+      rated_cases: delta.rated_cases,
+      resistance_rate_sum: delta.resistance_rate_sum,
+      organisms: [...delta.organisms].sort(),
+      // No cases in the previous 30 days to compare with, as in /regions
+      trend: 'stable',
+    }))
+  return [...updated, ...added]
+}
+
+// Add a live-feed delta to the /organisms top 10 and recompute the percentages
+const applyOrganismDeltas = (distribution, deltas) => {
+  const cases = Object.fromEntries(distribution.map((entry) => [entry.organism, entry.cases]))
+  Object.entries(deltas).forEach(([organism, delta]) => {
+    cases[organism] = (cases[organism] || 0) + delta.cases
+  })
+  const top = Object.entries(cases)
+    .sort((a, b) => b[1] - a[1] || a[0].localeCompare(b[0]))
+    .slice(0, 10)
+  const total = top.reduce((sum, [, count]) => sum + count, 0)
+  return top.map(([organism, count]) => ({
+    organism,
+    cases: count,
+    percentage: total > 0 ? Number(((count / total) * 100).toFixed(1)) : 0,
+  }))
+}
+
+// Add a live-feed delta to the latest (current month) bucket of /trends
+const applyTrendDelta = (trends, delta) => {
+  if (trends.length === 0 || delta.cases === 0) return trends
+  const last = trends[trends.length - 1]
+  const cases = last.cases + delta.cases
+  const rateSum = last.resistance_rate_sum + delta.resistance_rate_sum
+  return [
+    ...trends.slice(0, -1),
+    {
+      ...last,
+      cases,
+      // /trends averages over all cases of the bucket
+      resistance_rate: rateOf(rateSum, cases),
+      rated_cases: last.rated_cases + delta.rated_cases,
+      resistance_rate_sum: rateSum,
+    },
+  ]
+}
+
 const Surveillance = () => {
   const location = useLocation()
   const topRef = useRef(null)
@@ -22,6 +95,8 @@ const Surveillance = () => {
   const [isTrendsLoading, setIsTrendsLoading] = useState(true)
   const [organismData, setOrganismData] = useState([])
   const [isOrganismLoading, setIsOrganismLoading] = useState(true)
+  // Bumped to refetch everything when the live feed reports missed updates
+  const [reloadKey, setReloadKey] = useState(0)
 
   // Fetch surveillance data from backend
   useEffect(() => {
@@ -44,7 +119,7 @@ const Surveillance = () => {
     }
 
     fetchSurveillanceData()
-  }, [])
+  }, [reloadKey])
 
   // Fetch resistance trends data
   useEffect(() => {
@@ -66,7 +141,7 @@ const Surveillance = () => {
     }
 
     fetchTrendsData()
-  }, [])
+  }, [reloadKey])
 
   // Fetch organism distribution data
   useEffect(() => {
@@ -88,6 +163,23 @@ const Surveillance = () => {
     }
 
     fetchOrganismData()
+  }, [reloadKey])
+
+  // Live updates: fold server-sent deltas into the loaded data instead of polling
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return undefined
+    const source = new EventSource(`${API_URL}/api/surveillance/live`)
+    const resync = () => setReloadKey((key) => key + 1)
+
+    source.addEventListener('delta', (event) => {
+      const delta = JSON.parse(event.data)
+      setRegionData((current) => applyRegionDeltas(current, delta.regions))
+      setOrganismData((current) => applyOrganismDeltas(current, delta.organisms))
+      setTrendsData((current) => applyTrendDelta(current, delta.total))
+    })
+    source.addEventListener('resync', resync)
+
+    return () => source.close()
   }, [])
 
   // Handle scroll to anchor on mount
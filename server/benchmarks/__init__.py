@@ -0,0 +1,8 @@
+"""
+Benchmark package for the FastAPI backend.
+
+Each module is a runnable script (`python -m benchmarks.<name>` from the
+`server/` directory) that prints its results as JSON so runs can be
+compared across commits.
+"""
+
@@ -0,0 +1,98 @@
+"""Shared helpers for the benchmark scripts."""
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import os
+import sys
+import tempfile
+
+import httpx
+
+from benchmarks.synthetic import BENCH_DB_NAME
+
+
+# Set while `running_app` has the in-process app started
+_app_running = False
+
+
+def percentiles(samples: List[float]) -> Dict[str, Any]:
+    """Summarise latency samples (seconds) as count and p50/p95/p99/max in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def use_bench_database() -> None:
+    """
+    Point the in-process app at `BENCH_DB_NAME`, with writes that cannot be
+    stored spilled to a temporary file rather than the server's spill file.
+
+    The app's modules read these at import time, so this must run first.
+    """
+    if "main" in sys.modules or "services.database" in sys.modules:
+        raise RuntimeError("use_bench_database() must be called before the app is imported")
+    os.environ["DB_NAME"] = BENCH_DB_NAME
+    spill_dir = tempfile.mkdtemp(prefix="amr-bench-")
+    os.environ["WRITE_SPILL_PATH"] = os.path.join(spill_dir, "pending_writes.jsonl")
+
+
+@asynccontextmanager
+async def running_app(store: str = "mongod", connect_timeout_s: float = 15.0) -> AsyncIterator[None]:
+    """
+    Run the app's lifespan in-process as the server would: open MongoDB
+    (`BENCH_DB_NAME` on `MONGODB_URI`, or an in-memory mongomock database)
+    and start the inference scheduler and write-behind buffer.
+
+    Call `use_bench_database()` before this (and before importing the app).
+    """
+    global _app_running
+    import main as app_module
+    from services.database import mongo
+
+    if os.getenv("DB_NAME") != BENCH_DB_NAME:
+        raise RuntimeError("call use_bench_database() before starting the app in-process")
+    if store == "mongomock":
+        import mongomock
+
+        mongo.attach(mongomock.MongoClient()[BENCH_DB_NAME])
+        app_module.ensure_indexes(mongo.db)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        if not await mongo.wait_connected(timeout=connect_timeout_s):
+            raise SystemExit(f"MongoDB is not reachable at {mongo.uri}; try --store mongomock or --url")
+        _app_running = True
+        try:
+            yield
+        finally:
+            _app_running = False
+
+
+def make_client(url: Optional[str], timeout: float = 60.0) -> httpx.AsyncClient:
+    """
+    HTTP client for a running server at `url`, or for the app in-process
+    (inside `running_app()`, so the database and workers are up).
+
+    The in-process mode shares one event loop between client and server,
+    which is exactly where a blocking handler shows up as tail latency.
+    """
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+    if not _app_running:
+        raise RuntimeError("start the in-process app with running_app() first, or pass a server URL")
+    from main import app
+
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=timeout
+    )
@@ -0,0 +1,113 @@
+"""
+Tail latency of `/api/prediction/run` with and without surveillance load.
+
+Runs the same batch of prediction uploads twice: once alone, and once while
+a pool of clients hammers the `/api/surveillance/*` endpoints with
+long-range, day-granularity queries. With non-blocking database access the
+two p99 figures should stay close.
+
+    python -m benchmarks.concurrency [--url http://localhost:8000]
+
+Without `--url` the app runs in-process against `BENCH_DB_NAME` on
+`MONGODB_URI` (or `--store mongomock`), with its full lifespan, so
+predictions are stored as the server would store them.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks.common import make_client, percentiles, running_app, use_bench_database
+
+
+SURVEILLANCE_PATHS = [
+    "/api/surveillance/regions",
+    "/api/surveillance/organisms",
+    "/api/surveillance/trends?granularity=day&start={start}",
+]
+
+
+async def _predict(client: httpx.AsyncClient, latencies: List[float]) -> None:
+    started = time.perf_counter()
+    response = await client.post(
+        "/api/prediction/run",
+        files={"file": ("bench.csv", b"mz,intensity\n2000.0,1.0\n", "text/csv")},
+        data={"organism": "E. coli", "region": "Punjab"},
+    )
+    response.raise_for_status()
+    latencies.append(time.perf_counter() - started)
+
+
+async def _prediction_load(client: httpx.AsyncClient, total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            await _predict(client, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    return {**percentiles(latencies), "throughput_rps": round(total / elapsed, 1)}
+
+
+async def _surveillance_worker(client: httpx.AsyncClient, stop: asyncio.Event, counter: List[int]) -> None:
+    start = (datetime.utcnow() - timedelta(days=5 * 365)).strftime("%Y-%m-%dT%H:%M:%S")
+    i = 0
+    while not stop.is_set():
+        path = SURVEILLANCE_PATHS[i % len(SURVEILLANCE_PATHS)].format(start=start)
+        await client.get(path)
+        counter[0] += 1
+        i += 1
+
+
+async def run(url: Optional[str], total: int, concurrency: int, surveillance_clients: int) -> Dict[str, Any]:
+    async with make_client(url) as client:
+        baseline = await _prediction_load(client, total, concurrency)
+
+        stop = asyncio.Event()
+        counter = [0]
+        workers = [
+            asyncio.create_task(_surveillance_worker(client, stop, counter))
+            for _ in range(surveillance_clients)
+        ]
+        under_load = await _prediction_load(client, total, concurrency)
+        stop.set()
+        await asyncio.gather(*workers)
+
+    return {
+        "benchmark": "prediction_tail_latency_under_surveillance_load",
+        "target": url or "in-process",
+        "predictions": total,
+        "prediction_concurrency": concurrency,
+        "surveillance_clients": surveillance_clients,
+        "baseline": baseline,
+        "under_surveillance_load": {**under_load, "surveillance_requests": counter[0]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Base URL of a running server (default: in-process app)")
+    parser.add_argument("--store", choices=["mongod", "mongomock"], default="mongod", help="Backing store (in-process only)")
+    parser.add_argument("--requests", type=int, default=200, help="Prediction uploads per phase")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent prediction uploads")
+    parser.add_argument("--surveillance-clients", type=int, default=16, help="Concurrent surveillance pollers")
+    args = parser.parse_args()
+
+    async def main() -> Dict[str, Any]:
+        if args.url:
+            return await run(args.url, args.requests, args.concurrency, args.surveillance_clients)
+        async with running_app(args.store):
+            return await run(None, args.requests, args.concurrency, args.surveillance_clients)
+
+    if args.url is None:
+        use_bench_database()
+    print(json.dumps(asyncio.run(main()), indent=2))
@@ -0,0 +1,98 @@
+"""
+Cold start and per-worker memory of the inference model.
+
+Writes a synthetic model with `save_model` into a temporary directory,
+then starts `--workers` spawned processes that each load it and run one
+warm-up batch, the way the inference pool does on startup. Reports the
+time until every worker is warm and each worker's resident memory, once
+with memory-mapped weights (what the registry does) and once with the
+weights copied into private memory, for comparison.
+
+    python -m benchmarks.model_startup [--workers 4] [--bin-width 0.5] [--antibiotics 64]
+"""
+
+from typing import Any, Dict, List
+
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+
+from services.models import load_model, process_memory, save_model
+from services.preprocessing import PreprocessingConfig
+
+
+def _worker(directory: str, eager: bool, results: Any, release: Any) -> None:
+    started = time.perf_counter()
+    model = load_model(directory)
+    if eager:
+        model.weights = np.array(model.weights)
+        model.bias = np.array(model.bias)
+        if model.species_weights is not None:
+            model.species_weights = np.array(model.species_weights)
+    features = np.zeros((1, model.preprocessing.n_bins), dtype=np.float32)
+    model.predict(features, [None])
+    results.put({"load_ms": round((time.perf_counter() - started) * 1000, 2), **process_memory()})
+    # Stay alive until every worker has reported, so page sharing is measured under load
+    release.wait()
+
+
+def _start_workers(directory: str, workers: int, eager: bool) -> Dict[str, Any]:
+    context = multiprocessing.get_context("spawn")
+    results, release = context.Queue(), context.Event()
+    started = time.perf_counter()
+    processes = [context.Process(target=_worker, args=(directory, eager, results, release)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    reports: List[Dict[str, Any]] = [results.get() for _ in processes]
+    cold_start_ms = round((time.perf_counter() - started) * 1000, 2)
+    release.set()
+    for process in processes:
+        process.join()
+
+    return {
+        "mode": "eager" if eager else "mmap",
+        "cold_start_ms": cold_start_ms,
+        "load_ms_max": max(r["load_ms"] for r in reports),
+        "rss_kb_mean": round(float(np.mean([r.get("rss_kb", 0) for r in reports]))),
+        "rss_anon_kb_mean": round(float(np.mean([r.get("rss_anon_kb", 0) for r in reports]))),
+        "rss_file_kb_mean": round(float(np.mean([r.get("rss_file_kb", 0) for r in reports]))),
+    }
+
+
+def run(workers: int, config: PreprocessingConfig, n_antibiotics: int, n_species: int) -> Dict[str, Any]:
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as root:
+        directory = save_model(
+            root,
+            "bench",
+            weights=rng.normal(size=(config.n_bins, n_antibiotics)),
+            bias=np.zeros(n_antibiotics),
+            antibiotics=[f"antibiotic-{i}" for i in range(n_antibiotics)],
+            preprocessing=config,
+            species=[f"species-{i}" for i in range(n_species)],
+            species_weights=rng.normal(size=(config.n_bins, n_species)) if n_species else None,
+        )
+        weight_mb = 4 * config.n_bins * (n_antibiotics + n_species) / (1024 * 1024)
+        return {
+            "benchmark": "model_startup",
+            "workers": workers,
+            "n_bins": config.n_bins,
+            "weights_mb": round(weight_mb, 1),
+            "results": [_start_workers(directory, workers, eager) for eager in (False, True)],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--bin-width", type=float, default=0.5)
+    parser.add_argument("--antibiotics", type=int, default=64)
+    parser.add_argument("--species", type=int, default=256)
+    args = parser.parse_args()
+
+    config = PreprocessingConfig(bin_width=args.bin_width)
+    print(json.dumps(run(args.workers, config, args.antibiotics, args.species), indent=2))
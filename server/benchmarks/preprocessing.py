@@ -0,0 +1,81 @@
+"""
+Throughput of the spectrum preprocessing pipeline.
+
+Generates synthetic MALDI-TOF-like spectra (Gaussian peaks on a decaying
+baseline with noise) and reports spectra per second for one-at-a-time
+preprocessing and for stacked 2-D batches.
+
+    python -m benchmarks.preprocessing [--spectra 256] [--points 20000]
+"""
+
+from typing import Any, Dict
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from services.preprocessing import PreprocessingConfig, preprocess
+
+
+def synthetic_batch(n_spectra: int, n_points: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """A shared m/z axis and an (n_spectra, n_points) intensity matrix."""
+    rng = np.random.default_rng(seed)
+    mz = np.linspace(1800.0, 20500.0, n_points)
+    baseline = 500.0 * np.exp(-(mz - mz[0]) / 4000.0)
+    centres = rng.uniform(2000.0, 20000.0, size=(n_spectra, 60))
+    heights = rng.uniform(50.0, 2000.0, size=(n_spectra, 60))
+    intensity = np.tile(baseline, (n_spectra, 1)) + rng.normal(0.0, 5.0, size=(n_spectra, n_points))
+    for k in range(centres.shape[1]):
+        intensity += heights[:, k:k + 1] * np.exp(-((mz - centres[:, k:k + 1]) ** 2) / 18.0)
+    return {"mz": mz, "intensity": np.clip(intensity, 0.0, None)}
+
+
+def _rate(n: int, seconds: float) -> float:
+    return round(n / seconds, 1) if seconds > 0 else float("inf")
+
+
+def run(n_spectra: int, n_points: int, batch_size: int, config: PreprocessingConfig) -> Dict[str, Any]:
+    data = synthetic_batch(n_spectra, n_points)
+    mz, intensity = data["mz"], data["intensity"]
+    preprocess(mz, intensity[:2], config)  # warm-up
+
+    started = time.perf_counter()
+    for row in intensity:
+        preprocess(mz, row, config)
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for offset in range(0, n_spectra, batch_size):
+        preprocess(mz, intensity[offset:offset + batch_size], config)
+    batch_seconds = time.perf_counter() - started
+
+    per_row_mz = np.broadcast_to(mz, intensity.shape)
+    started = time.perf_counter()
+    for offset in range(0, n_spectra, batch_size):
+        preprocess(per_row_mz[offset:offset + batch_size], intensity[offset:offset + batch_size], config)
+    per_row_seconds = time.perf_counter() - started
+
+    return {
+        "benchmark": "spectrum_preprocessing",
+        "spectra": n_spectra,
+        "points_per_spectrum": n_points,
+        "n_bins": config.n_bins,
+        "batch_size": batch_size,
+        "single_spectra_per_s": _rate(n_spectra, single_seconds),
+        "batched_shared_axis_spectra_per_s": _rate(n_spectra, batch_seconds),
+        "batched_per_row_axis_spectra_per_s": _rate(n_spectra, per_row_seconds),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spectra", type=int, default=256)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--bin-width", type=float, default=PreprocessingConfig.bin_width)
+    args = parser.parse_args()
+
+    config = PreprocessingConfig(bin_width=args.bin_width)
+    print(json.dumps(run(args.spectra, args.points, args.batch_size, config), indent=2))
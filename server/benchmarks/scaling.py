@@ -0,0 +1,266 @@
+"""
+Endpoint latency as the `predictions` collection grows.
+
+Loads synthetic predictions (`benchmarks.synthetic`) in steps up to each
+requested scale and, at every scale, drives each endpoint with concurrent
+clients, reporting throughput and p50/p95/p99 latency per endpoint:
+
+    python -m benchmarks.scaling --scales 10k,100k,1m --out scaling.json
+
+Data goes into `BENCH_DB_NAME` (default `amr_bench`) on `MONGODB_URI`,
+which is emptied first. Without a reachable mongod, `--store mongomock`
+runs against an in-process stand-in; it is far slower than mongod, lacks
+some aggregation operators (`/trends` needs `$dateTrunc`, so it is skipped)
+and is only useful to check the harness at small scales. With `--url`, start the
+server with `DB_NAME` set to the benchmark database.
+
+Response and prediction caches are disabled for in-process runs unless
+`--cache` is given, so the numbers reflect database work rather than
+cache hits.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+
+import httpx
+
+from benchmarks.common import make_client, percentiles, running_app, use_bench_database
+
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+RequestSpec = Tuple[str, str, Dict[str, Any]]
+
+
+def _parse_scale(value: str) -> int:
+    value = value.strip().lower()
+    if value in SCALES:
+        return SCALES[value]
+    return int(value)
+
+
+def _spectrum(rng: random.Random) -> bytes:
+    """A small random peak list, so every upload misses the prediction cache."""
+    peaks = sorted(rng.sample(range(2000, 20000), 50))
+    return ("mz,intensity\n" + "".join(f"{mz}.0,{rng.uniform(1, 100):.3f}\n" for mz in peaks)).encode()
+
+
+def _records(rng: random.Random) -> RequestSpec:
+    params: Dict[str, Any] = {"limit": 100}
+    if rng.random() < 0.5:
+        params["region"] = rng.choice(["Punjab", "Sindh", "KPK", "Balochistan"])
+    return "GET", "/api/surveillance", {"params": params}
+
+
+def _records_filtered(rng: random.Random) -> RequestSpec:
+    return "GET", "/api/surveillance", {
+        "params": {
+            "limit": 100,
+            "organism": rng.choice(["E. coli", "K. pneumoniae", "A. baumannii"]),
+            "antibiotic": rng.choice(["Meropenem", "Ciprofloxacin", "Gentamicin"]),
+        }
+    }
+
+
+def _regions(rng: random.Random) -> RequestSpec:
+    return "GET", "/api/surveillance/regions", {}
+
+
+def _trends(rng: random.Random) -> RequestSpec:
+    granularity = rng.choice(["day", "week", "month"])
+    params: Dict[str, Any] = {"granularity": granularity}
+    if granularity == "day":
+        params["start"] = (datetime.utcnow() - timedelta(days=90)).strftime("%Y-%m-%dT00:00:00")
+    if rng.random() < 0.5:
+        params["region"] = rng.choice(["Punjab", "Sindh", "KPK"])
+    return "GET", "/api/surveillance/trends", {"params": params}
+
+
+def _organisms(rng: random.Random) -> RequestSpec:
+    return "GET", "/api/surveillance/organisms", {}
+
+
+def _prediction(rng: random.Random) -> RequestSpec:
+    return "POST", "/api/prediction/run", {
+        "files": {"file": ("bench.csv", _spectrum(rng), "text/csv")},
+        "data": {"organism": rng.choice(["E. coli", "K. pneumoniae", "S. aureus"]), "region": "Punjab"},
+    }
+
+
+ENDPOINTS: Dict[str, Callable[[random.Random], RequestSpec]] = {
+    "surveillance_records": _records,
+    "surveillance_records_filtered": _records_filtered,
+    "surveillance_regions": _regions,
+    "surveillance_trends": _trends,
+    "surveillance_organisms": _organisms,
+    "prediction_run": _prediction,
+}
+
+
+async def _drive(
+    client: httpx.AsyncClient,
+    make_request: Callable[[random.Random], RequestSpec],
+    total: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """Send `total` requests from `concurrency` clients; only 2xx responses count towards latency."""
+    rng = random.Random(seed)
+    requests = [make_request(rng) for _ in range(warmup + total)]
+    for method, path, kwargs in requests[:warmup]:
+        await client.request(method, path, **kwargs)
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    pending = iter(requests[warmup:])
+
+    async def worker() -> None:
+        for method, path, kwargs in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = str(response.status_code)
+                # Handlers report database errors in the body with a 200; count those too
+                failed = response.status_code >= 400 or (
+                    response.headers.get("content-type", "").startswith("application/json")
+                    and "error" in str(response.json().get("message", "")).lower()
+                )
+            except httpx.HTTPError as e:
+                status, failed = type(e).__name__, True
+            if failed:
+                errors[status] = errors.get(status, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {**percentiles(latencies), "throughput_rps": round(len(latencies) / elapsed, 1), "errors": errors}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(
+    url: Optional[str],
+    db: Any,
+    rebuild_rollups: bool,
+    scales: List[int],
+    endpoints: List[str],
+    total: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+) -> List[Dict[str, Any]]:
+    from benchmarks.synthetic import SyntheticPredictions, drop, load
+
+    generator = SyntheticPredictions(seed=seed)
+    drop(db)
+    loaded = 0
+    results = []
+    async with make_client(url) as client:
+        for scale in sorted(scales):
+            # Grow the same data set in place; the next scale only adds the difference
+            load_summary = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: load(db, scale - loaded, generator, offset=loaded, rebuild=rebuild_rollups)
+            )
+            loaded = scale
+            step: Dict[str, Any] = {"records": scale, "load": load_summary, "endpoints": {}}
+            for name in endpoints:
+                step["endpoints"][name] = await _drive(client, ENDPOINTS[name], total, concurrency, warmup, seed)
+            results.append(step)
+    return results
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Base URL of a running server (default: in-process app)")
+    parser.add_argument("--store", choices=["mongod", "mongomock"], default="mongod", help="Backing store (in-process only)")
+    parser.add_argument("--scales", default="10k,100k", help="Comma-separated record counts: 10k, 100k, 1m or integers")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated subset of: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint and scale")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per endpoint and scale")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache", action="store_true", help="Keep the response and prediction caches enabled")
+    parser.add_argument("--out", default=None, help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from benchmarks.synthetic import BENCH_DB_NAME
+
+    if args.url is None:
+        use_bench_database()
+        if not args.cache:
+            os.environ["SURVEILLANCE_CACHE_SIZE"] = "0"
+            os.environ["PREDICTION_CACHE_SIZE"] = "0"
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = sorted(set(endpoints) - set(ENDPOINTS))
+    if unknown:
+        parser.error(f"Unknown endpoint(s): {', '.join(unknown)}")
+    if args.url is None and args.store == "mongomock" and "surveillance_trends" in endpoints:
+        # mongomock has no $dateTrunc, so every request would fail
+        endpoints.remove("surveillance_trends")
+        print("⚠️  Skipping surveillance_trends: mongomock does not support $dateTrunc")
+
+    async def main() -> Dict[str, Any]:
+        if args.url is None:
+            from services.database import mongo
+
+            # Open MongoDB and start the scheduler and write-behind buffer as the server would
+            app = running_app(args.store)
+            await app.__aenter__()
+            database = mongo.db
+        else:
+            from pymongo import MongoClient
+
+            database = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))[BENCH_DB_NAME]
+        try:
+            steps = await run(
+                args.url,
+                database,
+                args.store == "mongod",
+                [_parse_scale(scale) for scale in args.scales.split(",") if scale.strip()],
+                endpoints,
+                args.requests,
+                args.concurrency,
+                args.warmup,
+                args.seed,
+            )
+        finally:
+            if args.url is None:
+                await app.__aexit__(None, None, None)
+        return {
+            "benchmark": "endpoint_scaling",
+            "commit": _commit(),
+            "target": args.url or "in-process",
+            "store": args.store if args.url is None else "server",
+            "cache": args.cache or args.url is not None,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "scales": steps,
+        }
+
+    report = json.dumps(asyncio.run(main()), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    print(report)
@@ -0,0 +1,171 @@
+"""
+Encode time and bytes on the wire of typical API payloads, before and after
+orjson responses and compression.
+
+Payloads are built from synthetic predictions, shaped like the responses
+of the endpoints they are named after (no database needed):
+
+- `regions`: /api/surveillance/regions
+- `trends_daily_3y`: /api/surveillance/trends?granularity=day over 3 years
+- `records_page`: a 1000-record page of /api/surveillance
+- `batch_results`: /api/prediction/batch (response model, 256 results)
+- `prescription`: /api/eprescription (response model)
+
+"before" is what FastAPI does by default (`jsonable_encoder`, or the
+response model's JSON-mode dump, then `json.dumps`); "after" is
+`services.responses` (orjson, or pydantic writing JSON directly). Sizes
+are reported uncompressed and with gzip and brotli at the configured
+levels, with the time to compress.
+
+    python -m benchmarks.serialization [--repeat 50] [--records 1000]
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import argparse
+import json
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from benchmarks.synthetic import SyntheticPredictions
+from routers.prediction import BatchPredictionResult, PrescriptionDocument
+from services.compression import brotli, compress
+from services.records import serialise
+from services.regions import regions
+from services.responses import dumps
+
+
+def _regions_payload(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    by_region: Dict[str, Dict[str, Any]] = {}
+    for doc in docs:
+        totals = by_region.setdefault(doc["region"], {"cases": 0, "organisms": set()})
+        totals["cases"] += 1
+        totals["organisms"].add(doc["bacterialSpecies"])
+    entries = []
+    for name, totals in sorted(by_region.items()):
+        province = regions.resolve(name)
+        entries.append({
+            "region": name,
+            "lat": province.lat,
+            "lng": province.lng,
+            "cases": totals["cases"],
+            "avg_resistance_rate": 0.412,
+            "organisms": sorted(totals["organisms"]),
+            "trend": "stable",
+        })
+    return {"regions": entries, "Count": len(entries)}
+
+
+def _trends_payload(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    buckets: Dict[Any, List[float]] = defaultdict(lambda: [0, 0.0])
+    for doc in docs:
+        tested = len(doc["susceptibleAntibiotics"]) + len(doc["resistantAntibiotics"])
+        bucket = buckets[doc["created_at"].date()]
+        bucket[0] += 1
+        bucket[1] += len(doc["resistantAntibiotics"]) / tested if tested else 0.0
+    first = min(buckets)
+    trends = []
+    for index in range((max(buckets) - first).days + 1):
+        day = first + timedelta(days=index)
+        cases, rate_sum = buckets.get(day, (0, 0.0))
+        trends.append({
+            "month": day.strftime("%d %b %Y"),
+            "month_index": index,
+            "resistance_rate": round(rate_sum / cases, 3) if cases else 0.25,
+            "cases": cases,
+            "date": day.strftime("%Y-%m-%d"),
+        })
+    return {"trends": trends, "count": len(trends), "granularity": "day"}
+
+
+def _before(payload: Any, adapter: Optional[TypeAdapter]) -> bytes:
+    if adapter is None:
+        content = jsonable_encoder(payload)
+    else:
+        content = adapter.dump_python(adapter.validate_python(payload, from_attributes=True), mode="json", by_alias=True)
+    # starlette's JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _after(payload: Any, adapter: Optional[TypeAdapter]) -> bytes:
+    if adapter is None:
+        return dumps(payload)
+    return adapter.dump_json(adapter.validate_python(payload, from_attributes=True), by_alias=True)
+
+
+def _median_us(fn: Callable[[], Any], repeat: int) -> float:
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1e6, 1)
+
+
+def run(repeat: int, n_records: int) -> Dict[str, Any]:
+    docs = list(SyntheticPredictions().documents(max(n_records, 20000)))
+    results = [
+        BatchPredictionResult(filename=f"spectrum-{i}.csv", **{
+            field: doc[field]
+            for field in ("bacterialSpecies", "susceptibleAntibiotics", "resistantAntibiotics", "region", "confidence", "patientId")
+        })
+        for i, doc in enumerate(docs[:256])
+    ]
+    prescription = {
+        "_id": docs[0]["_id"],
+        "prescriptionId": "PRES-01J9Z6M2X8K4T5Q7R3W1V0N9BC",
+        "patientId": docs[0]["patientId"],
+        "date": docs[0]["created_at"],
+        "bacterialSpecies": docs[0]["bacterialSpecies"],
+        "region": docs[0]["region"],
+        "antibiotic": "Meropenem",
+        "dosage": "1 g every 8 hours",
+        "duration": "7 days",
+        "instructions": None,
+        "confidence": docs[0]["confidence"],
+        "regionalSusceptibility": 0.871,
+        "regionalIsolates": 412,
+        "created_at": docs[0]["created_at"],
+    }
+    payloads = {
+        "regions": (_regions_payload(docs), None),
+        "trends_daily_3y": (_trends_payload(docs), None),
+        "records_page": ({"data": [serialise(doc) for doc in docs[:n_records]], "count": n_records, "next_cursor": None}, None),
+        "batch_results": (results, List[BatchPredictionResult]),
+        "prescription": (prescription, PrescriptionDocument),
+    }
+
+    report: Dict[str, Any] = {"benchmark": "serialization", "repeat": repeat, "brotli": brotli is not None, "payloads": {}}
+    for name, (payload, model) in payloads.items():
+        # Built once per route in the app, so not part of the timings
+        adapter = TypeAdapter(model) if model is not None else None
+        before, after = _before(payload, adapter), _after(payload, adapter)
+        if json.loads(before) != json.loads(after):
+            raise AssertionError(f"{name}: orjson output differs from the default encoder")
+        entry = {
+            "encode_before_us": _median_us(lambda: _before(payload, adapter), repeat),
+            "encode_after_us": _median_us(lambda: _after(payload, adapter), repeat),
+            "bytes_before": len(before),
+            "bytes_after": len(after),
+        }
+        entry["encode_speedup"] = round(entry["encode_before_us"] / max(entry["encode_after_us"], 0.1), 1)
+        for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+            entry[f"bytes_{encoding}"] = len(compress(after, encoding))
+            entry[f"{encoding}_us"] = _median_us(lambda: compress(after, encoding), repeat)
+        report["payloads"][name] = entry
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--records", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.repeat, args.records), indent=2))
@@ -0,0 +1,194 @@
+"""
+Synthetic prediction history for benchmarks.
+
+Generates documents shaped like the ones `/api/prediction/run` stores:
+canonical regions and districts from the region gazetteer (weighted
+roughly by population), organisms with their own resistance profiles,
+antibiotic lists drawn from the predictor's panels, and `created_at`
+spread over several years with more recent activity and slowly rising
+resistance. Generation is seeded, so the same arguments always produce
+the same data.
+
+    python -m benchmarks.synthetic --count 100000 [--drop]
+
+loads into `BENCH_DB_NAME` (default `amr_bench`) on `MONGODB_URI` and
+updates the surveillance rollups.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+
+from bson import ObjectId
+from pymongo.database import Database
+
+from services.inference import RESISTANT_POOL, SUSCEPTIBLE_POOL
+from services.records import prediction_keys
+from services.regions import regions
+from services.rollups import ROLLUP_COLLECTION, ensure_rollup_indexes, rebuild_rollups, record_predictions
+
+
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME", "amr_bench")
+
+# Share of samples per province
+PROVINCE_WEIGHTS = {
+    "punjab": 0.50,
+    "sindh": 0.23,
+    "kpk": 0.15,
+    "balochistan": 0.06,
+    "islamabad": 0.03,
+    "azad kashmir": 0.02,
+    "gilgit-baltistan": 0.01,
+}
+
+# Organism -> (share of samples, baseline probability that a tested antibiotic is resistant)
+ORGANISM_PROFILES = {
+    "E. coli": (0.38, 0.30),
+    "K. pneumoniae": (0.22, 0.42),
+    "S. aureus": (0.18, 0.25),
+    "P. aeruginosa": (0.12, 0.38),
+    "A. baumannii": (0.10, 0.60),
+}
+
+ANTIBIOTICS = SUSCEPTIBLE_POOL + RESISTANT_POOL
+
+# Collections written by `load`, dropped by `drop`
+COLLECTIONS = ("predictions", ROLLUP_COLLECTION, "prediction_cache")
+
+
+class SyntheticPredictions:
+    """Deterministic generator of prediction documents over `years` ending at `end`."""
+
+    def __init__(self, seed: int = 42, years: float = 3.0, end: Optional[datetime] = None):
+        self.seed = seed
+        self.span = timedelta(days=365 * years)
+        self.end = end or datetime.utcnow().replace(microsecond=0)
+        self._places = []
+        for province_id, weight in PROVINCE_WEIGHTS.items():
+            province = regions.regions[province_id]
+            districts = [r for r in regions.regions.values() if r.parent == province_id]
+            # Half of a province's samples carry a district, split evenly
+            self._places.append((province, None, weight / 2 if districts else weight))
+            for district in districts:
+                self._places.append((province, district, weight / 2 / len(districts)))
+        self._place_weights = [w for _, _, w in self._places]
+        self._organisms = list(ORGANISM_PROFILES)
+        self._organism_weights = [ORGANISM_PROFILES[o][0] for o in self._organisms]
+
+    def documents(self, count: int, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """`count` documents; chunks with different `offset`s are distinct and spread over the whole span."""
+        rng = random.Random(f"{self.seed}:{offset}")
+        for _ in range(count):
+            yield self._document(rng)
+
+    def _document(self, rng: random.Random) -> Dict[str, Any]:
+        # sqrt skews samples towards the end of the span: activity grows over time
+        age = 1.0 - rng.random() ** 0.5
+        created_at = self.end - timedelta(seconds=age * self.span.total_seconds())
+        province, district, _ = rng.choices(self._places, weights=self._place_weights)[0]
+        organism = rng.choices(self._organisms, weights=self._organism_weights)[0]
+
+        # Resistance creeps up by ~5 points over the span and varies by province
+        base = ORGANISM_PROFILES[organism][1]
+        regional = (zlib.crc32(province.id.encode()) % 7 - 3) / 100
+        p_resistant = min(0.95, max(0.02, base + regional + 0.05 * (1.0 - age)))
+        tested = rng.sample(ANTIBIOTICS, k=rng.randint(4, 10))
+        resistant = [a for a in tested if rng.random() < p_resistant]
+        susceptible = [a for a in tested if a not in resistant]
+
+        place = district or province
+        doc = {
+            "_id": ObjectId(),
+            "bacterialSpecies": organism,
+            "susceptibleAntibiotics": susceptible,
+            "resistantAntibiotics": resistant,
+            "region": province.name,
+            "confidence": round(rng.uniform(70.0, 99.0), 1),
+            "patientId": f"PAT-{rng.randint(10000, 99999)}",
+            "organism_input": organism,
+            "patientAge": rng.randint(0, 90),
+            "patientGender": rng.choice(["Male", "Female"]),
+            "region_input": place.name,
+            "district": district.name if district else None,
+            "region_id": place.id,
+            "location": None,
+            "filename": "synthetic.csv",
+            "spectrum_format": "csv",
+            "spectrum_points": rng.randint(200, 20000),
+            "spectrum_sha256": None,
+            "model_version": "mock-0",
+            "created_at": created_at,
+        }
+        doc.update(prediction_keys(doc))
+        return doc
+
+
+def drop(db: Database) -> None:
+    for name in COLLECTIONS:
+        db.drop_collection(name)
+
+
+def load(
+    db: Database,
+    count: int,
+    generator: Optional[SyntheticPredictions] = None,
+    offset: int = 0,
+    batch_size: int = 10000,
+    rebuild: bool = True,
+) -> Dict[str, Any]:
+    """
+    Insert `count` synthetic predictions in unordered batches and update the rollups.
+
+    With `rebuild` the rollups are recomputed in one aggregation afterwards
+    (needs a real mongod); otherwise each batch is added incrementally.
+    `offset` continues an earlier load with new, distinct documents.
+    Returns the counts and timings.
+    """
+    generator = generator or SyntheticPredictions()
+    ensure_rollup_indexes(db)
+    started = time.perf_counter()
+    inserted = 0
+    while inserted < count:
+        size = min(batch_size, count - inserted)
+        docs: List[Dict[str, Any]] = list(generator.documents(size, offset=offset + inserted))
+        db.predictions.insert_many(docs, ordered=False)
+        if not rebuild:
+            record_predictions(db, docs)
+        inserted += size
+    insert_s = time.perf_counter() - started
+    if rebuild:
+        rebuild_rollups(db)
+    return {
+        "inserted": inserted,
+        "insert_s": round(insert_s, 2),
+        "rollups_s": round(time.perf_counter() - started - insert_s, 2),
+        "docs_per_s": round(inserted / insert_s, 1) if insert_s > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000, help="Predictions to generate")
+    parser.add_argument("--years", type=float, default=3.0, help="Span of created_at, ending now")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help=f"Drop {', '.join(COLLECTIONS)} first")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    database = client[BENCH_DB_NAME]
+    if args.drop:
+        drop(database)
+    existing = database.predictions.estimated_document_count()
+    summary = load(database, args.count, SyntheticPredictions(args.seed, args.years), offset=existing)
+    print(json.dumps({"database": BENCH_DB_NAME, **summary, "total": existing + args.count}, indent=2))
+    client.close()
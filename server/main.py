@@ -1,25 +1,107 @@
-from typing import Any, Dict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
 
+import asyncio
+import logging
 import os
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure, ServerSelectionTimeoutError
+from fastapi.responses import Response
+from pymongo import ASCENDING, DESCENDING
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
 
+from routers.models import router as models_router
 from routers.prediction import router as prediction_router
 from routers.surveillance import router as surveillance_router
+from services.antibiogram import (
+    ANTIBIOGRAM_REFRESH_S,
+    antibiogram,
+    backfill_antibiogram_if_empty,
+    ensure_antibiogram_indexes,
+    record_antibiogram,
+    watch_antibiogram,
+)
+from services.compression import CompressionMiddleware
+from services.database import mongo, run_write, shutdown_executors
+from services.ingest import ensure_ingest_indexes
+from services.live_feed import LIVE_FEED_CHANGE_STREAM, live_feed
+from services.log import configure_logging, stop_logging
+from services.metrics import MetricsMiddleware, render as render_metrics
+from services.models import registry
+from services.outbreaks import (
+    ALERTS_COLLECTION,
+    OUTBREAK_BOOTSTRAP_DAYS,
+    OUTBREAK_CHECKPOINT_S,
+    checkpoint_periodically,
+    ensure_outbreak_indexes,
+    outbreaks,
+)
+from services.prediction_cache import ensure_cache_indexes
+from services.records import backfill_search_keys, organism_keys, prediction_keys
+from services.response_cache import surveillance_cache
+from services.responses import OrjsonResponse, OrjsonRoute
+from services.rollups import ROLLUP_COLLECTION, backfill_if_empty, ensure_rollup_indexes, record_predictions
+from services.scheduler import activate_model, scheduler, watch_model_directory
+from services.write_buffer import WRITE_RECONCILE_S, reconcile_periodically, write_buffer
 
 
 # Load environment variables
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Open the MongoDB client and start the background workers; on shutdown,
+    let in-flight work finish before the process exits.
+
+    Nothing here waits for MongoDB: the client connects in the background
+    and indexes are prepared once the first ping succeeds.
+    """
+    # Queued logging again if an earlier lifespan in this process stopped it
+    configure_logging()
+    mongo.open()
+    background_tasks.append(asyncio.create_task(mongo.monitor(on_connect=prepare_database, on_reconnect=replay_writes)))
+    background_tasks.append(asyncio.create_task(live_feed.run()))
+    background_tasks.append(asyncio.create_task(watch_antibiogram(ANTIBIOGRAM_REFRESH_S, lambda: mongo.read_db)))
+    background_tasks.append(asyncio.create_task(checkpoint_periodically(OUTBREAK_CHECKPOINT_S, lambda: mongo.db)))
+    background_tasks.append(asyncio.create_task(reconcile_periodically(WRITE_RECONCILE_S, lambda: mongo.db)))
+    start_inference_scheduler()
+    start_write_buffer()
+    try:
+        yield
+    finally:
+        await stop_background_workers()
+        mongo.close()
+
 
 app = FastAPI(
     title="AMR Prediction & Surveillance API",
     description="API for Antimicrobial Resistance prediction and surveillance",
     version="0.2.0",
+    lifespan=lifespan,
+    default_response_class=OrjsonResponse,
 )
+# Routes declared on the app below skip jsonable_encoder too
+app.router.route_class = OrjsonRoute
+
+
+# Reject oversized request bodies from their Content-Length before any of
+# the body is read; individual uploads are also capped while streaming.
+MAX_REQUEST_BYTES = int(float(os.getenv("MAX_REQUEST_MB", "128")) * 1024 * 1024)
+
+
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return OrjsonResponse(status_code=413, content={"detail": "Request body too large"})
+    return await call_next(request)
 
 
 # CORS middleware
@@ -34,33 +116,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresses large JSON/CSV/NDJSON bodies for clients sending Accept-Encoding (br or gzip)
+app.add_middleware(CompressionMiddleware)
+
+# Outermost, so the latency histograms include the other middleware
+app.add_middleware(MetricsMiddleware)
+
+
+def ensure_indexes(database) -> None:
+    """
+    Create the indexes used by the surveillance aggregations, patient and prescription lookups,
+    the prediction cache, bulk ingest, the antibiogram rollups and outbreak alerts.
+
+    `create_index` is idempotent, so this is safe to run on every startup.
+    """
+    database.predictions.create_index(
+        [("region", ASCENDING), ("created_at", DESCENDING)], name="region_created_at"
+    )
+    # District filters match the gazetteer id stored at write time
+    database.predictions.create_index(
+        [("region_id", ASCENDING), ("created_at", DESCENDING)], name="region_id_created_at"
+    )
+    database.predictions.create_index([("created_at", DESCENDING)], name="created_at")
+    # Keyset pagination of raw records sorts on (created_at, _id)
+    database.predictions.create_index([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id")
+    database.predictions.create_index([("bacterialSpecies", ASCENDING)], name="bacterialSpecies")
+    # Organism and antibiotic filters match the lower-cased names stored at write time
+    database.predictions.create_index(
+        [("organism_key", ASCENDING), ("created_at", DESCENDING)], name="organism_key_created_at"
+    )
+    database.predictions.create_index(
+        [("antibiotic_keys", ASCENDING), ("created_at", DESCENDING)], name="antibiotic_keys_created_at"
+    )
+    # Incremental analytics exports resume after a (stored_at, _id) watermark
+    database.predictions.create_index([("stored_at", ASCENDING), ("_id", ASCENDING)], name="stored_at_id")
+    # Retries and replays look up documents whose post-write hooks have not run by claim token
+    database.predictions.create_index([("hooks_claim", ASCENDING)], name="hooks_claim", sparse=True)
+    # Patient history pages through predictions and prescriptions newest first
+    for collection in ("predictions", "prescriptions"):
+        database[collection].create_index(
+            [("patientId", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="patientId_created_at_id",
+        )
+    try:
+        database.prescriptions.create_index(
+            [("prescriptionId", ASCENDING)],
+            name="prescriptionId",
+            unique=True,
+        )
+    except OperationFailure as e:
+        # Millisecond-timestamp IDs issued before ULIDs can collide; lookups still work without uniqueness
+        logger.warning("⚠️  Could not create the unique prescriptionId index: %s", e)
+    ensure_rollup_indexes(database)
+    ensure_cache_indexes(database)
+    ensure_ingest_indexes(database)
+    ensure_antibiogram_indexes(database)
+    ensure_outbreak_indexes(database)
+
+
+async def prepare_database(database: Database) -> None:
+    """
+    Create indexes, backfill the rollups and restore the outbreak detector
+    once MongoDB is first reachable.
+    """
+    # The backfills replace the rollup collections with $out; predictions stored meanwhile stay
+    # pending (and out of the rebuild) and are added by their hooks afterwards. Held until a
+    # successful prepare, as a failed one is retried while the rollups may still be empty.
+    write_buffer.pause_hooks()
+    await run_write(ensure_indexes, database)
+    await run_write(add_search_keys, database)
+    await run_write(backfill_if_empty, database)
+    await run_write(backfill_antibiogram_if_empty, database)
+    try:
+        replayed = await run_write(outbreaks.restore, database, OUTBREAK_BOOTSTRAP_DAYS)
+        logger.info("✅ Outbreak detector restored (%d predictions replayed)", replayed)
+    except Exception as e:
+        # Detection continues from new predictions; checkpoints stay off so the saved state is kept
+        logger.warning("⚠️  Could not restore the outbreak detector: %s: %s", type(e).__name__, e)
+    await write_buffer.resume_hooks(database)
+    # Writes spilled while the database was unreachable
+    await write_buffer.replay_spill()
+    if LIVE_FEED_CHANGE_STREAM:
+        background_tasks.append(asyncio.create_task(live_feed.follow_change_stream(database)))
+
+
+def add_search_keys(database: Database) -> None:
+    """Store the organism and antibiotic search keys on documents written before they existed."""
+    for collection, keys in (
+        ("predictions", prediction_keys),
+        (ROLLUP_COLLECTION, organism_keys),
+        (ALERTS_COLLECTION, organism_keys),
+    ):
+        updated = backfill_search_keys(database[collection], keys)
+        if updated:
+            logger.info("✅ Added search keys to %d document(s) in '%s'", updated, collection)
 
-# MongoDB connection (assume a default local URL, override via env if needed)
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-DB_NAME = os.getenv("DB_NAME", "amr_db")
-
-client = None
-db = None
-
-try:
-    # For MongoDB Atlas, ensure connection string is properly formatted
-    # If database name is not in URI, it will be specified when accessing client[DB_NAME]
-    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=10000)
-    db = client[DB_NAME]
-    # Test connection with a simple ping
-    client.admin.command("ping")
-    print(f"✅ Connected to MongoDB successfully (database: {DB_NAME})")
-except (ConnectionFailure, OperationFailure, ServerSelectionTimeoutError) as e:
-    print(f"⚠️  MongoDB connection failed: {type(e).__name__}: {str(e)}")
-    print("⚠️  Running without database - API will still work but data won't be persisted")
-    print("⚠️  Check your MongoDB credentials and IP whitelist settings")
-    client = None
-    db = None
-except Exception as e:
-    print(f"⚠️  Unexpected error connecting to MongoDB: {type(e).__name__}: {str(e)}")
-    print("⚠️  Running without database - API will still work but data won't be persisted")
-    client = None
-    db = None
+
+async def replay_writes(database: Database) -> None:
+    """Write back what was spilled while MongoDB was unreachable, after each reconnect."""
+    await write_buffer.replay_spill()
 
 
 @app.get("/")
@@ -75,26 +229,95 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """
+    Health check endpoint.
+
+    Database connectivity is the state cached by the background ping, so
+    probes never wait on MongoDB.
+    """
+    connection = mongo.stats()
     health_status: Dict[str, Any] = {
-        "status": "healthy",
+        # Degraded once a database that was reachable is lost; running without one is allowed
+        "status": "degraded" if mongo.ever_connected and not mongo.connected else "healthy",
         "message": "Backend is running",
-        "database": "connected" if db is not None else "disconnected",
+        "database": connection["state"],
+        "mongo": connection,
+        "ready": registry.ready,
+        "model": {"version": registry.version, "warmup_ms": registry.warmup_ms},
+        "writes": write_buffer.stats(),
+        "antibiogram": antibiogram.stats(),
+        "live_feed": live_feed.stats(),
+        "outbreaks": outbreaks.stats(),
     }
+    return health_status
 
-    if db is not None:
-        try:
-            client.admin.command("ping")
-            health_status["database"] = "connected"
-        except Exception as e:  # pragma: no cover - defensive
-            health_status["database"] = f"error: {str(e)}"
-            health_status["status"] = "degraded"
 
-    return health_status
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: route latency, MongoDB command timing and prediction stage timing."""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+# Seconds between checks of the model directory for a new CURRENT version (0 disables)
+MODEL_RELOAD_INTERVAL_S = float(os.getenv("MODEL_RELOAD_INTERVAL_S", "30"))
+
+background_tasks: List[asyncio.Task] = []
+
+
+async def load_model_in_background() -> None:
+    try:
+        status = await activate_model(registry.current_version())
+        logger.info("✅ Model %s ready (warm-up %s ms)", status["version"], status["warmup_ms"])
+    except Exception as e:
+        logger.warning("⚠️  Could not load model: %s: %s", type(e).__name__, e)
+        logger.warning("⚠️  Serving the mocked predictor")
+        registry.ready = True
+
+
+def start_inference_scheduler() -> None:
+    """Start the inference workers, then load and warm the model without blocking startup."""
+    scheduler.start()
+    background_tasks.append(asyncio.create_task(load_model_in_background()))
+    if MODEL_RELOAD_INTERVAL_S > 0:
+        background_tasks.append(asyncio.create_task(watch_model_directory(MODEL_RELOAD_INTERVAL_S)))
+
+
+def start_write_buffer() -> None:
+    """
+    Start the write-behind buffer. Stored predictions update the surveillance
+    and antibiogram rollups and the outbreak detector, invalidate the cached
+    surveillance responses and are pushed to live feed clients.
+    """
+    write_buffer.on_flush("predictions", record_predictions)
+    write_buffer.on_flush("predictions", record_antibiogram)
+    # Before the cache bump, so cached /alerts responses include the alerts just raised
+    write_buffer.on_flush("predictions", outbreaks.observe)
+    write_buffer.on_flush("predictions", surveillance_cache.bump)
+    write_buffer.on_flush("predictions", live_feed.publish)
+    write_buffer.start(lambda: mongo.db)
+
+
+async def stop_background_workers() -> None:
+    """Let in-flight inference batches and queued writes finish before the process exits."""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await scheduler.stop()
+    await write_buffer.stop()
+    if mongo.db is not None:
+        try:
+            await run_write(outbreaks.checkpoint, mongo.db)
+        except Exception as e:
+            logger.warning("⚠️  Outbreak detector checkpoint failed: %s: %s", type(e).__name__, e)
+    shutdown_executors()
+    stop_logging()
 
 
 # Include feature routers
 app.include_router(prediction_router)
+app.include_router(models_router)
 app.include_router(surveillance_router)
 
 
@@ -0,0 +1,41 @@
+from typing import Any, Dict
+import multiprocessing
+
+from fastapi import APIRouter, HTTPException
+
+from services.models import process_memory, registry
+from services.responses import OrjsonResponse, OrjsonRoute
+from services.scheduler import activate_model, scheduler
+
+
+router = APIRouter(prefix="/api/models", tags=["Models"], route_class=OrjsonRoute, default_response_class=OrjsonResponse)
+
+
+@router.get("", summary="Served model version, warm-up state and memory use")
+async def get_model_status() -> Dict[str, Any]:
+    """
+    Report the active model version and per-process resident memory.
+
+    Weights are memory-mapped, so they show up under `rss_file_kb` and are
+    shared between the API process and the inference workers.
+    """
+    status = registry.status()
+    status["memory"] = {
+        "api": process_memory(),
+        "inference_workers": [process_memory(p.pid) for p in multiprocessing.active_children()],
+    }
+    status["scheduler_workers"] = scheduler.workers
+    return status
+
+
+@router.post("/reload", summary="Hot-swap to the version named by the model directory")
+async def reload_model() -> Dict[str, Any]:
+    """
+    Re-read `CURRENT` under `MODEL_PATH`, load that version and warm the
+    inference workers on it. Requests already queued finish on the version
+    their features were preprocessed for.
+    """
+    try:
+        return await activate_model(registry.current_version())
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=500, detail=f"Could not load model: {e}")
@@ -1,33 +1,34 @@
 from datetime import datetime
-from typing import List, Optional
-import random
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import itertools
+import json
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from pymongo.database import Database
+from pymongo.errors import PyMongoError
 
+from services.antibiogram import antibiogram
+from services.batches import BatchInputError, BatchItem, iter_batch_items
+from services.database import get_db, run_read
+from services.ids import new_id
+from services.metrics import UPLOAD_BYTES, stage_timer
+from services.models import registry
+from services.prediction_cache import cache_key, prediction_cache, upload_digest
+from services.preprocessing import preprocess, preprocess_spectra
+from services.records import SORT, InvalidCursorError, after_cursor, encode_cursor, prediction_keys, serialise
+from services.regions import canonical_region
+from services.responses import OrjsonResponse, OrjsonRoute
+from services.scheduler import scheduler
+from services.spectra import SpectrumParseError, UploadTooLargeError, read_upload
+from services.write_buffer import write_buffer
 
-def get_db() -> Optional[Database]:
-    """
-    Dependency to provide MongoDB database instance.
-
-    The actual client & db are created in main.py; we import lazily
-    here to avoid circular imports at module import time. We try both
-    'main' (when running from the server directory) and 'server.main'
-    (when imported as a package).
-    """
-    try:
-        from main import db  # type: ignore
-    except Exception:
-        try:
-            from server.main import db  # type: ignore
-        except Exception:
-            db = None
-    return db
 
-
-router = APIRouter(prefix="/api", tags=["Prediction & E-Prescription"])
+router = APIRouter(prefix="/api", tags=["Prediction & E-Prescription"], route_class=OrjsonRoute, default_response_class=OrjsonResponse)
 
 
 class PredictionRequestMeta(BaseModel):
@@ -50,6 +51,12 @@ class PredictionResult(BaseModel):
     patientId: str
 
 
+class BatchPredictionResult(PredictionResult):
+    """One spectrum's result in a batch prediction, tagged with its file name."""
+
+    filename: str
+
+
 class PrescriptionPayload(BaseModel):
     """Payload coming from the E-Prescription page."""
 
@@ -76,6 +83,9 @@ class PrescriptionDocument(BaseModel):
     duration: str
     instructions: Optional[str] = None
     confidence: Optional[float] = None
+    # Share of isolates of this organism susceptible to the antibiotic in the region, from the antibiogram
+    regionalSusceptibility: Optional[float] = None
+    regionalIsolates: Optional[int] = None
 
 
 @router.post(
@@ -89,83 +99,236 @@ async def run_prediction(
     patientAge: Optional[int] = Form(None),
     patientGender: Optional[str] = Form(None),
     region: Optional[str] = Form(None),
+    latitude: Optional[float] = Form(None, ge=-90, le=90),
+    longitude: Optional[float] = Form(None, ge=-180, le=180),
+    patientId: Optional[str] = Form(None, max_length=128),
     db: Optional[Database] = Depends(get_db),
 ):
     """
     Run AMR prediction.
 
-    For now this is a mocked model; it returns structured data matching
-    what the frontend expects. The uploaded file is accepted and can be
-    wired to a real ML model later.
+    The uploaded file is streamed through the spectrum parser (CSV/TSV
+    peak lists, Bruker text exports, mzML), preprocessed into a feature
+    vector and queued on the inference scheduler, which batches it with
+    concurrent requests. Served by the registry's active model version
+    (the mocked predictor when none is installed). Re-uploads of the same
+    file for the same organism and model version are answered from the
+    prediction cache.
+
+    `region` is stored under its canonical gazetteer name; when it is
+    missing or unknown, `latitude`/`longitude` are used to locate it.
+    Without a `patientId`, a new one is issued.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="File is required")
 
-    # TODO: Replace this with real model inference using the uploaded file.
-    # For now, generate a randomized but plausible result using a fixed pool.
-    organism_pool = [
-        "E. coli",
-        "K. pneumoniae",
-        "S. aureus",
-        "P. aeruginosa",
-        "A. baumannii",
-    ]
-    susceptible_pool = [
-        "Amoxicillin",
-        "Amoxicillin-Clavulanate",
-        "Ceftriaxone",
-        "Cefazolin",
-        "Trimethoprim-Sulfamethoxazole",
-        "Azithromycin",
-        "Piperacillin-Tazobactam",
-        "Meropenem",
-        "Imipenem",
-        "Doxycycline",
-    ]
-    resistant_pool = [
-        "Ciprofloxacin",
-        "Levofloxacin",
-        "Gentamicin",
-        "Vancomycin",
-        "Tobramycin",
-    ]
-
-    bacterial_species = organism.strip() if organism else random.choice(organism_pool)
-    susceptible = random.sample(susceptible_pool, k=min(6, len(susceptible_pool)))
-    resistant = random.sample(resistant_pool, k=min(3, len(resistant_pool)))
-    confidence = round(random.uniform(75, 95), 1)
-    patient_id = f"PAT-{random.randint(10000, 99999)}"
-
+    if file.size is not None:
+        UPLOAD_BYTES.observe(file.size)
+    version, config = registry.snapshot()
+    try:
+        with stage_timer("digest"):
+            digest = await run_in_threadpool(upload_digest, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    key = cache_key(digest, version, organism)
+
+    cached = await prediction_cache.get(db, key, version)
+    if cached is None:
+        try:
+            with stage_timer("parse"):
+                spectrum = await run_in_threadpool(read_upload, file)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except SpectrumParseError as e:
+            raise HTTPException(status_code=400, detail=f"Could not read spectrum: {e}")
+
+        with stage_timer("preprocess"):
+            features = await run_in_threadpool(preprocess, spectrum.mz, spectrum.intensity, config)
+        with stage_timer("inference"):
+            prediction = await scheduler.submit(features, organism, version)
+        cached = {
+            "prediction": prediction,
+            "spectrum_format": spectrum.format,
+            "spectrum_points": spectrum.n_points,
+        }
+        await prediction_cache.put(db, key, version, cached)
+
+    location = canonical_region(region, latitude, longitude)
     mock_result = PredictionResult(
-        bacterialSpecies=bacterial_species,
-        susceptibleAntibiotics=susceptible,
-        resistantAntibiotics=resistant,
-        region=region,
-        confidence=confidence,
-        patientId=patient_id,
+        **cached["prediction"],
+        region=location["region"],
+        patientId=patientId or new_id("PAT"),
     )
 
-    if db is not None:
-        try:
-            doc = mock_result.model_dump()
-            doc.update(
-                {
-                    "organism_input": organism,
-                    "patientAge": patientAge,
-                    "patientGender": patientGender,
-                    "region_input": region,
-                    "filename": file.filename,
-                    "created_at": datetime.utcnow(),
-                }
-            )
-            db.predictions.insert_one(doc)
-        except Exception:
-            # Log error but don't break user flow
-            pass
+    doc = mock_result.model_dump()
+    doc.update(
+        {
+            "organism_input": organism,
+            "patientAge": patientAge,
+            "patientGender": patientGender,
+            "region_input": region,
+            "district": location["district"],
+            "region_id": location["region_id"],
+            "location": _point(latitude, longitude),
+            "filename": file.filename,
+            "spectrum_format": cached["spectrum_format"],
+            "spectrum_points": cached["spectrum_points"],
+            "spectrum_sha256": digest,
+            "model_version": version,
+            "created_at": datetime.utcnow(),
+        }
+    )
+    doc.update(prediction_keys(doc))
+    # Persisted by the write-behind buffer (rollups are updated after the insert)
+    await write_buffer.enqueue("predictions", doc)
 
     return mock_result
 
 
+def _point(latitude: Optional[float], longitude: Optional[float]) -> Optional[Dict[str, Any]]:
+    """GeoJSON point for the sample's coordinates, if both were given."""
+    if latitude is None or longitude is None:
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def _item_location(item: BatchItem) -> Dict[str, Any]:
+    return canonical_region(item.meta.get("region"), item.meta.get("latitude"), item.meta.get("longitude"))
+
+
+# Spectra parsed and predicted together per chunk when streaming NDJSON
+STREAM_CHUNK_SIZE = 16
+
+
+async def _predict_items(items: List[BatchItem]) -> Tuple[str, List[BatchPredictionResult]]:
+    """Preprocess and run the model on all parsed items of a batch at once; returns the model version used."""
+    version, config = registry.snapshot()
+    features = await run_in_threadpool(preprocess_spectra, [item.spectrum for item in items], config)
+    predictions = await scheduler.predict_many(features, [item.meta["organism"] for item in items], version)
+    return version, [
+        BatchPredictionResult(
+            **prediction,
+            filename=item.filename,
+            region=_item_location(item)["region"],
+            patientId=item.meta.get("patientId") or new_id("PAT"),
+        )
+        for item, prediction in zip(items, predictions)
+    ]
+
+
+def _prediction_documents(
+    items: List[BatchItem], results: List[BatchPredictionResult], version: str
+) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    docs = []
+    for item, result in zip(items, results):
+        location = _item_location(item)
+        doc = result.model_dump()
+        doc.update(
+            {
+                "organism_input": item.meta.get("organism"),
+                "patientAge": item.meta.get("patientAge"),
+                "patientGender": item.meta.get("patientGender"),
+                "region_input": item.meta.get("region"),
+                "district": location["district"],
+                "region_id": location["region_id"],
+                "location": _point(item.meta.get("latitude"), item.meta.get("longitude")),
+                "spectrum_format": item.spectrum.format,
+                "spectrum_points": item.spectrum.n_points,
+                "spectrum_sha256": item.sha256,
+                "model_version": version,
+                "created_at": now,
+            }
+        )
+        doc.update(prediction_keys(doc))
+        docs.append(doc)
+    return docs
+
+
+@router.post(
+    "/prediction/batch",
+    response_model=List[BatchPredictionResult],
+    summary="Run AMR prediction on a whole plate of spectra",
+)
+async def run_batch_prediction(
+    files: List[UploadFile] = File(None, description="Mass spectrometry data files"),
+    archive: Optional[UploadFile] = File(None, description="Zip archive of spectrum files"),
+    metadata: Optional[UploadFile] = File(None, description="CSV with a filename column plus per-file metadata"),
+    organism: Optional[str] = Form(None),
+    patientAge: Optional[int] = Form(None),
+    patientGender: Optional[str] = Form(None),
+    region: Optional[str] = Form(None),
+    latitude: Optional[float] = Form(None, ge=-90, le=90),
+    longitude: Optional[float] = Form(None, ge=-180, le=180),
+    stream: bool = Query(False, description="Stream results as NDJSON while they complete"),
+):
+    """
+    Run AMR prediction for many spectra in one request.
+
+    Spectra come from `files` and/or a zip `archive`; per-file metadata
+    comes from the `metadata` CSV (or `metadata.csv` inside the archive),
+    with the form fields as defaults. All spectra are preprocessed and
+    predicted as one batch and queued for storage in one go.
+
+    With `stream=true` the response is NDJSON: spectra are processed in
+    chunks and each result (or `{"filename", "error"}` line) is sent as
+    soon as its chunk completes.
+    """
+    defaults = {
+        "organism": organism,
+        "patientAge": patientAge,
+        "patientGender": patientGender,
+        "region": region,
+        "latitude": latitude,
+        "longitude": longitude,
+    }
+    items_iter = iter_batch_items(files or [], archive, metadata, defaults)
+
+    async def next_chunk(size: Optional[int]) -> List[BatchItem]:
+        return await run_in_threadpool(lambda: list(itertools.islice(items_iter, size)))
+
+    try:
+        first_chunk = await next_chunk(None if not stream else STREAM_CHUNK_SIZE)
+    except BatchInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not stream:
+        failed = [{"filename": item.filename, "error": item.error} for item in first_chunk if item.error]
+        if failed:
+            raise HTTPException(status_code=400, detail={"message": "Some spectra could not be read", "files": failed})
+        version, results = await _predict_items(first_chunk)
+        await write_buffer.enqueue_many("predictions", _prediction_documents(first_chunk, results, version))
+        return results
+
+    async def ndjson() -> AsyncIterator[bytes]:
+        chunk = first_chunk
+        while chunk:
+            for item in chunk:
+                if item.error:
+                    yield (json.dumps({"filename": item.filename, "error": item.error}) + "\n").encode()
+            parsed = [item for item in chunk if not item.error]
+            if parsed:
+                version, results = await _predict_items(parsed)
+                await write_buffer.enqueue_many("predictions", _prediction_documents(parsed, results, version))
+                for result in results:
+                    yield (result.model_dump_json() + "\n").encode()
+            chunk = await next_chunk(STREAM_CHUNK_SIZE)
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.get("/prediction/scheduler", summary="Inference micro-batching statistics")
+async def get_scheduler_stats():
+    """Queue depth and batch-size statistics of the inference scheduler."""
+    return scheduler.stats()
+
+
+@router.get("/prediction/cache", summary="Prediction result cache statistics")
+async def get_prediction_cache_stats():
+    """Hit/miss counters of the content-addressed prediction cache."""
+    return prediction_cache.stats()
+
+
 @router.post(
     "/eprescription",
     response_model=PrescriptionDocument,
@@ -173,16 +336,17 @@ async def run_prediction(
 )
 async def create_eprescription(
     payload: PrescriptionPayload,
-    db: Optional[Database] = Depends(get_db),
 ):
     """
     Create an electronic prescription based on prediction results.
 
     The frontend currently generates prescription client-side; this
     endpoint provides a backend implementation that can store and
-    later retrieve prescriptions if desired.
+    later retrieve prescriptions if desired. The prescription carries the
+    regional susceptibility of the chosen antibiotic from the antibiogram,
+    when it has been tested there.
     """
-    prescription_id = f"PRES-{int(datetime.utcnow().timestamp() * 1000)}"
+    prescription_id = new_id("PRES")
     now = datetime.utcnow()
 
     doc = PrescriptionDocument(
@@ -197,14 +361,95 @@ async def create_eprescription(
         instructions=payload.instructions,
         confidence=payload.confidence,
     )
+    regional = antibiogram.cube.susceptibility_of(
+        canonical_region(payload.region)["region"], payload.bacterialSpecies, payload.antibiotic
+    )
+    if regional is not None:
+        doc.regionalSusceptibility = regional["susceptibility"]
+        doc.regionalIsolates = regional["tested"]
 
-    if db is not None:
-        try:
-            db.prescriptions.insert_one(doc.model_dump())
-        except Exception:
-            # Log error but still return generated prescription
-            pass
+    # `created_at` orders prescriptions with predictions in the patient history
+    await write_buffer.enqueue("prescriptions", {**doc.model_dump(), "created_at": now})
+
+    return doc
+
+
+@router.get(
+    "/eprescription/{prescription_id}",
+    response_model=PrescriptionDocument,
+    summary="Retrieve a stored electronic prescription",
+)
+async def get_eprescription(prescription_id: str, db: Optional[Database] = Depends(get_db)):
+    """
+    Look up a prescription by its `prescriptionId` (unique index).
 
+    Prescriptions are stored by the write-behind buffer, so one created
+    within the last `WRITE_FLUSH_INTERVAL_MS` may not be found yet.
+    """
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    try:
+        doc = await run_read(db.prescriptions.find_one, {"prescriptionId": prescription_id})
+    except PyMongoError as e:
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Prescription not found")
     return doc
 
 
+# Entries per page of GET /api/patients/{id}/history
+DEFAULT_HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 500
+
+HISTORY_COLLECTIONS = {"predictions": "prediction", "prescriptions": "prescription"}
+
+
+@router.get("/patients/{patient_id}/history", summary="A patient's predictions and prescriptions")
+async def get_patient_history(
+    patient_id: str,
+    limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE, description="Entries per page"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+    db: Optional[Database] = Depends(get_db),
+):
+    """
+    Predictions and prescriptions of one patient, newest first, each
+    tagged with its `type`.
+
+    Both collections are read with keyset pagination on the
+    (`patientId`, `created_at`, `_id`) indexes and merged; pass
+    `next_cursor` back as `cursor` for the next page.
+    """
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    query: Dict[str, Any] = {"patientId": patient_id}
+    if cursor:
+        try:
+            query = after_cursor(query, cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def page(collection: str) -> List[Dict[str, Any]]:
+        docs = list(db[collection].find(query).sort(SORT).limit(limit + 1))
+        for doc in docs:
+            doc["type"] = HISTORY_COLLECTIONS[collection]
+        return docs
+
+    try:
+        pages = await asyncio.gather(*(run_read(page, collection) for collection in HISTORY_COLLECTIONS))
+    except PyMongoError as e:
+        raise HTTPException(status_code=503, detail=f"Database error: {e}")
+
+    # Same order as SORT; entries without created_at come last
+    entries = sorted(
+        itertools.chain.from_iterable(pages),
+        key=lambda doc: (doc.get("created_at") is not None, doc.get("created_at") or datetime.min, doc["_id"]),
+        reverse=True,
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    return {
+        "patientId": patient_id,
+        "data": [serialise(doc) for doc in entries],
+        "count": len(entries),
+        "next_cursor": encode_cursor(entries[-1]) if has_more else None,
+    }
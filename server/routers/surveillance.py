@@ -1,279 +1,690 @@
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple
+import asyncio
+import itertools
+import logging
+import tempfile
+import time
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pymongo.database import Database
+from pymongo.errors import PyMongoError
+from starlette.concurrency import run_in_threadpool
 
+from services.analytics_export import SORT as EXPORT_SORT, ArrowStream
+from services.antibiogram import antibiogram
+from services.database import get_db, get_read_db, run_read, run_write
+from services.ingest import (
+    INGEST_BATCH_SIZE,
+    MAX_INGEST_BYTES,
+    MAX_REPORTED_ERRORS,
+    IngestInputError,
+    iter_rows,
+    validate_batch,
+    write_batch,
+)
+from services.live_feed import FeedFullError, live_feed
+from services.outbreaks import ALERTS_COLLECTION, outbreaks
+from services.records import (
+    SORT,
+    InvalidCursorError,
+    after_cursor,
+    encode_cursor,
+    prediction_filter,
+    search_key,
+    serialise,
+    take,
+    to_csv,
+    to_ndjson,
+)
+from services.regions import canonical_region, regions
+from services.response_cache import surveillance_cache
+from services.responses import OrjsonResponse, OrjsonRoute
+from services.rollups import ROLLUP_COLLECTION, region_key
+from services.write_buffer import write_buffer
 
-def get_db() -> Optional[Database]:
+
+router = APIRouter(prefix="/api/surveillance", tags=["Surveillance"], route_class=OrjsonRoute, default_response_class=OrjsonResponse)
+
+logger = logging.getLogger(__name__)
+
+
+Granularity = Literal["day", "week", "month"]
+
+AlertStatus = Literal["active", "resolved", "all"]
+
+AlertMetric = Literal["cases", "resistance", "antibiotic"]
+
+# Number of buckets returned by /trends when no `start` is given
+DEFAULT_TREND_BUCKETS = 12
+
+# Most buckets one /trends response may hold (10 years of days)
+MAX_TREND_BUCKETS = 3660
+
+# (chart label, `date` field) strftime formats per granularity
+TREND_LABEL_FORMATS: Dict[str, Tuple[str, str]] = {
+    "day": ("%d %b %Y", "%Y-%m-%d"),
+    "week": ("%d %b %Y", "%Y-%m-%d"),
+    "month": ("%b %Y", "%Y-%m"),
+}
+
+
+def _date_trunc_spec(date_expr: Any, granularity: str) -> Dict[str, Any]:
+    """`$dateTrunc` arguments for a bucket of the given granularity (weeks start on Monday)."""
+    spec: Dict[str, Any] = {"date": date_expr, "unit": granularity}
+    if granularity == "week":
+        spec["startOfWeek"] = "monday"
+    return spec
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    """Convert a query datetime to the naive UTC form pymongo stores and returns."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _truncate_date(value: datetime, granularity: str) -> datetime:
+    """Python counterpart of `$dateTrunc` for the start of the bucket containing `value`."""
+    day = datetime(value.year, value.month, value.day)
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _shift_bucket(bucket_start: datetime, granularity: str, count: int) -> datetime:
+    """Move a truncated bucket start by `count` buckets (may be negative)."""
+    if granularity == "month":
+        month_index = bucket_start.year * 12 + bucket_start.month - 1 + count
+        return bucket_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+    if granularity == "week":
+        return bucket_start + timedelta(weeks=count)
+    return bucket_start + timedelta(days=count)
+
+
+def _bucket_count(first_bucket: datetime, end: datetime, granularity: str) -> int:
+    """Number of buckets starting at `first_bucket` and before `end`, without building their dates."""
+    last_bucket = _truncate_date(end, granularity)
+    if granularity == "month":
+        count = (last_bucket.year - first_bucket.year) * 12 + last_bucket.month - first_bucket.month
+    elif granularity == "week":
+        count = (last_bucket - first_bucket).days // 7
+    else:
+        count = (last_bucket - first_bucket).days
+    return count + (1 if end > last_bucket else 0)
+
+
+def _region_summary_pipeline(now: datetime) -> List[Dict[str, Any]]:
     """
-    Return the MongoDB database handle from the main application module.
+    Pipeline grouping the surveillance rollups per (lower-cased) region.
 
-    Works both when running `python main.py` from the `server/` directory
-    and when the app is imported as a package.
+    Each output document carries the case count, average resistance rate,
+    the set of organisms seen and the case counts for the last 30 days and
+    the 30 days before that. Windows are resolved at day granularity.
     """
-    try:
-        from main import db  # type: ignore
-    except Exception:
-        try:
-            from server.main import db  # type: ignore
-        except Exception:
-            db = None
-    return db
+    today = datetime(now.year, now.month, now.day)
+    recent_start = today - timedelta(days=30)
+    older_start = today - timedelta(days=60)
+    return [
+        {"$match": {"region": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": "$region",
+                "cases": {"$sum": "$cases"},
+                "rated_cases": {"$sum": "$rated_cases"},
+                "resistance_rate_sum": {"$sum": "$resistance_rate_sum"},
+                "organisms": {"$addToSet": "$organism"},
+                "recent_count": {
+                    "$sum": {"$cond": [{"$gte": ["$day", recent_start]}, "$cases", 0]}
+                },
+                "older_count": {
+                    "$sum": {
+                        "$cond": [
+                            {
+                                "$and": [
+                                    {"$gte": ["$day", older_start]},
+                                    {"$lt": ["$day", recent_start]},
+                                ]
+                            },
+                            "$cases",
+                            0,
+                        ]
+                    }
+                },
+            }
+        },
+        {"$sort": {"_id": 1}},
+    ]
 
 
-router = APIRouter(prefix="/api/surveillance", tags=["Surveillance"])
+def get_cached_read_db() -> Optional[Database]:
+    """
+    Database for the cached surveillance endpoints: the primary while the
+    response cache is on, since a fill right after a bump could otherwise
+    read a lagging secondary and serve that state for the whole TTL.
+    """
+    return get_db() if surveillance_cache.max_entries else get_read_db()
 
 
-@router.get("", summary="Get raw surveillance records (if available)")
-async def get_surveillance_data(db: Optional[Database] = Depends(get_db)):
-    """Return basic surveillance documents from the database, if configured."""
+# Records per page of GET /api/surveillance, and per cursor batch when exporting
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+
+@router.get("", summary="Page through or export raw prediction records")
+async def get_surveillance_data(
+    region: Optional[str] = Query(None, description="Only include this region"),
+    organism: Optional[str] = Query(None, description="Only include this bacterial species"),
+    antibiotic: Optional[str] = Query(None, description="Only include records that tested this antibiotic"),
+    start: Optional[datetime] = Query(None, description="Created at or after"),
+    end: Optional[datetime] = Query(None, description="Created before"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Records per page"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+    format: Literal["json", "ndjson", "csv"] = Query("json", description="`ndjson`/`csv` stream every matching record"),
+    db: Optional[Database] = Depends(get_read_db),
+):
+    """
+    Return prediction records, newest first.
+
+    JSON responses are pages of `limit` records; pass `next_cursor` back as
+    `cursor` for the next page (keyset pagination on `created_at`/`_id`, so
+    deep pages cost the same as the first). With `format=ndjson` or
+    `format=csv` all matching records are streamed straight from the
+    MongoDB cursor in batches, in constant memory.
+    """
     if db is None:
         return {"data": [], "message": "Database not connected"}
 
+    query = prediction_filter(
+        region=region,
+        organism=organism,
+        antibiotic=antibiotic,
+        start=_as_naive_utc(start) if start else None,
+        end=_as_naive_utc(end) if end else None,
+    )
+    if cursor:
+        try:
+            query = after_cursor(query, cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if format != "json":
+        return _export_response(db, query, format)
+
     try:
-        data: List[Dict[str, Any]] = list(
-            db.surveillance.find({}, {"_id": 0}).limit(10)
+        docs: List[Dict[str, Any]] = await run_read(
+            lambda: list(db.predictions.find(query).sort(SORT).limit(limit + 1))
         )
-        return {"data": data, "count": len(data)}
     except Exception as e:
         return {"data": [], "message": f"Database error: {str(e)}"}
 
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "data": [serialise(doc) for doc in docs],
+        "count": len(docs),
+        "next_cursor": encode_cursor(docs[-1]) if has_more else None,
+    }
 
-@router.get("/regions", summary="Get regional surveillance data")
-async def get_surveillance_regions(db: Optional[Database] = Depends(get_db)):
-    """Get surveillance data by regions with geographic coordinates from database."""
+
+def _export_response(db: Database, query: Dict[str, Any], format: str) -> StreamingResponse:
+    """Stream every record matching `query` as NDJSON or CSV."""
+    cursor = db.predictions.find(query).sort(SORT).batch_size(EXPORT_BATCH_SIZE)
+
+    async def body() -> AsyncIterator[bytes]:
+        header = True
+        try:
+            while True:
+                records = await run_read(take, cursor, EXPORT_BATCH_SIZE)
+                if format == "csv" and header:
+                    yield to_csv(records, header=True)
+                    header = False
+                elif records:
+                    yield to_csv(records, header=False) if format == "csv" else to_ndjson(records)
+                if len(records) < EXPORT_BATCH_SIZE:
+                    break
+        finally:
+            cursor.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"predictions-{datetime.utcnow():%Y%m%dT%H%M%SZ}.{format}"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/export/arrow", summary="Stream prediction history as an Arrow IPC stream")
+async def export_arrow(
+    table: Literal["predictions", "antibiotic_results"] = Query(
+        "predictions", description="`antibiotic_results` has one row per (prediction, antibiotic)"
+    ),
+    region: Optional[str] = Query(None, description="Only include this region"),
+    organism: Optional[str] = Query(None, description="Only include this bacterial species"),
+    antibiotic: Optional[str] = Query(None, description="Only include records that tested this antibiotic"),
+    start: Optional[datetime] = Query(None, description="Created at or after"),
+    end: Optional[datetime] = Query(None, description="Created before"),
+    db: Optional[Database] = Depends(get_read_db),
+):
+    """
+    Columnar export for analysis tools (`pyarrow.ipc.open_stream`,
+    `pandas`, `polars`), oldest first, one record batch per cursor chunk
+    with dictionary-encoded labels. For partitioned Parquet files and
+    incremental exports use `python -m services.analytics_export`.
+    """
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    query = prediction_filter(
+        region=region,
+        organism=organism,
+        antibiotic=antibiotic,
+        start=_as_naive_utc(start) if start else None,
+        end=_as_naive_utc(end) if end else None,
+    )
+    cursor = db.predictions.find(query).sort(EXPORT_SORT).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        stream = ArrowStream(cursor, table)
+    except RuntimeError as e:
+        cursor.close()
+        raise HTTPException(status_code=501, detail=str(e))
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                data = await run_read(stream.next_bytes)
+                if not data:
+                    break
+                yield data
+        finally:
+            cursor.close()
+
+    filename = f"{table}-{datetime.utcnow():%Y%m%dT%H%M%SZ}.arrows"
+    return StreamingResponse(
+        body(),
+        media_type="application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Ingest bodies are kept in memory up to this size, then spooled to disk
+INGEST_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+@router.post("/ingest", summary="Bulk-ingest AST results from lab systems (NDJSON or CSV)")
+async def ingest_results(
+    request: Request,
+    source: str = Query("default", min_length=1, max_length=64, description="Sending system; `recordId` is unique per source"),
+    format: Optional[Literal["ndjson", "csv"]] = Query(None, description="Body format (default: from Content-Type)"),
+    db: Optional[Database] = Depends(get_db),
+):
+    """
+    Store antimicrobial susceptibility test results pushed by a LIS.
+
+    The body is NDJSON or CSV with one result per line (see
+    `services/ingest.py` for the fields). Records are validated and written
+    in batches; invalid records are reported by line and skipped, and
+    records whose `recordId` this source already sent count as duplicates,
+    so a failed upload can simply be retried. Stored results feed the
+    surveillance rollups like uploaded predictions.
+    """
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+
+    started = time.perf_counter()
+    body = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_INGEST_BYTES:
+                raise HTTPException(status_code=413, detail="Request body too large")
+            body.write(chunk)
+        body.seek(0)
+
+        rows = iter_rows(body, fmt)
+        now = datetime.utcnow()
+        summary: Dict[str, Any] = {"source": source, "format": fmt, "received": 0, "inserted": 0, "duplicates": 0, "rejected": 0}
+        errors: List[Dict[str, Any]] = []
+
+        async def store(valid: List[Tuple[int, Dict[str, Any]]]) -> None:
+            write_buffer.track("predictions", [doc for _, doc in valid])
+            result = await run_write(write_batch, db, valid)
+            summary["inserted"] += len(result["stored"])
+            summary["duplicates"] += len(result["duplicates"])
+            summary["rejected"] += len(result["errors"])
+            errors.extend(result["errors"])
+            # Rollups, cache invalidation and other listeners, as for uploaded predictions
+            await write_buffer.run_hooks(db, "predictions", result["stored"])
+
+        def next_batch() -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]], int]:
+            batch = list(itertools.islice(rows, INGEST_BATCH_SIZE))
+            return (*validate_batch(batch, source, now), len(batch))
+
+        writing: Optional[asyncio.Task] = None
+        try:
+            while True:
+                try:
+                    # Parse and validate the next batch while the previous one is written
+                    valid, invalid, count = await run_in_threadpool(next_batch)
+                except IngestInputError as e:
+                    if summary["received"] == 0:
+                        raise HTTPException(status_code=400, detail=str(e))
+                    summary["error"] = f"Stopped after {summary['received']} records: {e}"
+                    break
+                if writing is not None:
+                    await writing
+                    writing = None
+                if count == 0:
+                    break
+                summary["received"] += count
+                summary["rejected"] += len(invalid)
+                errors.extend(invalid)
+                if valid:
+                    writing = asyncio.ensure_future(store(valid))
+        finally:
+            if writing is not None:
+                await writing
+    except PyMongoError as e:
+        # Stored batches stay stored; retrying the whole body only adds what is missing
+        raise HTTPException(status_code=503, detail=f"Database error: {str(e)}")
+    finally:
+        body.close()
+
+    elapsed = time.perf_counter() - started
+    errors.sort(key=lambda report: report["line"])
+    summary.update({
+        "errors": errors[:MAX_REPORTED_ERRORS],
+        "errors_truncated": len(errors) > MAX_REPORTED_ERRORS,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "records_per_s": round(summary["received"] / elapsed, 1) if elapsed > 0 else None,
+    })
+    return summary
+
+
+async def _regions_payload(db: Database) -> Dict[str, Any]:
+    """Regions with coordinates, case counts, resistance rate and 30-day trend."""
+    region_groups = await run_read(
+        lambda: list(db[ROLLUP_COLLECTION].aggregate(_region_summary_pipeline(datetime.utcnow())))
+    )
     
-    # Region coordinates mapping (static geographic data) - case-insensitive lookup
-    region_coords_map = {
-        "punjab": {"lat": 31.5204, "lng": 74.3587},
-        "sindh": {"lat": 24.8607, "lng": 67.0011},
-        "kpk": {"lat": 34.0151, "lng": 71.5249},
-        "khyber pakhtunkhwa": {"lat": 34.0151, "lng": 71.5249},
-        "balochistan": {"lat": 30.1798, "lng": 66.975},
-        "gilgit-baltistan": {"lat": 35.8028, "lng": 74.4667},
-        "azad kashmir": {"lat": 33.7782, "lng": 73.8472},
-    }
+    if not region_groups and await run_read(db.predictions.estimated_document_count) == 0:
+        return {"regions": [], "Count": 0, "message": "No predictions found in database"}
     
-    # Display names mapping
-    region_display_names = {
-        "punjab": "Punjab",
-        "sindh": "Sindh",
-        "kpk": "KPK",
-        "khyber pakhtunkhwa": "KPK",
-        "balochistan": "Balochistan",
-        "gilgit-baltistan": "Gilgit-Baltistan",
-        "azad kashmir": "Azad Kashmir",
-    }
+    logger.debug("Found %d unique regions", len(region_groups))
     
+    # Predictions are stored under canonical province names; resolving the
+    # keys again folds in rows written before canonicalisation (e.g. "kp")
+    provinces: Dict[str, Dict[str, Any]] = {}
+    for region_info in region_groups:
+        match = regions.resolve(region_info["_id"])
+        if match is None:
+            # Skip regions without coordinates
+            logger.debug("Skipping region %r - not in the region gazetteer", region_info["_id"])
+            continue
+        province = regions.province(match)
+        totals = provinces.setdefault(province.id, {
+            "province": province,
+            "cases": 0,
+            "rated_cases": 0,
+            "resistance_rate_sum": 0.0,
+            "organisms": set(),
+            "recent_count": 0,
+            "older_count": 0,
+        })
+        for field in ("cases", "rated_cases", "resistance_rate_sum", "recent_count", "older_count"):
+            totals[field] += region_info[field]
+        totals["organisms"].update(o for o in region_info["organisms"] if o)
+    
+    regions_with_trends = []
+    for totals in sorted(provinces.values(), key=lambda t: t["province"].id):
+        province = totals["province"]
+        rated_cases = totals["rated_cases"]
+        avg_resistance_rate = (
+            totals["resistance_rate_sum"] / rated_cases if rated_cases > 0 else 0.25
+        )
+        
+        # Calculate trend (compare last 30 days vs previous 30 days)
+        recent_count = totals["recent_count"]
+        older_count = totals["older_count"]
+        
+        if older_count == 0:
+            trend = "stable"
+        elif recent_count > older_count * 1.1:
+            trend = "increasing"
+        elif recent_count < older_count * 0.9:
+            trend = "decreasing"
+        else:
+            trend = "stable"
+        
+        regions_with_trends.append({
+            "region": province.name,
+            "lat": province.lat,
+            "lng": province.lng,
+            "cases": totals["cases"],
+            "avg_resistance_rate": round(avg_resistance_rate, 3),
+            # The sums behind the rate, so clients can fold live-feed deltas in exactly
+            "rated_cases": rated_cases,
+            "resistance_rate_sum": round(totals["resistance_rate_sum"], 6),
+            "organisms": sorted(totals["organisms"]),
+            "trend": trend,
+        })
+    
+    if regions_with_trends:
+        logger.debug("Returning %d regions with data", len(regions_with_trends))
+        return {"regions": regions_with_trends, "Count": len(regions_with_trends)}
+    return {"regions": [], "Count": 0, "message": "No region data available"}
+
+
+@router.get("/regions", summary="Get regional surveillance data")
+async def get_surveillance_regions(request: Request, db: Optional[Database] = Depends(get_cached_read_db)):
+    """
+    Get surveillance data by regions with geographic coordinates from the surveillance rollups.
+
+    Served from the surveillance response cache (with `ETag`) until new
+    predictions arrive.
+    """
     if db is not None:
         try:
-            # First, check if we have any predictions at all
-            total_predictions = db.predictions.count_documents({})
-            print(f"Total predictions in database: {total_predictions}")
-            
-            if total_predictions == 0:
-                return {"regions": [], "Count": 0, "message": "No predictions found in database"}
-            
-            # Get all unique regions from predictions (case-insensitive)
-            all_predictions = list(db.predictions.find({}, {"region": 1, "bacterialSpecies": 1, "susceptibleAntibiotics": 1, "resistantAntibiotics": 1, "created_at": 1}))
-            
-            # Group by region (normalize to lowercase for matching)
-            region_groups = {}
-            for pred in all_predictions:
-                region = pred.get("region")
-                if region and str(region).strip():
-                    region_lower = str(region).strip().lower()
-                    if region_lower not in region_groups:
-                        region_groups[region_lower] = {
-                            "predictions": [],
-                            "organisms": set(),
-                        }
-                    region_groups[region_lower]["predictions"].append(pred)
-                    if pred.get("bacterialSpecies"):
-                        region_groups[region_lower]["organisms"].add(pred["bacterialSpecies"])
-            
-            print(f"Found {len(region_groups)} unique regions: {list(region_groups.keys())}")
-            
-            if region_groups:
-                regions_with_trends = []
-                for region_key, region_info in region_groups.items():
-                    # Get coordinates (try exact match first, then lowercase)
-                    coords = region_coords_map.get(region_key, None)
-                    if not coords:
-                        # Try to find partial match
-                        for key, val in region_coords_map.items():
-                            if key in region_key or region_key in key:
-                                coords = val
-                                break
-                    
-                    if not coords:
-                        # Skip regions without coordinates
-                        print(f"Skipping region '{region_key}' - no coordinates found")
-                        continue
-                    
-                    # Get display name
-                    display_name = region_display_names.get(region_key, region_key.title())
-                    
-                    predictions = region_info["predictions"]
-                    cases = len(predictions)
-                    
-                    # Calculate average resistance rate
-                    total_resistance = 0
-                    valid_predictions = 0
-                    for pred in predictions:
-                        susceptible_count = len(pred.get("susceptibleAntibiotics", []))
-                        resistant_count = len(pred.get("resistantAntibiotics", []))
-                        total = susceptible_count + resistant_count
-                        if total > 0:
-                            resistance_rate = resistant_count / total
-                            total_resistance += resistance_rate
-                            valid_predictions += 1
-                    
-                    avg_resistance_rate = total_resistance / valid_predictions if valid_predictions > 0 else 0.25
-                    
-                    # Calculate trend (compare last 30 days vs previous 30 days)
-                    now = datetime.utcnow()
-                    recent_count = sum(1 for p in predictions if p.get("created_at") and (now - p.get("created_at")).days <= 30)
-                    older_count = sum(1 for p in predictions if p.get("created_at") and 30 < (now - p.get("created_at")).days <= 60)
-                    
-                    if older_count == 0:
-                        trend = "stable"
-                    elif recent_count > older_count * 1.1:
-                        trend = "increasing"
-                    elif recent_count < older_count * 0.9:
-                        trend = "decreasing"
-                    else:
-                        trend = "stable"
-                    
-                    regions_with_trends.append({
-                        "region": display_name,
-                        "lat": coords["lat"],
-                        "lng": coords["lng"],
-                        "cases": cases,
-                        "avg_resistance_rate": round(avg_resistance_rate, 3),
-                        "organisms": list(region_info["organisms"]),
-                        "trend": trend,
-                    })
-                
-                if regions_with_trends:
-                    print(f"Returning {len(regions_with_trends)} regions with data")
-                    return {"regions": regions_with_trends, "Count": len(regions_with_trends)}
+            return await surveillance_cache.respond(request, ("regions",), lambda: _regions_payload(db))
         except Exception as e:
-            import traceback
-            print(f"Error aggregating region data: {e}")
-            print(traceback.format_exc())
+            logger.exception("Error aggregating region data: %s", e)
     
     # Fallback: return empty array if no database or no data
     return {"regions": [], "Count": 0, "message": "No region data available"}
 
 
-@router.get("/trends", summary="Get resistance trends over the past 12 months")
-async def get_resistance_trends(db: Optional[Database] = Depends(get_db)):
-    """Get resistance trends over time from database."""
+def _rollup_region_keys(db: Database, region: str) -> List[str]:
+    """
+    Rollup region keys folded into the same province as `region`, as `/regions`
+    folds them (including rows written before canonicalisation, e.g. "kp"). Blocking.
+    """
+    target = regions.resolve(region)
+    if target is None:
+        return [region_key(region)]
+    province = regions.province(target)
+    keys = []
+    for key in db[ROLLUP_COLLECTION].distinct("region"):
+        match = regions.resolve(key)
+        if match is not None and regions.province(match).id == province.id:
+            keys.append(key)
+    return keys
+
+
+async def _trends_payload(
+    db: Database,
+    granularity: str,
+    first_bucket: datetime,
+    n_buckets: int,
+    start: datetime,
+    end: datetime,
+    region: Optional[str],
+    organism: Optional[str],
+) -> Dict[str, Any]:
+    """Resistance rate and case count for `n_buckets` buckets from `first_bucket` up to `end`."""
+    # Rollups are per day, so the range is resolved at day granularity
+    match: Dict[str, Any] = {
+        "day": {"$gte": _truncate_date(start, "day"), "$lt": end},
+    }
+    if region:
+        match["region"] = {"$in": await run_read(_rollup_region_keys, db, region)}
+    if organism:
+        match["organism_key"] = search_key(organism)
+    
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"$dateTrunc": _date_trunc_spec("$day", granularity)},
+                "resistance_rate_sum": {"$sum": "$resistance_rate_sum"},
+                "cases": {"$sum": "$cases"},
+                "rated_cases": {"$sum": "$rated_cases"},
+            }
+        },
+    ]
+    buckets = {
+        b["_id"]: b
+        for b in await run_read(lambda: list(db[ROLLUP_COLLECTION].aggregate(pipeline)))
+    }
+    
+    label_format, date_format = TREND_LABEL_FORMATS[granularity]
+    trends_data: List[Dict[str, Any]] = []
+    for index in range(n_buckets):
+        bucket_start = _shift_bucket(first_bucket, granularity, index)
+        bucket = buckets.get(bucket_start)
+        trends_data.append({
+            "month": bucket_start.strftime(label_format),
+            "month_index": len(trends_data),
+            "resistance_rate": round(bucket["resistance_rate_sum"] / bucket["cases"], 3) if bucket else 0.25,
+            "cases": bucket["cases"] if bucket else 0,
+            "rated_cases": bucket["rated_cases"] if bucket else 0,
+            "resistance_rate_sum": round(bucket["resistance_rate_sum"], 6) if bucket else 0.0,
+            "date": bucket_start.strftime(date_format),
+        })
+    
+    return {"trends": trends_data, "count": len(trends_data), "granularity": granularity}
+
+
+@router.get("/trends", summary="Get resistance trends bucketed by day, week or month")
+async def get_resistance_trends(
+    request: Request,
+    granularity: Granularity = Query("month", description="Bucket size"),
+    start: Optional[datetime] = Query(None, description="Range start (defaults to 12 buckets before `end`)"),
+    end: Optional[datetime] = Query(None, description="Range end (defaults to now)"),
+    region: Optional[str] = Query(None, description="Only include this province (districts are not supported)"),
+    organism: Optional[str] = Query(None, description="Only include this bacterial species"),
+    db: Optional[Database] = Depends(get_cached_read_db),
+):
+    """
+    Get resistance trends over time from database.
+
+    All buckets are computed by a single aggregation over the daily
+    rollups; buckets without any prediction are filled in with zero cases.
+    Responses are cached per query until new predictions arrive.
+
+    The rollups are kept per province, so `region` must name a province
+    (or a region outside the gazetteer); a district name is rejected with
+    400 rather than silently widened to its province.
+    """
+    province = regions.resolve(region) if region else None
+    if province is not None and province.parent is not None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Trends are kept per province; `region` names a district of {regions.province(province).name}",
+        )
+    try:
+        requested_start = _as_naive_utc(start) if start else None
+        requested_end = _as_naive_utc(end) if end else None
+        end = requested_end or datetime.utcnow()
+        first_bucket = _truncate_date(requested_start, granularity) if requested_start else _shift_bucket(
+            _truncate_date(end, granularity), granularity, -(DEFAULT_TREND_BUCKETS - 1)
+        )
+    except (ValueError, OverflowError):
+        # e.g. a default range reaching back before year 1
+        raise HTTPException(status_code=400, detail="`start` or `end` is outside the supported date range")
+    start = requested_start or first_bucket
+    if start >= end:
+        raise HTTPException(status_code=400, detail="`start` must be before `end`")
+    n_buckets = _bucket_count(first_bucket, end, granularity)
+    if n_buckets > MAX_TREND_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range spans {n_buckets} {granularity} buckets; at most {MAX_TREND_BUCKETS} are allowed",
+        )
     
     if db is not None:
+        cache_key = (
+            "trends",
+            granularity,
+            requested_start.isoformat() if requested_start else None,
+            requested_end.isoformat() if requested_end else None,
+            province.id if province is not None else region_key(region),
+            search_key(organism),
+        )
         try:
-            trends_data: List[Dict[str, Any]] = []
-            base_date = datetime.utcnow()
-            
-            # Aggregate data by month for the past 12 months
-            for i in range(11, -1, -1):
-                month_start = base_date - timedelta(days=30 * (i + 1))
-                month_end = base_date - timedelta(days=30 * i)
-                month_date = month_end
-                month_name = month_date.strftime("%b %Y")
-                
-                # Get predictions for this month
-                month_predictions = list(db.predictions.find({
-                    "created_at": {
-                        "$gte": month_start,
-                        "$lt": month_end
-                    }
-                }))
-                
-                if month_predictions:
-                    # Calculate average resistance rate for the month
-                    total_resistance = 0
-                    for pred in month_predictions:
-                        susceptible_count = len(pred.get("susceptibleAntibiotics", []))
-                        resistant_count = len(pred.get("resistantAntibiotics", []))
-                        total = susceptible_count + resistant_count
-                        if total > 0:
-                            resistance_rate = resistant_count / total
-                            total_resistance += resistance_rate
-                    
-                    avg_resistance_rate = total_resistance / len(month_predictions) if month_predictions else 0.25
-                    cases = len(month_predictions)
-                else:
-                    # No data for this month
-                    avg_resistance_rate = 0.25
-                    cases = 0
-                
-                trends_data.append({
-                    "month": month_name,
-                    "month_index": 11 - i,
-                    "resistance_rate": round(avg_resistance_rate, 3),
-                    "cases": cases,
-                    "date": month_date.strftime("%Y-%m"),
-                })
-            
-            return {"trends": trends_data, "count": len(trends_data)}
+            return await surveillance_cache.respond(
+                request,
+                cache_key,
+                lambda: _trends_payload(db, granularity, first_bucket, n_buckets, start, end, region, organism),
+            )
         except Exception as e:
-            print(f"Error fetching trends data: {e}")
+            # An empty series would read as "no cases"; report the failure instead
+            logger.exception("Error fetching trends data: %s", e)
+            status_code = 503 if isinstance(e, PyMongoError) else 500
+            raise HTTPException(status_code=status_code, detail="Could not aggregate trends data")
     
     # Fallback: return empty trends if no database
     return {"trends": [], "count": 0}
 
 
+async def _organisms_payload(db: Database) -> Dict[str, Any]:
+    """Top 10 organisms by case count with their share of those cases."""
+    # Top 10 organisms by case count, summed over the daily rollups
+    top_organisms = await run_read(
+        lambda: list(db[ROLLUP_COLLECTION].aggregate([
+            {"$match": {"organism": {"$ne": None}}},
+            {"$group": {"_id": "$organism", "cases": {"$sum": "$cases"}}},
+            {"$sort": {"cases": -1, "_id": 1}},
+            {"$limit": 10},
+        ]))
+    )
+    sorted_organisms = [(row["_id"], row["cases"]) for row in top_organisms]
+    
+    total_cases = sum(count for _, count in sorted_organisms)
+    
+    distribution_data = []
+    for organism, cases in sorted_organisms:
+        percentage = (cases / total_cases * 100) if total_cases > 0 else 0
+        distribution_data.append({
+            "organism": organism,
+            "cases": cases,
+            "percentage": round(percentage, 1),
+        })
+    
+    logger.debug("Returning %d organisms", len(distribution_data))
+    return {
+        "distribution": distribution_data,
+        "total_cases": total_cases,
+        "count": len(distribution_data),
+    }
+
+
 @router.get("/organisms", summary="Get organism distribution statistics")
-async def get_organism_distribution(db: Optional[Database] = Depends(get_db)):
+async def get_organism_distribution(request: Request, db: Optional[Database] = Depends(get_cached_read_db)):
     """
-    Get organism distribution data from database - aggregated from predictions.
+    Get organism distribution data from database - aggregated from the surveillance rollups.
     """
     
     if db is not None:
         try:
-            # Get all predictions with bacterial species
-            all_predictions = list(db.predictions.find(
-                {"bacterialSpecies": {"$exists": True, "$ne": None}},
-                {"bacterialSpecies": 1}
-            ))
-            
-            print(f"Found {len(all_predictions)} predictions with bacterial species")
-            
-            if all_predictions:
-                # Count organisms manually (more reliable than aggregation)
-                organism_counts = {}
-                for pred in all_predictions:
-                    organism = pred.get("bacterialSpecies")
-                    if organism:
-                        organism_counts[organism] = organism_counts.get(organism, 0) + 1
-                
-                # Sort by count and get top 10
-                sorted_organisms = sorted(organism_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-                
-                total_cases = sum(count for _, count in sorted_organisms)
-                
-                distribution_data = []
-                for organism, cases in sorted_organisms:
-                    percentage = (cases / total_cases * 100) if total_cases > 0 else 0
-                    distribution_data.append({
-                        "organism": organism,
-                        "cases": cases,
-                        "percentage": round(percentage, 1),
-                    })
-                
-                print(f"Returning {len(distribution_data)} organisms")
-                return {
-                    "distribution": distribution_data,
-                    "total_cases": total_cases,
-                    "count": len(distribution_data),
-                }
+            return await surveillance_cache.respond(request, ("organisms",), lambda: _organisms_payload(db))
         except Exception as e:
-            import traceback
-            print(f"Error aggregating organism distribution: {e}")
-            print(traceback.format_exc())
+            logger.exception("Error aggregating organism distribution: %s", e)
     
     # Fallback: return empty distribution if no database or no data
     return {
@@ -283,3 +694,145 @@ async def get_organism_distribution(db: Optional[Database] = Depends(get_db)):
     }
 
 
+@router.get("/antibiogram", summary="Antibiotics ranked by regional susceptibility for an organism")
+async def get_antibiogram(
+    organism: str = Query(..., description="Bacterial species"),
+    region: Optional[str] = Query(None, description="Region or district (default: all regions)"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Only the best `limit` antibiotics"),
+):
+    """
+    Cumulative antibiogram for prescribers: antibiotics tested on `organism`
+    in `region`, most susceptible first.
+
+    Answered from the in-memory antibiogram cube over the last
+    `ANTIBIOGRAM_WINDOW_MONTHS`, rebuilt in the background, so no database
+    work happens per request. Districts resolve to their province.
+    Antibiotics tested on fewer than `min_isolates` isolates have
+    `reportable: false` and are ranked after the rest.
+    """
+    cube = antibiogram.cube
+    region_name = canonical_region(region)["region"] if region else None
+    ranked = cube.lookup(region_name, organism, limit)
+    return {
+        "organism": cube.organism_name(organism) or organism.strip(),
+        "region": region_name,
+        "antibiotics": ranked,
+        "count": len(ranked),
+        "min_isolates": cube.min_isolates,
+        "window_start": cube.window_start.isoformat() if cube.window_start else None,
+        "built_at": cube.built_at.isoformat(),
+    }
+
+
+async def _alerts_payload(
+    db: Database,
+    status: str,
+    region: Optional[str],
+    organism: Optional[str],
+    metric: Optional[str],
+    since: Optional[datetime],
+    limit: int,
+) -> Dict[str, Any]:
+    """Stored outbreak alerts matching the filters, newest first."""
+    query: Dict[str, Any] = {}
+    if status != "all":
+        query["status"] = status
+    if region:
+        query["region"] = canonical_region(region)["region"]
+    if organism:
+        query["organism_key"] = search_key(organism)
+    if metric:
+        query["metric"] = metric
+    if since:
+        query["raised_at"] = {"$gte": since}
+    alerts = await run_read(
+        lambda: list(
+            db[ALERTS_COLLECTION].find(query, {"_id": 0, "organism_key": 0}).sort("raised_at", -1).limit(limit)
+        )
+    )
+    return {"alerts": alerts, "count": len(alerts)}
+
+
+@router.get("/alerts", summary="Outbreak alerts: spikes in cases or resistance")
+async def get_outbreak_alerts(
+    request: Request,
+    status: AlertStatus = Query("active", description="Only active or resolved alerts, or all"),
+    region: Optional[str] = Query(None, description="Only alerts in this region"),
+    organism: Optional[str] = Query(None, description="Only alerts for this bacterial species"),
+    metric: Optional[AlertMetric] = Query(None, description="Only case-count, resistance-rate or per-antibiotic alerts"),
+    since: Optional[datetime] = Query(None, description="Only alerts raised from this time"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of alerts"),
+    db: Optional[Database] = Depends(get_cached_read_db),
+):
+    """
+    Alerts raised by the streaming outbreak detector, newest first.
+
+    Each prediction updates EWMA baselines and CUSUM statistics per region
+    × organism (daily cases and mean resistance rate) and per resistant
+    antibiotic. An alert (`trigger`: `cusum` or `spike`) reports the
+    `observed` and `expected` daily value for its `day`; it is resolved
+    once the statistic falls back below the threshold.
+    """
+    since = _as_naive_utc(since) if since else None
+    if db is not None:
+        cache_key = (
+            "alerts",
+            status,
+            region_key(canonical_region(region)["region"]),
+            organism.strip().lower() if organism else None,
+            metric,
+            since.isoformat() if since else None,
+            limit,
+        )
+        try:
+            return await surveillance_cache.respond(
+                request,
+                cache_key,
+                lambda: _alerts_payload(db, status, region, organism, metric, since, limit),
+            )
+        except Exception as e:
+            logger.exception("Error fetching outbreak alerts: %s", e)
+
+    # Fallback: the alerts this process raised recently
+    region_name = canonical_region(region)["region"].lower() if region else None
+    alerts = [
+        alert
+        for alert in outbreaks.alerts(None if status == "all" else status)
+        if (region_name is None or alert["region"].lower() == region_name)
+        and (organism is None or alert["organism"].lower() == organism.strip().lower())
+        and (metric is None or alert["metric"] == metric)
+        and (since is None or alert["raised_at"] >= since)
+    ][:limit]
+    return {"alerts": alerts, "count": len(alerts)}
+
+
+@router.get("/live", summary="Live feed of surveillance deltas (server-sent events)")
+async def get_live_feed(last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """
+    Server-sent event stream replacing dashboard polling.
+
+    While predictions are stored, a `delta` event is sent at most once per
+    `LIVE_FEED_INTERVAL_MS` with the new cases (`cases`, `rated_cases`,
+    `resistance_rate_sum`) in `total`, per region in `regions` (plus the
+    organisms seen) and per organism in `organisms`; add them to the
+    `/regions`, `/trends` and `/organisms` payloads. A `resync` event
+    means updates were missed (slow client, or reconnected too late):
+    refetch those payloads. Browsers' `EventSource` reconnects with
+    `Last-Event-ID` and is sent the events it missed.
+    """
+    try:
+        body = live_feed.stream(last_event_id)
+    except FeedFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        # No caching or proxy buffering of the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache", summary="Surveillance response cache statistics")
+async def get_surveillance_cache_stats():
+    """Data generation and hit/miss counters of the surveillance response cache."""
+    return surveillance_cache.stats()
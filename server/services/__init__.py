@@ -0,0 +1,7 @@
+"""
+Service package for the FastAPI backend.
+
+This package holds data-access and domain logic shared by the
+routers (surveillance rollups, etc.), keeping route handlers thin.
+"""
+
@@ -0,0 +1,389 @@
+"""
+Columnar export of prediction history for offline analysis.
+
+Predictions are read from a MongoDB cursor in chunks of `row_group_size`
+documents and written as two tables:
+
+- `predictions`: one row per prediction (id, created_at, region, district,
+  organism, confidence, patient fields, model version, result counts);
+- `antibiotic_results`: the `susceptibleAntibiotics` and
+  `resistantAntibiotics` lists exploded into one row per
+  (prediction, antibiotic) with a boolean `resistant` column.
+
+Low-cardinality string columns (region, organism, antibiotic, ...) are
+dictionary-encoded. Output is Parquet (one row group per chunk) or Arrow
+IPC streams, optionally partitioned Hive-style by day or month of
+`created_at` and by region. Incremental exports resume after a watermark
+stored in the `export_watermarks` collection, so a nightly job writes only
+the predictions stored since its previous run. The watermark follows
+`stored_at`, set when a document is inserted, rather than `created_at`,
+so predictions that reach MongoDB late (spill-file replays, other
+processes' write-behind buffers) are still exported by the next run.
+
+    python -m services.analytics_export --out exports/ --partition-by month,region --incremental nightly
+
+pyarrow is only imported when an export runs.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import argparse
+import itertools
+import json
+import os
+
+from pymongo import ASCENDING
+from pymongo.database import Database
+
+from services.rollups import region_key
+
+
+WATERMARK_COLLECTION = "export_watermarks"
+EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "50000"))
+# Predictions stored less than this long ago are left for the next
+# incremental run, covering inserts still in flight and clock skew between
+# the processes that write
+EXPORT_SETTLE_S = float(os.getenv("EXPORT_SETTLE_S", "60"))
+
+# Partition key -> Hive directory name (distinct from the data columns)
+PARTITION_KEYS = {"day": "created_day", "month": "created_month", "region": "region_key"}
+FORMATS = {"parquet": ".parquet", "arrow": ".arrows"}
+SORT = [("created_at", ASCENDING), ("_id", ASCENDING)]
+INCREMENTAL_SORT = [("stored_at", ASCENDING), ("_id", ASCENDING)]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Columnar export needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def schemas() -> Dict[str, Any]:
+    pa = _pyarrow()
+    label = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp("ms")
+    return {
+        "predictions": pa.schema([
+            ("id", pa.string()),
+            ("created_at", timestamp),
+            ("region", label),
+            ("district", label),
+            ("organism", label),
+            ("confidence", pa.float64()),
+            ("patient_id", pa.string()),
+            ("patient_age", pa.int32()),
+            ("patient_gender", label),
+            ("model_version", label),
+            ("n_susceptible", pa.int32()),
+            ("n_resistant", pa.int32()),
+        ]),
+        "antibiotic_results": pa.schema([
+            ("prediction_id", pa.string()),
+            ("created_at", timestamp),
+            ("region", label),
+            ("organism", label),
+            ("antibiotic", label),
+            ("resistant", pa.bool_()),
+        ]),
+    }
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def build_tables(docs: Sequence[Dict[str, Any]], table_schemas: Dict[str, Any]) -> Dict[str, Any]:
+    """Column-wise Arrow tables for one chunk of prediction documents."""
+    pa = _pyarrow()
+    columns: Dict[str, Dict[str, List[Any]]] = {
+        name: {field.name: [] for field in schema} for name, schema in table_schemas.items()
+    }
+    predictions, results = columns["predictions"], columns["antibiotic_results"]
+    for doc in docs:
+        prediction_id = str(doc["_id"])
+        created_at = doc.get("created_at")
+        region = doc.get("region")
+        organism = doc.get("bacterialSpecies")
+        susceptible = doc.get("susceptibleAntibiotics") or []
+        resistant = doc.get("resistantAntibiotics") or []
+
+        predictions["id"].append(prediction_id)
+        predictions["created_at"].append(created_at)
+        predictions["region"].append(region)
+        predictions["district"].append(doc.get("district"))
+        predictions["organism"].append(organism)
+        predictions["confidence"].append(doc.get("confidence"))
+        predictions["patient_id"].append(doc.get("patientId"))
+        predictions["patient_age"].append(_int_or_none(doc.get("patientAge")))
+        predictions["patient_gender"].append(doc.get("patientGender"))
+        predictions["model_version"].append(doc.get("model_version"))
+        predictions["n_susceptible"].append(len(susceptible))
+        predictions["n_resistant"].append(len(resistant))
+
+        for antibiotic, is_resistant in itertools.chain(
+            ((a, False) for a in susceptible), ((a, True) for a in resistant)
+        ):
+            results["prediction_id"].append(prediction_id)
+            results["created_at"].append(created_at)
+            results["region"].append(region)
+            results["organism"].append(organism)
+            results["antibiotic"].append(antibiotic)
+            results["resistant"].append(is_resistant)
+
+    return {
+        name: pa.table(
+            [pa.array(columns[name][field.name], type=field.type) for field in schema],
+            schema=schema,
+        )
+        for name, schema in table_schemas.items()
+    }
+
+
+def partition_values(doc: Dict[str, Any], partition_by: Sequence[str]) -> Tuple[Tuple[str, str], ...]:
+    created_at = doc.get("created_at")
+    values = []
+    for key in partition_by:
+        if key == "day":
+            value = created_at.strftime("%Y-%m-%d") if created_at else "unknown"
+        elif key == "month":
+            value = created_at.strftime("%Y-%m") if created_at else "unknown"
+        else:
+            value = region_key(doc.get("region")) or "unknown"
+        values.append((key, value.replace("/", "_")))
+    return tuple(values)
+
+
+class PartitionedWriter:
+    """One open Parquet/Arrow writer per (table, partition) under `root`."""
+
+    def __init__(self, root: str, fmt: str, run_id: str, table_schemas: Dict[str, Any]):
+        self.root = root
+        self.fmt = fmt
+        self.run_id = run_id
+        self.schemas = table_schemas
+        self._writers: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Any] = {}
+        self.files: List[str] = []
+        self.rows: Dict[str, int] = {name: 0 for name in table_schemas}
+
+    def _open(self, table: str, partition: Tuple[Tuple[str, str], ...]) -> Any:
+        pa = _pyarrow()
+        directory = os.path.join(
+            self.root, table, *[f"{PARTITION_KEYS[key]}={value}" for key, value in partition]
+        )
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.run_id}{FORMATS[self.fmt]}")
+        self.files.append(path)
+        if self.fmt == "parquet":
+            return pa.parquet.ParquetWriter(path, self.schemas[table], compression="zstd")
+        return pa.ipc.new_stream(path, self.schemas[table])
+
+    def write(self, table: str, partition: Tuple[Tuple[str, str], ...], data: Any) -> None:
+        if data.num_rows == 0:
+            return
+        key = (table, partition)
+        writer = self._writers.get(key)
+        if writer is None:
+            writer = self._writers[key] = self._open(table, partition)
+        # One call per chunk: a Parquet row group / an IPC record batch
+        if self.fmt == "parquet":
+            writer.write_table(data, row_group_size=data.num_rows)
+        else:
+            writer.write_table(data)
+        self.rows[table] += data.num_rows
+
+    def close_where(self, keep: Any) -> None:
+        """Close the writers whose partition fails `keep(partition)`."""
+        for key in [k for k in self._writers if not keep(k[1])]:
+            self._writers.pop(key).close()
+
+    def close(self) -> None:
+        self.close_where(lambda _: False)
+
+
+def _chunks(cursor: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(cursor)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_predictions(
+    db: Database,
+    out_dir: str,
+    fmt: str = "parquet",
+    partition_by: Sequence[str] = (),
+    query: Optional[Dict[str, Any]] = None,
+    incremental: Optional[str] = None,
+    row_group_size: int = EXPORT_ROW_GROUP_SIZE,
+) -> Dict[str, Any]:
+    """
+    Export predictions matching `query` to `out_dir` (blocking).
+
+    With `incremental`, only predictions stored after that watermark are
+    exported and the watermark advances once all files are closed. The
+    first incremental run also exports documents written before `stored_at`
+    existed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+    unknown = set(partition_by) - set(PARTITION_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown partition keys: {', '.join(sorted(unknown))}")
+
+    conditions = [query] if query else []
+    watermark = None
+    if incremental:
+        watermark = db[WATERMARK_COLLECTION].find_one({"_id": incremental})
+        cutoff = datetime.utcnow() - timedelta(seconds=EXPORT_SETTLE_S)
+        settled = {"stored_at": {"$lt": cutoff}}
+        if watermark is not None:
+            conditions.append(settled)
+            conditions.append({
+                "$or": [
+                    {"stored_at": {"$gt": watermark["stored_at"]}},
+                    {"stored_at": watermark["stored_at"], "_id": {"$gt": watermark["last_id"]}},
+                ]
+            })
+        else:
+            conditions.append({"$or": [settled, {"stored_at": None}]})
+    find_filter = {"$and": conditions} if conditions else {}
+
+    table_schemas = schemas()
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    writer = PartitionedWriter(out_dir, fmt, run_id, table_schemas)
+    # Incremental runs follow stored_at, so created_at partitions may recur and stay open until the end
+    date_key = next((k for k in partition_by if k in ("day", "month")), None) if not incremental else None
+    last: Optional[Dict[str, Any]] = None
+
+    sort = INCREMENTAL_SORT if incremental else SORT
+    cursor = db.predictions.find(find_filter).sort(sort).batch_size(min(row_group_size, 10000))
+    try:
+        for chunk in _chunks(cursor, row_group_size):
+            groups: Dict[Tuple[Tuple[str, str], ...], List[Dict[str, Any]]] = {}
+            for doc in chunk:
+                groups.setdefault(partition_values(doc, partition_by), []).append(doc)
+            for partition, docs in groups.items():
+                for table, data in build_tables(docs, table_schemas).items():
+                    writer.write(table, partition, data)
+            last = chunk[-1]
+            if date_key is not None:
+                # Rows arrive in created_at order, so earlier date partitions are complete
+                current = dict(partition_values(last, (date_key,)))[date_key]
+                writer.close_where(lambda p: dict(p).get(date_key) == current)
+    finally:
+        cursor.close()
+        writer.close()
+
+    if incremental and last is not None:
+        db[WATERMARK_COLLECTION].replace_one(
+            {"_id": incremental},
+            {
+                "_id": incremental,
+                # Only documents from before stored_at were exported; all stamped ones are newer than the cutoff
+                "stored_at": last.get("stored_at") or cutoff,
+                "last_id": last["_id"],
+                "updated_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+
+    return {
+        "format": fmt,
+        "partition_by": list(partition_by),
+        "rows": writer.rows,
+        "files": writer.files,
+        "watermark": {
+            "name": incremental,
+            "from": watermark["stored_at"].isoformat() if watermark else None,
+            "to": (last.get("stored_at") or cutoff).isoformat() if last else None,
+        } if incremental else None,
+    }
+
+
+class _ChunkSink:
+    """Write-only file object collecting what pyarrow writes, drained after each batch."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data: Any) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+class ArrowStream:
+    """
+    Incremental Arrow IPC stream of one export table, for HTTP responses.
+
+    `next_bytes()` reads one chunk from the cursor (blocking) and returns the
+    encoded record batch, or b"" once the cursor is exhausted and the stream
+    is closed.
+    """
+
+    def __init__(self, cursor: Iterable[Dict[str, Any]], table: str, chunk_size: int = 10000):
+        pa = _pyarrow()
+        self.table = table
+        self.schemas = schemas()
+        self._chunks = _chunks(cursor, chunk_size)
+        self._sink = _ChunkSink()
+        self._writer = pa.ipc.new_stream(self._sink, self.schemas[table])
+        self._done = False
+
+    def next_bytes(self) -> bytes:
+        if self._done:
+            return b""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._writer.close()
+            self._done = True
+        else:
+            self._writer.write_table(build_tables(chunk, self.schemas)[self.table])
+        return self._sink.drain()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--partition-by", default="", help="Comma-separated: day or month, and/or region")
+    parser.add_argument("--incremental", metavar="NAME", help="Export only predictions after watermark NAME, then advance it")
+    parser.add_argument("--row-group-size", type=int, default=EXPORT_ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    database = client[os.getenv("DB_NAME", "amr_db")]
+    summary = export_predictions(
+        database,
+        args.out,
+        fmt=args.format,
+        partition_by=[key.strip() for key in args.partition_by.split(",") if key.strip()],
+        incremental=args.incremental,
+        row_group_size=args.row_group_size,
+    )
+    print(json.dumps(summary, indent=2))
+    client.close()
@@ -0,0 +1,360 @@
+"""
+Regional antibiogram: susceptibility per region × organism × antibiotic.
+
+Every stored prediction (or ingested AST result) adds its per-antibiotic
+results to `antibiogram_rollups`, one document per (region, organism,
+antibiotic, month) holding `tested` and `resistant` counts, with the same
+batched `$inc` upserts as the surveillance rollups.
+
+The API process keeps the trailing `ANTIBIOGRAM_WINDOW_MONTHS` of those
+rows as an `AntibiogramCube`: dense count arrays indexed by region,
+organism and antibiotic, with susceptibility and a ranking per
+(region, organism) computed when the cube is built. A background task
+rebuilds it every `ANTIBIOGRAM_REFRESH_S` and swaps it in whole, so a
+lookup is two dictionary hits and a list slice, never a query.
+
+Antibiotics tested on fewer than `ANTIBIOGRAM_MIN_ISOLATES` isolates (30,
+as in CLSI M39 cumulative antibiograms) are reported but ranked after
+those with enough data.
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import argparse
+import asyncio
+import logging
+import os
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+from pymongo.database import Database
+
+from services.rollups import region_key
+
+
+logger = logging.getLogger(__name__)
+
+ANTIBIOGRAM_COLLECTION = "antibiogram_rollups"
+
+ANTIBIOGRAM_WINDOW_MONTHS = int(os.getenv("ANTIBIOGRAM_WINDOW_MONTHS", "12"))
+ANTIBIOGRAM_REFRESH_S = float(os.getenv("ANTIBIOGRAM_REFRESH_S", "60"))
+ANTIBIOGRAM_MIN_ISOLATES = int(os.getenv("ANTIBIOGRAM_MIN_ISOLATES", "30"))
+
+# Region index of the all-regions totals in the cube
+ALL_REGIONS = "all"
+
+
+def ensure_antibiogram_indexes(db: Database) -> None:
+    """Unique rollup key; the month prefix serves the window query of a rebuild."""
+    db[ANTIBIOGRAM_COLLECTION].create_index(
+        [("month", ASCENDING), ("region", ASCENDING), ("organism", ASCENDING), ("antibiotic", ASCENDING)],
+        name="month_region_organism_antibiotic",
+        unique=True,
+    )
+
+
+def _month(created_at: Optional[datetime]) -> datetime:
+    created_at = created_at or datetime.utcnow()
+    return datetime(created_at.year, created_at.month, 1)
+
+
+def record_antibiogram(db: Database, predictions: List[Dict[str, Any]]) -> None:
+    """
+    Add the per-antibiotic results of freshly stored predictions to the rollups.
+
+    Results for the same row are combined first and sent as one unordered
+    `bulk_write` of `$inc` upserts (a write-behind flush hook).
+    """
+    increments: Dict[Tuple[Any, ...], List[int]] = {}
+    for prediction in predictions:
+        organism = prediction.get("bacterialSpecies") or None
+        if organism is None:
+            continue
+        prefix = (region_key(prediction.get("region")), organism, _month(prediction.get("created_at")))
+        for resistant, field in ((0, "susceptibleAntibiotics"), (1, "resistantAntibiotics")):
+            for antibiotic in prediction.get(field) or []:
+                counts = increments.setdefault(prefix + (antibiotic,), [0, 0])
+                counts[0] += 1
+                counts[1] += resistant
+
+    if increments:
+        db[ANTIBIOGRAM_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"region": region, "organism": organism, "month": month, "antibiotic": antibiotic},
+                    {"$inc": {"tested": tested, "resistant": resistant}},
+                    upsert=True,
+                )
+                for (region, organism, month, antibiotic), (tested, resistant) in increments.items()
+            ],
+            ordered=False,
+        )
+
+
+def rebuild_antibiogram(db: Database) -> int:
+    """
+    Recompute `antibiogram_rollups` from the full `predictions` history with `$out`.
+
+    As with `rebuild_rollups`, predictions still waiting for their
+    `record_antibiogram` hook are left out for the hook to add, and others
+    stored while it runs are not included. Returns the number of rows written.
+    """
+    def results(field: str, resistant: int) -> Dict[str, Any]:
+        return {
+            "$map": {
+                "input": {"$ifNull": [field, []]},
+                "as": "antibiotic",
+                "in": {"antibiotic": "$$antibiotic", "resistant": resistant},
+            }
+        }
+
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"bacterialSpecies": {"$nin": [None, ""]}, "hooks_pending": {"$ne": "record_antibiogram"}}},
+        {
+            "$project": {
+                "region": {
+                    "$cond": [
+                        {"$eq": [{"$type": "$region"}, "string"]},
+                        {"$toLower": {"$trim": {"input": "$region"}}},
+                        None,
+                    ]
+                },
+                "organism": "$bacterialSpecies",
+                "month": {"$dateTrunc": {"date": "$created_at", "unit": "month"}},
+                "results": {
+                    "$concatArrays": [
+                        results("$susceptibleAntibiotics", 0),
+                        results("$resistantAntibiotics", 1),
+                    ]
+                },
+            }
+        },
+        {"$unwind": "$results"},
+        {
+            "$group": {
+                "_id": {
+                    "region": {"$cond": [{"$eq": ["$region", ""]}, None, "$region"]},
+                    "organism": "$organism",
+                    "month": "$month",
+                    "antibiotic": "$results.antibiotic",
+                },
+                "tested": {"$sum": 1},
+                "resistant": {"$sum": "$results.resistant"},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "region": "$_id.region",
+                "organism": "$_id.organism",
+                "month": "$_id.month",
+                "antibiotic": "$_id.antibiotic",
+                "tested": 1,
+                "resistant": 1,
+            }
+        },
+        {"$out": ANTIBIOGRAM_COLLECTION},
+    ]
+    db.predictions.aggregate(pipeline, allowDiskUse=True)
+    ensure_antibiogram_indexes(db)
+    return db[ANTIBIOGRAM_COLLECTION].count_documents({})
+
+
+def backfill_antibiogram_if_empty(db: Database) -> None:
+    """Build the antibiogram rollups on first start against existing predictions."""
+    if db[ANTIBIOGRAM_COLLECTION].estimated_document_count() == 0 and db.predictions.estimated_document_count() > 0:
+        logger.info("⏳ Building antibiogram rollups from existing predictions...")
+        rows = rebuild_antibiogram(db)
+        logger.info("✅ Built %d antibiogram rollup rows", rows)
+
+
+def _names(values: Iterable[str]) -> List[str]:
+    """Distinct names, case-insensitively, sorted; the first spelling seen is kept."""
+    names: Dict[str, str] = {}
+    for value in values:
+        names.setdefault(value.lower(), value)
+    return sorted(names.values(), key=str.lower)
+
+
+class AntibiogramCube:
+    """Immutable region × organism × antibiotic counts with precomputed rankings."""
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        min_isolates: int = 30,
+        window_start: Optional[datetime] = None,
+        built_at: Optional[datetime] = None,
+    ):
+        self.min_isolates = min_isolates
+        self.window_start = window_start
+        self.built_at = built_at or datetime.utcnow()
+
+        self.regions: List[str] = sorted({row["region"] for row in rows if row["region"] is not None}) + [ALL_REGIONS]
+        self.organisms = _names(row["organism"] for row in rows)
+        self.antibiotics = _names(row["antibiotic"] for row in rows)
+        self._region_index = {name: i for i, name in enumerate(self.regions)}
+        self._organism_index = {name.lower(): i for i, name in enumerate(self.organisms)}
+        self._antibiotic_index = {name.lower(): i for i, name in enumerate(self.antibiotics)}
+
+        shape = (len(self.regions), len(self.organisms), len(self.antibiotics))
+        self.tested = np.zeros(shape, dtype=np.int64)
+        self.resistant = np.zeros(shape, dtype=np.int64)
+        for row in rows:
+            o = self._organism_index[row["organism"].lower()]
+            a = self._antibiotic_index[row["antibiotic"].lower()]
+            # Rows without a region only count towards the all-regions totals
+            for r in {-1, self._region_index.get(row["region"], -1)}:
+                self.tested[r, o, a] += row["tested"]
+                self.resistant[r, o, a] += row["resistant"]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.susceptibility = np.where(self.tested > 0, 1.0 - self.resistant / self.tested, np.nan)
+        # Per (region, organism): enough isolates first, then most susceptible, then most tested;
+        # untested antibiotics sort last and are cut off by `lookup`
+        self.ranking = np.lexsort(
+            (-self.tested, -np.nan_to_num(self.susceptibility, nan=-1.0), self.tested < min_isolates, self.tested == 0),
+            axis=-1,
+        )
+        # Response entries per (region, organism) in ranked order, so a lookup is a list slice
+        tested, resistant, susceptibility = self.tested.tolist(), self.resistant.tolist(), self.susceptibility.tolist()
+        self._entries: List[List[List[Dict[str, Any]]]] = [
+            [
+                [
+                    {
+                        "antibiotic": self.antibiotics[a],
+                        "susceptibility": round(susceptibility[r][o][a], 3),
+                        "tested": tested[r][o][a],
+                        "susceptible": tested[r][o][a] - resistant[r][o][a],
+                        "resistant": resistant[r][o][a],
+                        "reportable": tested[r][o][a] >= min_isolates,
+                    }
+                    for a in self.ranking[r, o].tolist()
+                    if tested[r][o][a] > 0
+                ]
+                for o in range(len(self.organisms))
+            ]
+            for r in range(len(self.regions))
+        ]
+
+    def organism_name(self, organism: str) -> Optional[str]:
+        index = self._organism_index.get(organism.strip().lower())
+        return None if index is None else self.organisms[index]
+
+    def lookup(self, region: Optional[str], organism: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Antibiotics tested on `organism` in `region` (None: all regions), best first."""
+        r = self._region_index.get(region_key(region) or ALL_REGIONS)
+        o = self._organism_index.get(organism.strip().lower())
+        if r is None or o is None:
+            return []
+        # The entries are shared between lookups; callers must not modify them
+        return self._entries[r][o][:limit]
+
+    def susceptibility_of(self, region: Optional[str], organism: str, antibiotic: str) -> Optional[Dict[str, Any]]:
+        """Entry of one antibiotic from `lookup`, matched case-insensitively."""
+        a = self._antibiotic_index.get(antibiotic.strip().lower())
+        if a is None:
+            return None
+        return next((entry for entry in self.lookup(region, organism) if entry["antibiotic"] == self.antibiotics[a]), None)
+
+
+class Antibiogram:
+    """Holds the current cube and rebuilds it from the rollups in the background."""
+
+    def __init__(self, window_months: int = 12, min_isolates: int = 30):
+        self.window_months = window_months
+        self.min_isolates = min_isolates
+        self.cube = AntibiogramCube([], min_isolates)
+        self.ready = False
+        self._counters = {"refreshes": 0, "failures": 0}
+        self.refresh_ms: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "Antibiogram":
+        return cls(window_months=ANTIBIOGRAM_WINDOW_MONTHS, min_isolates=ANTIBIOGRAM_MIN_ISOLATES)
+
+    def window_start(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """First month in the window (0 months: all history)."""
+        if self.window_months <= 0:
+            return None
+        month = _month(now)
+        index = month.year * 12 + month.month - self.window_months
+        return month.replace(year=index // 12, month=index % 12 + 1)
+
+    def build(self, db: Database) -> AntibiogramCube:
+        """Sum the window's monthly rows per cell and build a cube (blocking)."""
+        start = self.window_start()
+        pipeline: List[Dict[str, Any]] = []
+        if start is not None:
+            pipeline.append({"$match": {"month": {"$gte": start}}})
+        pipeline += [
+            {
+                "$group": {
+                    "_id": {"region": "$region", "organism": "$organism", "antibiotic": "$antibiotic"},
+                    "tested": {"$sum": "$tested"},
+                    "resistant": {"$sum": "$resistant"},
+                }
+            },
+        ]
+        rows = [
+            {**row["_id"], "tested": row["tested"], "resistant": row["resistant"]}
+            for row in db[ANTIBIOGRAM_COLLECTION].aggregate(pipeline)
+        ]
+        return AntibiogramCube(rows, self.min_isolates, start)
+
+    async def refresh(self, db: Database) -> None:
+        """Build a new cube off the event loop and swap it in; lookups never see a partial one."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            cube = await loop.run_in_executor(None, self.build, db)
+        except Exception:
+            self._counters["failures"] += 1
+            raise
+        self.cube = cube
+        self.refresh_ms = round((loop.time() - started) * 1000, 2)
+        self.ready = True
+        self._counters["refreshes"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        cube = self.cube
+        return {
+            "ready": self.ready,
+            "built_at": cube.built_at.isoformat(),
+            "window_start": cube.window_start.isoformat() if cube.window_start else None,
+            "shape": {"regions": len(cube.regions), "organisms": len(cube.organisms), "antibiotics": len(cube.antibiotics)},
+            "refresh_ms": self.refresh_ms,
+            **self._counters,
+        }
+
+
+antibiogram = Antibiogram.from_env()
+
+
+async def watch_antibiogram(interval_s: float, get_db: Callable[[], Optional[Database]]) -> None:
+    """Rebuild the cube now and every `interval_s` seconds while a database is available."""
+    while True:
+        db = get_db()
+        if db is not None:
+            try:
+                await antibiogram.refresh(db)
+            except Exception as e:
+                logger.warning("⚠️  Antibiogram refresh failed: %s: %s", type(e).__name__, e)
+        await asyncio.sleep(interval_s if antibiogram.ready else min(interval_s, 5.0))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage the antibiogram rollup collection.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute antibiogram rollups from all predictions")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    database = client[os.getenv("DB_NAME", "amr_db")]
+    if args.command == "rebuild":
+        print(f"✅ Wrote {rebuild_antibiogram(database)} rows to '{ANTIBIOGRAM_COLLECTION}'")
+    client.close()
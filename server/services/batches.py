@@ -0,0 +1,198 @@
+"""
+Input handling for batch (whole-plate) predictions.
+
+A batch is either several uploaded spectrum files or one zip archive of
+them, plus optional per-file metadata from a CSV with a `filename` column
+and any of `organism`, `patientAge`, `patientGender`, `region`,
+`latitude`, `longitude`, `patientId`. The CSV may be uploaded separately or included in the archive
+as `metadata.csv`. Form fields act as defaults for files without a row.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import csv
+import hashlib
+import io
+import os
+import posixpath
+import zipfile
+import zlib
+
+from services.prediction_cache import upload_digest
+from services.spectra import CHUNK_SIZE, MAX_UPLOAD_BYTES, Spectrum, SpectrumParseError, parse_spectrum_stream, read_upload
+
+
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "384"))
+METADATA_FILENAME = "metadata.csv"
+METADATA_FIELDS = ("organism", "patientAge", "patientGender", "region", "latitude", "longitude", "patientId")
+
+
+class BatchInputError(ValueError):
+    """The batch as a whole cannot be processed (bad archive, bad metadata, too many files)."""
+
+
+@dataclass
+class BatchItem:
+    """One spectrum of a batch: its parsed data and metadata, or why it failed."""
+
+    filename: str
+    meta: Dict[str, Any] = field(default_factory=dict)
+    spectrum: Optional[Spectrum] = None
+    sha256: Optional[str] = None
+    error: Optional[str] = None
+
+
+class _HashingStream:
+    """Binary stream wrapper computing the SHA-256 of the bytes read through it."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self._digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        # Parsers may stop before the end of the file; hash the rest too
+        while self.read(CHUNK_SIZE):
+            pass
+        return self._digest.hexdigest()
+
+
+def _basename(name: str) -> str:
+    return posixpath.basename(name.replace("\\", "/"))
+
+
+def read_metadata_csv(stream: BinaryIO) -> Dict[str, Dict[str, Any]]:
+    """Parse the metadata CSV into {basename: {field: value}}."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text)
+        columns = {(name or "").strip(): name for name in reader.fieldnames or []}
+        if "filename" not in columns:
+            raise BatchInputError("Metadata CSV must have a 'filename' column")
+
+        rows: Dict[str, Dict[str, Any]] = {}
+        for line_number, row in enumerate(reader, start=2):
+            filename = _basename((row.get(columns["filename"]) or "").strip())
+            if not filename:
+                continue
+            meta: Dict[str, Any] = {}
+            for name in METADATA_FIELDS:
+                value = (row.get(columns[name]) or "").strip() if name in columns else ""
+                if value:
+                    meta[name] = value
+            if "patientAge" in meta:
+                try:
+                    meta["patientAge"] = int(meta["patientAge"])
+                except ValueError:
+                    raise BatchInputError(f"Metadata line {line_number}: patientAge must be an integer")
+            for name, limit in (("latitude", 90), ("longitude", 180)):
+                if name in meta:
+                    try:
+                        meta[name] = float(meta[name])
+                    except ValueError:
+                        raise BatchInputError(f"Metadata line {line_number}: {name} must be a number")
+                    if not -limit <= meta[name] <= limit:
+                        raise BatchInputError(f"Metadata line {line_number}: {name} out of range")
+            rows[filename] = meta
+        return rows
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise BatchInputError(f"Could not read metadata CSV: {e}")
+    finally:
+        text.detach()
+
+
+def _item(filename: str, defaults: Dict[str, Any], metadata: Dict[str, Dict[str, Any]]) -> BatchItem:
+    meta = {k: v for k, v in defaults.items() if v is not None}
+    meta.update(metadata.get(_basename(filename), {}))
+    item = BatchItem(filename=filename, meta=meta)
+    if not meta.get("organism"):
+        item.error = "No organism given in metadata or form fields"
+    return item
+
+
+def _spectrum_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    members = []
+    for info in archive.infolist():
+        name = _basename(info.filename)
+        if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+            continue
+        if name.lower() == METADATA_FILENAME:
+            continue
+        members.append(info)
+    return members
+
+
+def iter_batch_items(
+    files: List[Any],
+    archive: Optional[Any],
+    metadata: Optional[Any],
+    defaults: Dict[str, Any],
+) -> Iterator[BatchItem]:
+    """
+    Yield the batch's spectra one at a time, parsing each as it is reached.
+
+    Blocking; consume it off the event loop. Raises `BatchInputError` before
+    the first item if the batch itself is unusable.
+    """
+    zipped: Optional[zipfile.ZipFile] = None
+    members: List[zipfile.ZipInfo] = []
+    if archive is not None:
+        try:
+            archive.file.seek(0)
+            zipped = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise BatchInputError("Archive is not a valid zip file")
+        members = _spectrum_members(zipped)
+
+    if len(files) + len(members) == 0:
+        raise BatchInputError("Upload spectrum files or a zip archive")
+    if len(files) + len(members) > MAX_BATCH_FILES:
+        raise BatchInputError(f"A batch may contain at most {MAX_BATCH_FILES} spectra")
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    if metadata is not None:
+        metadata.file.seek(0)
+        rows = read_metadata_csv(metadata.file)
+    elif zipped is not None:
+        bundled = next(
+            (i for i in zipped.infolist() if _basename(i.filename).lower() == METADATA_FILENAME),
+            None,
+        )
+        if bundled is not None:
+            with zipped.open(bundled) as stream:
+                rows = read_metadata_csv(stream)
+
+    for upload in files:
+        item = _item(upload.filename or "", defaults, rows)
+        if item.error is None:
+            try:
+                item.spectrum = read_upload(upload)
+                item.sha256 = upload_digest(upload)
+            except SpectrumParseError as e:
+                item.error = str(e)
+        yield item
+
+    for info in members:
+        item = _item(info.filename, defaults, rows)
+        if item.error is None:
+            if info.file_size > MAX_UPLOAD_BYTES:
+                item.error = f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+            else:
+                try:
+                    with zipped.open(info) as stream:
+                        hashing = _HashingStream(stream)
+                        item.spectrum = parse_spectrum_stream(hashing, info.filename)
+                        item.sha256 = hashing.hexdigest()
+                except SpectrumParseError as e:
+                    item.error = str(e)
+                except (zipfile.BadZipFile, zlib.error, NotImplementedError) as e:
+                    item.error = f"Could not extract file: {e}"
+                except RuntimeError:
+                    # zipfile's error for an encrypted member without a password
+                    item.error = "Could not extract file: it is encrypted"
+        yield item
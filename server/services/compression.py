@@ -0,0 +1,183 @@
+"""
+Response compression: brotli when the client accepts it (and the `brotli`
+package is installed), otherwise gzip.
+
+Bodies of at least `COMPRESSION_MIN_BYTES` with a compressible media type
+are compressed in one go. Streaming responses (exports, NDJSON batches)
+are compressed chunk by chunk, flushing after each chunk so clients still
+receive them incrementally. Server-sent events are never compressed,
+since a compressor buffering an event would delay it, and responses that
+already carry a `Content-Encoding` (e.g. cached bodies compressed once
+by the response cache) are left as they are.
+"""
+
+from typing import List, Optional, Tuple
+
+import gzip
+import os
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Quality 4 compresses about as well as gzip -6, and faster; 11 is for static assets
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Bodies and chunks at least this large are compressed off the event loop (zlib and brotli release the GIL)
+INLINE_COMPRESS_BYTES = 64 * 1024
+
+COMPRESSIBLE_TYPES: Tuple[str, ...] = (
+    "application/json",
+    "application/x-ndjson",
+    "application/vnd.apache.arrow.stream",
+    "text/csv",
+    "text/plain",
+    "text/html",
+)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """`br`, `gzip` or None, from an `Accept-Encoding` header (brotli preferred)."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a whole body with `encoding` (`br` or `gzip`)."""
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    """`compress`, on a worker thread for large bodies so the event loop keeps serving."""
+    if len(body) < INLINE_COMPRESS_BYTES:
+        return compress(body, encoding)
+    return await run_in_threadpool(compress, body, encoding)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";", 1)[0].strip().lower() in COMPRESSIBLE_TYPES
+
+
+class _StreamCompressor:
+    """Incremental compressor whose output can be flushed after every chunk."""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + (self._brotli.finish() if last else self._brotli.flush())
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    async def chunk_async(self, data: bytes, last: bool) -> bytes:
+        if len(data) < INLINE_COMPRESS_BYTES:
+            return self.chunk(data, last)
+        return await run_in_threadpool(self.chunk, data, last)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing response bodies of `minimum_size` bytes or more."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_StreamCompressor] = None
+        buffered: Optional[List[bytes]] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, compressor, buffered, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                await send({"type": "http.response.body", "body": await compressor.chunk_async(body, not more_body), "more_body": more_body})
+                return
+            if buffered is not None:
+                buffered.append(body)
+                if not more_body:
+                    await self._send_whole(send, start, b"".join(buffered), encoding)
+                return
+
+            # First body message: decide from the headers and the size, when known
+            headers = MutableHeaders(raw=start["headers"])
+            length = headers.get("content-length")
+            size = int(length) if length and length.isdigit() else (None if more_body else len(body))
+            if (
+                "content-encoding" in headers
+                or not is_compressible(headers.get("content-type"))
+                or (size is not None and size < self.minimum_size)
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+            elif not more_body:
+                await self._send_whole(send, start, body, encoding)
+            elif size is not None:
+                # A body of known length sent in parts (e.g. through an `http` middleware): compress it whole
+                buffered = [body]
+            else:
+                compressor = _StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                del headers["Content-Length"]
+                await send(start)
+                await send({"type": "http.response.body", "body": await compressor.chunk_async(body, False), "more_body": True})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    async def _send_whole(send: Send, start: Message, body: bytes, encoding: str) -> None:
+        body = await compress_async(body, encoding)
+        headers = MutableHeaders(raw=start["headers"])
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        headers["Content-Length"] = str(len(body))
+        await send(start)
+        await send({"type": "http.response.body", "body": body, "more_body": False})
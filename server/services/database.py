@@ -0,0 +1,290 @@
+"""
+The MongoDB connection and non-blocking access to the synchronous pymongo driver.
+
+Route handlers are `async def`, so calling pymongo directly would block the
+event loop for the duration of every query. The helpers here run database
+calls on bounded thread pools instead: one for heavy read/aggregation work
+(surveillance) and one for the short writes on the prediction path, so a
+burst of slow dashboard aggregations can never queue ahead of an insert.
+
+`mongo` owns the process's single `MongoClient`. It is opened by the app's
+lifespan without waiting for the server and watched by a background ping
+loop, so startup never blocks on MongoDB and a database that comes up
+later is picked up on the next ping. Handlers get their handle from the
+`get_db` (primary) and `get_read_db` (secondary-preferred, for
+surveillance reads) dependencies, which return None while MongoDB is
+unreachable.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import asyncio
+import functools
+import logging
+import os
+import time
+
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
+
+from services.metrics import mongo_command_listener
+
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "8"))
+DB_WRITE_WORKERS = int(os.getenv("DB_WRITE_WORKERS", "8"))
+
+# Created on first use, so a later lifespan in the same process (tests, benchmarks) gets fresh pools
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_EXECUTOR_WORKERS = {"read": DB_READ_WORKERS, "write": DB_WRITE_WORKERS}
+
+
+def _executor(kind: str) -> ThreadPoolExecutor:
+    executor = _executors.get(kind)
+    if executor is None:
+        executor = _executors[kind] = ThreadPoolExecutor(
+            max_workers=_EXECUTOR_WORKERS[kind], thread_name_prefix=f"mongo-{kind}"
+        )
+    return executor
+
+
+async def _run(executor: ThreadPoolExecutor, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_read(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking query/aggregation on the read pool and await its result."""
+    return await _run(_executor("read"), fn, *args, **kwargs)
+
+
+async def run_write(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking insert/update on the write pool and await its result."""
+    return await _run(_executor("write"), fn, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    """Wait for in-flight database calls and stop the worker threads; later calls start new pools."""
+    while _executors:
+        _, executor = _executors.popitem()
+        executor.shutdown(wait=True)
+
+
+# One pool per server, shared by both executors, the write-behind buffer and
+# streaming exports; sized so every executor thread can hold a connection.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", str(2 * (DB_READ_WORKERS + DB_WRITE_WORKERS))))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+# Fail fast when the server goes away between health checks instead of pymongo's 30 s default
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_HEALTH_INTERVAL_S = float(os.getenv("MONGO_HEALTH_INTERVAL_S", "10"))
+# Secondaries lagging further than this are not used for surveillance reads (-1: no limit, else >= 90)
+MONGO_READ_MAX_STALENESS_S = int(os.getenv("MONGO_READ_MAX_STALENESS_S", "-1"))
+
+OnConnect = Callable[[Database], Awaitable[None]]
+
+
+class MongoConnection:
+    """
+    The process's MongoClient with cached connectivity state.
+
+    `open()` only creates the client; pymongo connects from its own
+    background threads. `monitor()` pings the primary every
+    `health_interval` seconds (retrying sooner, with backoff, while it is
+    down) and `db` / `read_db` return None until a ping has succeeded and
+    again after one fails, so handlers take their database-less path
+    instead of waiting on server selection.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        health_interval_s: float = 10.0,
+        read_max_staleness_s: int = -1,
+        event_listeners: Optional[List[Any]] = None,
+        **client_options: Any,
+    ):
+        self.uri = uri
+        self.db_name = db_name
+        self.health_interval = max(0.5, health_interval_s)
+        self.read_max_staleness = read_max_staleness_s
+        self.event_listeners = event_listeners or []
+        self.client_options = client_options
+        self.client: Optional[MongoClient] = None
+        self._db: Optional[Database] = None
+        self._read_db: Optional[Database] = None
+        self._attached = False
+        self.connected = False
+        self.prepared = False
+        self.ever_connected = False
+        self.error: Optional[str] = None
+        self.checked_at: Optional[datetime] = None
+        self.ping_ms: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "MongoConnection":
+        return cls(
+            uri=os.getenv("MONGODB_URI", "mongodb://localhost:27017/"),
+            db_name=os.getenv("DB_NAME", "amr_db"),
+            health_interval_s=MONGO_HEALTH_INTERVAL_S,
+            read_max_staleness_s=MONGO_READ_MAX_STALENESS_S,
+            event_listeners=[mongo_command_listener],
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        )
+
+    @property
+    def db(self) -> Optional[Database]:
+        """Primary handle for writes and read-your-writes queries, or None while disconnected."""
+        return self._db if self.connected else None
+
+    @property
+    def read_db(self) -> Optional[Database]:
+        """Secondary-preferred handle for surveillance reads, or None while disconnected."""
+        return self._read_db if self.connected else None
+
+    def open(self) -> None:
+        """Create the client without contacting the server (idempotent)."""
+        if self.client is not None or self._attached:
+            return
+        try:
+            # For MongoDB Atlas the database name need not be in the URI; it is selected below
+            self.client = MongoClient(self.uri, event_listeners=self.event_listeners, **self.client_options)
+        except (PyMongoError, ValueError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.warning("⚠️  Invalid MongoDB configuration: %s", self.error)
+            logger.warning("⚠️  Running without database - API will still work but data won't be persisted")
+            return
+        self._db = self.client[self.db_name]
+        self._read_db = self.client.get_database(
+            self.db_name, read_preference=SecondaryPreferred(max_staleness=self.read_max_staleness)
+        )
+
+    def attach(self, database: Database) -> None:
+        """Serve reads and writes from an existing handle (benchmarks, scripts); nothing is monitored."""
+        self.close()
+        self._attached = True
+        self._db = self._read_db = database
+        self.connected = self.prepared = self.ever_connected = True
+        self.error = None
+
+    async def monitor(self, on_connect: Optional[OnConnect] = None, on_reconnect: Optional[OnConnect] = None) -> None:
+        """
+        Track connectivity until cancelled.
+
+        `on_connect(db)` runs once, after the first successful ping
+        (index creation, rollup backfill); it is retried on the next
+        ping if it fails. `on_reconnect(db)` runs each time the database
+        is reachable again after that (e.g. to replay spilled writes).
+        """
+        loop = asyncio.get_running_loop()
+        backoff = 1.0
+        while self.client is not None:
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(None, self.client.admin.command, "ping")
+            except PyMongoError as e:
+                if self._attached:
+                    return
+                self._mark_down(f"{type(e).__name__}: {e}")
+            else:
+                reconnected = self.prepared and not self.connected
+                self._mark_up((time.perf_counter() - started) * 1000)
+                if reconnected and on_reconnect is not None:
+                    try:
+                        await on_reconnect(self._db)
+                    except Exception as e:
+                        logger.warning("⚠️  Reconnect handler failed: %s: %s", type(e).__name__, e)
+                if not self.prepared and on_connect is not None:
+                    try:
+                        await on_connect(self._db)
+                        self.prepared = True
+                    except Exception as e:
+                        logger.warning("⚠️  Could not prepare MongoDB indexes/rollups: %s: %s", type(e).__name__, e)
+            self.checked_at = datetime.utcnow()
+            if self.connected:
+                backoff = 1.0
+                await asyncio.sleep(self.health_interval)
+            else:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.health_interval)
+
+    def _mark_up(self, ping_ms: float) -> None:
+        if not self.connected:
+            if self.ever_connected:
+                logger.info("🔁 Reconnected to MongoDB (database: %s)", self.db_name)
+            else:
+                logger.info("✅ Connected to MongoDB successfully (database: %s)", self.db_name)
+        self.connected = self.ever_connected = True
+        self.error = None
+        self.ping_ms = round(ping_ms, 2)
+
+    def _mark_down(self, error: str) -> None:
+        if self.connected:
+            logger.warning("⚠️  Lost MongoDB connection: %s", error)
+        elif self.checked_at is None:
+            logger.warning("⚠️  MongoDB not reachable yet: %s", error)
+            logger.warning("⚠️  Running without database until it is - retrying in the background")
+        self.connected = False
+        self.error = error
+        self.ping_ms = None
+
+    async def wait_connected(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the first successful ping (scripts and benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while not self.connected and self.client is not None and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.connected
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        self.connected = False
+
+    def stats(self) -> Dict[str, Any]:
+        if self.connected:
+            state = "connected"
+        elif self.checked_at is None and self.error is None:
+            state = "connecting"
+        else:
+            state = "disconnected"
+        return {
+            "state": state,
+            "database": self.db_name,
+            "prepared": self.prepared,
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+            "ping_ms": self.ping_ms,
+            "error": self.error,
+            "pool": {
+                "max_size": self.client_options.get("maxPoolSize"),
+                "min_size": self.client_options.get("minPoolSize"),
+            },
+        }
+
+
+mongo = MongoConnection.from_env()
+
+
+def get_db() -> Optional[Database]:
+    """FastAPI dependency: the primary database handle, or None while MongoDB is unreachable."""
+    return mongo.db
+
+
+def get_read_db() -> Optional[Database]:
+    """FastAPI dependency: a secondary-preferred handle for surveillance reads, or None."""
+    return mongo.read_db
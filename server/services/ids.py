@@ -0,0 +1,68 @@
+"""
+Sortable, collision-free identifiers (ULIDs).
+
+A ULID packs a 48-bit millisecond timestamp and 80 random bits into 26
+Crockford base32 characters, so identifiers sort by creation time as plain
+strings. Within one millisecond the generator increments the random part
+instead of drawing a new one, so the identifiers of one process are
+strictly increasing even under load; across API workers and hosts the 80
+random bits make a collision negligible, and unique indexes reject one
+outright. The sequence is re-seeded in a forked child, so workers forked
+from the same parent never continue the same sequence.
+"""
+
+import os
+import threading
+import time
+
+
+# Crockford's base32: no I, L, O or U
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+ULID_LENGTH = 26
+_RANDOM_BITS = 80
+
+
+def _encode(value: int) -> str:
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ENCODING[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+class UlidGenerator:
+    """Thread-safe, monotonic ULID source."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = -1
+        self._last_ms = -1
+        self._random = 0
+
+    def new(self) -> str:
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._pid = os.getpid()
+                self._last_ms = -1
+            now = time.time_ns() // 1_000_000
+            if now > self._last_ms:
+                self._last_ms = now
+                self._random = int.from_bytes(os.urandom(_RANDOM_BITS // 8), "big")
+            else:
+                # Same millisecond, or the clock stepped back: continue the sequence
+                self._random += 1
+                if self._random >> _RANDOM_BITS:
+                    self._last_ms += 1
+                    self._random = int.from_bytes(os.urandom(_RANDOM_BITS // 8), "big")
+            value = (self._last_ms << _RANDOM_BITS) | self._random
+        return _encode(value)
+
+
+ulids = UlidGenerator()
+
+
+def new_id(prefix: str) -> str:
+    """`<prefix>-<ULID>`, e.g. `PRES-01J9Z6M2X8K4T5Q7R3W1V0N9BC`."""
+    return f"{prefix}-{ulids.new()}"
+
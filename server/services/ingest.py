@@ -0,0 +1,287 @@
+"""
+Bulk ingest of antimicrobial susceptibility test (AST) results from lab systems.
+
+Records arrive as NDJSON or CSV, one AST result each:
+
+    recordId              required; unique per source, the idempotency key
+    bacterialSpecies      required (alias `organism`)
+    susceptibleAntibiotics / resistantAntibiotics
+                          lists (CSV: `;`-separated); at least one antibiotic
+    created_at            ISO 8601 collection time (alias `collectedAt`; default: now)
+    region, latitude, longitude, patientId, patientAge, patientGender
+                          optional
+
+Rows are read and checked in batches of `INGEST_BATCH_SIZE` with plain
+per-field coercion functions; each valid row becomes a `predictions`
+document (region canonicalised through the gazetteer) and the batch is
+stored with one unordered `bulk_write`. Invalid rows are reported by line
+number without affecting the rest of the batch.
+
+Documents carry `ingest_key` = "<source>:<recordId>" under a unique index,
+so replaying a file, or a retry after a timeout, stores nothing twice:
+duplicates inside a batch are dropped before writing and duplicates of
+earlier ingests come back as duplicate-key errors, counted as `duplicates`.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import csv
+import io
+import json
+import os
+
+from pymongo import ASCENDING, InsertOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+from services.records import prediction_keys
+from services.regions import canonical_region
+
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+MAX_INGEST_BYTES = int(float(os.getenv("MAX_INGEST_MB", "128")) * 1024 * 1024)
+# Error reports returned per request; the counts always cover every record
+MAX_REPORTED_ERRORS = int(os.getenv("INGEST_MAX_REPORTED_ERRORS", "1000"))
+
+DUPLICATE_KEY = 11000
+
+# Alternative names accepted for fields (e.g. LIS exports)
+FIELD_ALIASES = {
+    "organism": "bacterialSpecies",
+    "collectedAt": "created_at",
+    "susceptible": "susceptibleAntibiotics",
+    "resistant": "resistantAntibiotics",
+}
+
+# Row = (line number, raw record)
+Row = Tuple[int, Dict[str, Any]]
+
+# Key of the placeholder record yielded for an NDJSON line that is not JSON
+_UNREADABLE = "__unreadable__"
+
+
+class IngestInputError(ValueError):
+    """The body as a whole cannot be read (wrong format, not UTF-8, no header)."""
+
+
+def ensure_ingest_indexes(db: Database) -> None:
+    """Unique idempotency key; predictions from the upload form have none and are not indexed."""
+    db.predictions.create_index(
+        [("ingest_key", ASCENDING)],
+        name="ingest_key",
+        unique=True,
+        partialFilterExpression={"ingest_key": {"$exists": True}},
+    )
+
+
+def _text(value: Any, name: str, max_length: int = 200, required: bool = False) -> Optional[str]:
+    if value is not None and (not isinstance(value, (str, int)) or isinstance(value, bool)):
+        raise ValueError(f"{name} must be a string")
+    text = str(value).strip() if value is not None else ""
+    if len(text) > max_length:
+        raise ValueError(f"{name} is longer than {max_length} characters")
+    if required and not text:
+        raise ValueError(f"{name} is required")
+    return text or None
+
+
+def _antibiotics(value: Any, name: str) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        items: List[Any] = value.split(";")
+    elif isinstance(value, list):
+        items = value
+    else:
+        raise ValueError(f"{name} must be a list or a ';'-separated string")
+    names = []
+    for item in items:
+        if not isinstance(item, str):
+            raise ValueError(f"{name} must contain strings")
+        item = item.strip()
+        if item:
+            names.append(item)
+    return names
+
+
+def _number(value: Any, name: str, low: float, high: float, integer: bool = False) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    try:
+        number = int(value) if integer else float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be {'an integer' if integer else 'a number'}")
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low:g} and {high:g}")
+    return number
+
+
+def _timestamp(value: Any, now: datetime) -> datetime:
+    if value is None or value == "":
+        return now
+    if not isinstance(value, str):
+        raise ValueError("created_at must be an ISO 8601 string")
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("created_at must be an ISO 8601 string")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if parsed > now + timedelta(days=1):
+        raise ValueError("created_at is in the future")
+    return parsed
+
+
+def _canonical_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {FIELD_ALIASES.get(key, key): value for key, value in record.items()}
+
+
+def validate_batch(
+    rows: List[Row], source: str, now: Optional[datetime] = None
+) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Turn a batch of raw records into prediction documents.
+
+    Returns (line, document) pairs for valid rows and one error report per
+    invalid row, listing every problem found in it.
+    """
+    now = now or datetime.utcnow()
+    valid: List[Tuple[int, Dict[str, Any]]] = []
+    errors: List[Dict[str, Any]] = []
+    for line, raw in rows:
+        if not isinstance(raw, dict):
+            errors.append({"line": line, "recordId": None, "errors": ["record must be an object"]})
+            continue
+        if _UNREADABLE in raw:
+            errors.append({"line": line, "recordId": None, "errors": [raw[_UNREADABLE]]})
+            continue
+        record = _canonical_fields(raw)
+        problems: List[str] = []
+
+        def check(fn: Callable[..., Any], *args: Any) -> Any:
+            try:
+                return fn(*args)
+            except ValueError as e:
+                problems.append(str(e))
+                return None
+
+        record_id = check(_text, record.get("recordId"), "recordId", 128, True)
+        organism = check(_text, record.get("bacterialSpecies"), "bacterialSpecies", 200, True)
+        susceptible = check(_antibiotics, record.get("susceptibleAntibiotics"), "susceptibleAntibiotics") or []
+        resistant = check(_antibiotics, record.get("resistantAntibiotics"), "resistantAntibiotics") or []
+        created_at = check(_timestamp, record.get("created_at"), now)
+        region = check(_text, record.get("region"), "region")
+        latitude = check(_number, record.get("latitude"), "latitude", -90, 90)
+        longitude = check(_number, record.get("longitude"), "longitude", -180, 180)
+        patient_id = check(_text, record.get("patientId"), "patientId", 128)
+        patient_age = check(_number, record.get("patientAge"), "patientAge", 0, 130, True)
+        patient_gender = check(_text, record.get("patientGender"), "patientGender", 32)
+
+        if not susceptible and not resistant:
+            problems.append("no antibiotic results")
+        overlap = set(susceptible) & set(resistant)
+        if overlap:
+            problems.append(f"listed as both susceptible and resistant: {', '.join(sorted(overlap))}")
+        if problems:
+            errors.append({"line": line, "recordId": record_id, "errors": problems})
+            continue
+
+        location = canonical_region(region, latitude, longitude)
+        doc = {
+            "bacterialSpecies": organism,
+            "susceptibleAntibiotics": susceptible,
+            "resistantAntibiotics": resistant,
+            "region": location["region"],
+            "confidence": None,
+            "patientId": patient_id,
+            "organism_input": organism,
+            "patientAge": patient_age,
+            "patientGender": patient_gender,
+            "region_input": region,
+            "district": location["district"],
+            "region_id": location["region_id"],
+            "location": None if latitude is None or longitude is None else {
+                "type": "Point", "coordinates": [longitude, latitude]
+            },
+            "source": source,
+            "recordId": record_id,
+            "ingest_key": f"{source}:{record_id}",
+            "created_at": created_at,
+            "ingested_at": now,
+        }
+        doc.update(prediction_keys(doc))
+        valid.append((line, doc))
+    return valid, errors
+
+
+def iter_rows(stream: BinaryIO, fmt: str) -> Iterator[Row]:
+    """Raw records of an NDJSON or CSV body with their line numbers (blocking)."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            if not reader.fieldnames:
+                raise IngestInputError("CSV body has no header row")
+            for row in reader:
+                # Empty cells are missing values, not empty strings
+                yield reader.line_num, {
+                    (key or "").strip(): value for key, value in row.items() if key and value not in (None, "")
+                }
+        else:
+            for line_number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {_UNREADABLE: f"invalid JSON: {e.msg}"}
+    except UnicodeDecodeError:
+        raise IngestInputError("Body is not valid UTF-8")
+    except csv.Error as e:
+        raise IngestInputError(f"Could not read CSV: {e}")
+    finally:
+        text.detach()
+
+
+def write_batch(db: Database, valid: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Store a validated batch with one unordered `bulk_write` (blocking).
+
+    Returns the stored documents (for rollups), the line numbers of
+    duplicates and error reports for documents the server rejected.
+    """
+    stored: List[Dict[str, Any]] = []
+    duplicates: List[int] = []
+    errors: List[Dict[str, Any]] = []
+
+    seen = set()
+    unique: List[Tuple[int, Dict[str, Any]]] = []
+    for line, doc in valid:
+        if doc["ingest_key"] in seen:
+            duplicates.append(line)
+        else:
+            seen.add(doc["ingest_key"])
+            unique.append((line, doc))
+    if not unique:
+        return {"stored": stored, "duplicates": duplicates, "errors": errors}
+
+    failed = set()
+    stored_at = datetime.utcnow()
+    for _, doc in unique:
+        doc["stored_at"] = stored_at
+    try:
+        db.predictions.bulk_write([InsertOne(doc) for _, doc in unique], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            index = write_error["index"]
+            failed.add(index)
+            line, doc = unique[index]
+            if write_error.get("code") == DUPLICATE_KEY:
+                duplicates.append(line)
+            else:
+                errors.append({"line": line, "recordId": doc["recordId"], "errors": [write_error.get("errmsg", "write failed")]})
+    stored = [doc for index, (_, doc) in enumerate(unique) if index not in failed]
+    return {"stored": stored, "duplicates": duplicates, "errors": errors}
@@ -0,0 +1,309 @@
+"""
+Live surveillance feed: server-sent events with per-region and per-organism deltas.
+
+Stored predictions are published to an in-process hub, either by the
+write-behind flush hook (this process's writes, including bulk ingest) or,
+with `LIVE_FEED_CHANGE_STREAM=1`, by a MongoDB change stream on
+`predictions`, which also sees other API processes' writes (replica sets
+only; the hook is used if the stream cannot be opened).
+
+Deltas are coalesced: everything published within `LIVE_FEED_INTERVAL_MS`
+becomes one event, serialised once and handed to every subscriber, so the
+cost of a burst grows with the number of updates, not with the number of
+open dashboards times a full recomputation.
+
+Each subscriber has a bounded queue (`LIVE_FEED_CLIENT_QUEUE` events). A
+client too slow to keep up has its backlog dropped and receives a single
+`resync` event, telling it to refetch the full payloads; memory per client
+stays bounded and one slow client never holds up the others. Recent events
+are kept so a reconnecting client (`Last-Event-ID`) misses nothing.
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+import asyncio
+import logging
+import os
+
+from pymongo.database import Database
+from pymongo.errors import OperationFailure, PyMongoError
+
+from services.regions import regions
+from services.responses import dumps
+from services.rollups import resistance_rate
+
+
+logger = logging.getLogger(__name__)
+
+LIVE_FEED_INTERVAL_MS = float(os.getenv("LIVE_FEED_INTERVAL_MS", "1000"))
+LIVE_FEED_CLIENT_QUEUE = int(os.getenv("LIVE_FEED_CLIENT_QUEUE", "32"))
+LIVE_FEED_MAX_CLIENTS = int(os.getenv("LIVE_FEED_MAX_CLIENTS", "5000"))
+LIVE_FEED_HEARTBEAT_S = float(os.getenv("LIVE_FEED_HEARTBEAT_S", "15"))
+LIVE_FEED_CHANGE_STREAM = os.getenv("LIVE_FEED_CHANGE_STREAM", "0") == "1"
+
+# Events kept for clients reconnecting with Last-Event-ID
+REPLAY_EVENTS = 256
+
+# Browsers reconnect this long after the stream drops
+RETRY_MS = 5000
+
+Totals = Dict[str, Any]
+
+
+class FeedFullError(RuntimeError):
+    """`LIVE_FEED_MAX_CLIENTS` subscribers are already connected."""
+
+
+def _empty_totals() -> Totals:
+    return {"cases": 0, "rated_cases": 0, "resistance_rate_sum": 0.0}
+
+
+def _add(totals: Totals, other: Totals) -> None:
+    for field in ("cases", "rated_cases", "resistance_rate_sum"):
+        totals[field] += other[field]
+
+
+def summarise(predictions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Delta of a batch of predictions: totals overall, per region and per organism.
+
+    Regions are folded into provinces, named and placed as in `/regions`, so
+    a dashboard can add a province it has not seen yet; regions outside the
+    gazetteer are left out there too.
+    """
+    delta: Dict[str, Any] = {"total": _empty_totals(), "regions": {}, "organisms": {}}
+    for prediction in predictions:
+        rate = resistance_rate(
+            prediction.get("susceptibleAntibiotics") or [],
+            prediction.get("resistantAntibiotics") or [],
+        )
+        one = {"cases": 1, "rated_cases": 0 if rate is None else 1, "resistance_rate_sum": rate or 0.0}
+        organism = prediction.get("bacterialSpecies") or None
+        _add(delta["total"], one)
+        match = regions.resolve(prediction.get("region"))
+        if match is not None:
+            province = regions.province(match)
+            totals = delta["regions"].setdefault(
+                province.name, {**_empty_totals(), "organisms": set(), "lat": province.lat, "lng": province.lng}
+            )
+            _add(totals, one)
+            if organism:
+                totals["organisms"].add(organism)
+        if organism:
+            _add(delta["organisms"].setdefault(organism, _empty_totals()), one)
+    return delta
+
+
+def _merge(into: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    _add(into["total"], delta["total"])
+    for region, totals in delta["regions"].items():
+        target = into["regions"].setdefault(
+            region, {**_empty_totals(), "organisms": set(), "lat": totals["lat"], "lng": totals["lng"]}
+        )
+        _add(target, totals)
+        target["organisms"] |= totals["organisms"]
+    for organism, totals in delta["organisms"].items():
+        _add(into["organisms"].setdefault(organism, _empty_totals()), totals)
+
+
+def _event(seq: int, name: str, data: Dict[str, Any]) -> bytes:
+    # Organism sets are written as sorted lists
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (seq, name.encode(), dumps(data))
+
+
+class _Subscriber:
+    __slots__ = ("queue",)
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+
+
+class LiveFeed:
+    """In-process pub/sub hub coalescing prediction deltas into SSE events."""
+
+    def __init__(
+        self,
+        interval_ms: float = 1000.0,
+        client_queue: int = 32,
+        max_clients: int = 5000,
+        heartbeat_s: float = 15.0,
+    ):
+        self.interval = max(0.01, interval_ms / 1000.0)
+        self.client_queue = max(1, client_queue)
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat_s
+        self.change_stream_active = False
+        self._subscribers: Set[_Subscriber] = set()
+        self._recent: Deque[Tuple[int, bytes]] = deque(maxlen=REPLAY_EVENTS)
+        self._pending: Optional[Dict[str, Any]] = None
+        self._seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._counters = {"published": 0, "events": 0, "resyncs": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls) -> "LiveFeed":
+        return cls(
+            interval_ms=LIVE_FEED_INTERVAL_MS,
+            client_queue=LIVE_FEED_CLIENT_QUEUE,
+            max_clients=LIVE_FEED_MAX_CLIENTS,
+            heartbeat_s=LIVE_FEED_HEARTBEAT_S,
+        )
+
+    # Publishing
+
+    def publish(self, db: Any, predictions: List[Dict[str, Any]]) -> None:
+        """
+        Write-behind flush hook: queue the delta of freshly stored predictions.
+
+        Runs on a database worker thread; the delta is computed there and
+        handed to the event loop. Ignored while the change stream delivers
+        the same documents.
+        """
+        if not self.change_stream_active:
+            self._publish_threadsafe(predictions)
+
+    def _publish_threadsafe(self, predictions: List[Dict[str, Any]]) -> None:
+        if self._loop is None or not predictions:
+            return
+        delta = summarise(predictions)
+        try:
+            self._loop.call_soon_threadsafe(self._accumulate, delta, len(predictions))
+        except RuntimeError:
+            # The loop has closed (shutdown)
+            pass
+
+    def _accumulate(self, delta: Dict[str, Any], count: int) -> None:
+        self._counters["published"] += count
+        if self._pending is None:
+            self._pending = delta
+            self._wake.set()
+        else:
+            _merge(self._pending, delta)
+
+    async def run(self) -> None:
+        """Broadcast the coalesced delta at most once per interval (until cancelled)."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            await self._wake.wait()
+            # Let the rest of the burst arrive, then send it as one event
+            await asyncio.sleep(self.interval)
+            self._wake.clear()
+            delta, self._pending = self._pending, None
+            if delta is not None:
+                self._broadcast("delta", {"at": datetime.utcnow().isoformat(), **delta})
+
+    def _broadcast(self, name: str, data: Dict[str, Any]) -> None:
+        self._seq += 1
+        chunk = _event(self._seq, name, {"seq": self._seq, **data})
+        self._recent.append((self._seq, chunk))
+        self._counters["events"] += 1
+        for subscriber in self._subscribers:
+            self._deliver(subscriber, chunk)
+
+    def _deliver(self, subscriber: _Subscriber, chunk: bytes) -> None:
+        try:
+            subscriber.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the backlog and ask the client to refetch
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(_event(self._seq, "resync", {"seq": self._seq}))
+            self._counters["resyncs"] += 1
+
+    # Subscribing
+
+    def _subscribe(self, last_event_id: Optional[str]) -> _Subscriber:
+        if len(self._subscribers) >= self.max_clients:
+            self._counters["rejected"] += 1
+            raise FeedFullError("Too many live feed clients")
+        subscriber = _Subscriber(self.client_queue)
+        if last_event_id is not None and last_event_id.strip().isdigit():
+            last = int(last_event_id)
+            missed = [chunk for seq, chunk in self._recent if seq > last]
+            # Resync when events were missed beyond the replay buffer, or the seq is from before a restart
+            too_old = bool(self._recent) and last < self._recent[0][0] - 1
+            if too_old or last > self._seq or len(missed) > self.client_queue:
+                self._deliver(subscriber, _event(self._seq, "resync", {"seq": self._seq}))
+            else:
+                for chunk in missed:
+                    subscriber.queue.put_nowait(chunk)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def stream(self, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """SSE body for one client; raises FeedFullError before the response starts."""
+        subscriber = self._subscribe(last_event_id)
+
+        async def body() -> AsyncIterator[bytes]:
+            try:
+                yield f"retry: {RETRY_MS}\n\n".encode()
+                while True:
+                    try:
+                        yield await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        # Comment line: keeps proxies from closing an idle stream
+                        yield b": keep-alive\n\n"
+            finally:
+                self._subscribers.discard(subscriber)
+
+        return body()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self._subscribers),
+            "max_clients": self.max_clients,
+            "seq": self._seq,
+            "source": "change_stream" if self.change_stream_active else "write_hook",
+            **self._counters,
+        }
+
+    # Change stream
+
+    async def follow_change_stream(self, db: Database) -> None:
+        """
+        Publish inserts into `predictions` from a MongoDB change stream (until cancelled).
+
+        Resumes after the last seen event when the stream is interrupted;
+        falls back to the write hook when change streams are unsupported.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+        resume_token: Optional[Dict[str, Any]] = None
+
+        def follow() -> None:
+            nonlocal resume_token
+            pipeline = [{"$match": {"operationType": "insert"}}]
+            with db.predictions.watch(pipeline, resume_after=resume_token, max_await_time_ms=1000) as stream:
+                self.change_stream_active = True
+                batch: List[Dict[str, Any]] = []
+                while not stopping:
+                    change = stream.try_next()
+                    if change is not None:
+                        batch.append(change["fullDocument"])
+                        resume_token = stream.resume_token
+                        if len(batch) < 500:
+                            continue
+                    self._publish_threadsafe(batch)
+                    batch = []
+
+        try:
+            while True:
+                try:
+                    await loop.run_in_executor(None, follow)
+                except OperationFailure as e:
+                    logger.warning("⚠️  Live feed change stream unavailable, using local writes only: %s", e)
+                    return
+                except PyMongoError as e:
+                    logger.warning("⚠️  Live feed change stream interrupted: %s: %s", type(e).__name__, e)
+                finally:
+                    self.change_stream_active = False
+                await asyncio.sleep(1.0)
+        finally:
+            stopping = True
+
+
+live_feed = LiveFeed.from_env()
@@ -0,0 +1,134 @@
+"""
+Prometheus metrics for the API process.
+
+- `http_request_duration_seconds`: latency per route template, method and
+  status, recorded by `MetricsMiddleware`.
+- `mongodb_command_duration_seconds`: every command pymongo sends, tagged
+  by collection and command name, via a command-monitoring listener passed
+  to `MongoClient(event_listeners=...)`.
+- `prediction_upload_bytes` and `prediction_stage_duration_seconds`: upload
+  size and the time `/api/prediction/run` spends hashing, parsing,
+  preprocessing and waiting for inference.
+
+Everything is exposed in the text format by `GET /metrics`.
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Most requests finish in milliseconds; aggregations and uploads can take seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command latency",
+    ["collection", "command"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total",
+    "MongoDB commands that returned an error",
+    ["collection", "command"],
+)
+UPLOAD_BYTES = Histogram(
+    "prediction_upload_bytes",
+    "Size of spectrum uploads to /api/prediction/run",
+    buckets=(1e3, 1e4, 1e5, 1e6, 4e6, 1.6e7, 6.4e7, 2.56e8),
+)
+PREDICTION_STAGE_DURATION = Histogram(
+    "prediction_stage_duration_seconds",
+    "Time spent per stage of /api/prediction/run",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Label for requests that matched no route, so probes of random paths cannot grow the label set
+UNMATCHED_ROUTE = "unmatched"
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Observe the duration of one `run_prediction` stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PREDICTION_STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of every HTTP request by route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", UNMATCHED_ROUTE), str(status[0])
+            ).observe(time.perf_counter() - started)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times MongoDB commands from the started/succeeded events pymongo publishes."""
+
+    def __init__(self):
+        self._started: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        # getMore names its collection separately; admin commands (ping, hello) have none
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finish(self, event: Any) -> Tuple[str, str]:
+        with self._lock:
+            return self._started.pop((event.connection_id, event.request_id), ("-", event.command_name))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        collection, command = self._finish(event)
+        MONGO_COMMAND_DURATION.labels(collection, command).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        collection, command = self._finish(event)
+        MONGO_COMMAND_DURATION.labels(collection, command).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(collection, command).inc()
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
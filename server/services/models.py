@@ -0,0 +1,264 @@
+"""
+Model registry: versioned artifacts loaded from `MODEL_PATH`.
+
+Layout of the model directory::
+
+    models/
+      CURRENT                 # optional: name of the version to serve
+      v1/
+        model.json            # version (= directory name), antibiotics, species, preprocessing
+        weights.npy           # (n_bins, n_antibiotics) float32
+        bias.npy              # (n_antibiotics,) float32
+        species_weights.npy   # optional (n_bins, n_species) float32
+        species_bias.npy      # optional (n_species,) float32
+
+Without `CURRENT`, the lexicographically last version directory is served.
+Weight files are opened with `np.load(mmap_mode="r")`, so every process
+that loads the same version (uvicorn/gunicorn workers, inference pool
+workers) maps the same page-cache pages instead of holding its own copy.
+When no model is installed, the mocked predictor is used.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.preprocessing import DEFAULT_CONFIG, PreprocessingConfig
+
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "models"))
+MOCK_VERSION = "mock-0"
+
+
+@dataclass
+class LoadedModel:
+    """A linear multi-label resistance model with an optional species head."""
+
+    version: str
+    antibiotics: List[str]
+    weights: np.ndarray
+    bias: np.ndarray
+    preprocessing: PreprocessingConfig
+    species: List[str] = field(default_factory=list)
+    species_weights: Optional[np.ndarray] = None
+    species_bias: Optional[np.ndarray] = None
+    loaded_at: float = field(default_factory=time.time)
+    load_ms: float = 0.0
+
+    def predict(self, features: np.ndarray, organisms: Sequence[Optional[str]]) -> List[Dict[str, Any]]:
+        """One vectorised forward pass for the whole (n_spectra, n_bins) batch."""
+        probabilities = 1.0 / (1.0 + np.exp(-(features @ self.weights + self.bias)))
+        resistant_mask = probabilities >= 0.5
+        confidence = np.maximum(probabilities, 1.0 - probabilities).mean(axis=1) * 100.0
+
+        predicted_species: List[Optional[str]] = [None] * len(organisms)
+        if self.species_weights is not None and self.species:
+            scores = features @ self.species_weights
+            if self.species_bias is not None:
+                scores = scores + self.species_bias
+            predicted_species = [self.species[i] for i in np.argmax(scores, axis=1)]
+
+        results = []
+        for row, organism in enumerate(organisms):
+            results.append({
+                "bacterialSpecies": organism.strip() if organism else (predicted_species[row] or "Unknown"),
+                "susceptibleAntibiotics": [a for a, r in zip(self.antibiotics, resistant_mask[row]) if not r],
+                "resistantAntibiotics": [a for a, r in zip(self.antibiotics, resistant_mask[row]) if r],
+                "confidence": round(float(confidence[row]), 1),
+            })
+        return results
+
+
+def load_model(directory: str) -> LoadedModel:
+    """
+    Load one version directory, memory-mapping its weight arrays.
+
+    The version is the directory name, which is what `CURRENT` and
+    `activate()` refer to; a `model.json` naming another version is rejected.
+    """
+    started = time.perf_counter()
+    with open(os.path.join(directory, "model.json")) as f:
+        meta = json.load(f)
+    version = os.path.basename(os.path.normpath(directory))
+    if meta.get("version") and str(meta["version"]) != version:
+        raise ValueError(f"{directory}: model.json names version {meta['version']!r}, not {version!r}")
+
+    def array(name: str) -> Optional[np.ndarray]:
+        path = os.path.join(directory, name)
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    weights, bias = array("weights.npy"), array("bias.npy")
+    if weights is None or bias is None:
+        raise FileNotFoundError(f"{directory} is missing weights.npy or bias.npy")
+    antibiotics = list(meta["antibiotics"])
+    preprocessing = PreprocessingConfig(**meta.get("preprocessing", {}))
+    if weights.shape != (preprocessing.n_bins, len(antibiotics)) or bias.shape != (len(antibiotics),):
+        raise ValueError(f"{directory}: weight shapes do not match n_bins/antibiotics in model.json")
+
+    return LoadedModel(
+        version=version,
+        antibiotics=antibiotics,
+        weights=weights,
+        bias=bias,
+        preprocessing=preprocessing,
+        species=list(meta.get("species", [])),
+        species_weights=array("species_weights.npy"),
+        species_bias=array("species_bias.npy"),
+        load_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
+
+
+def save_model(
+    root: str,
+    version: str,
+    weights: np.ndarray,
+    bias: np.ndarray,
+    antibiotics: List[str],
+    preprocessing: PreprocessingConfig = DEFAULT_CONFIG,
+    species: Optional[List[str]] = None,
+    species_weights: Optional[np.ndarray] = None,
+    make_current: bool = True,
+) -> str:
+    """Write a version directory (used by training/export scripts and benchmarks)."""
+    directory = os.path.join(root, version)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "weights.npy"), np.ascontiguousarray(weights, dtype=np.float32))
+    np.save(os.path.join(directory, "bias.npy"), np.ascontiguousarray(bias, dtype=np.float32))
+    if species_weights is not None:
+        np.save(os.path.join(directory, "species_weights.npy"), np.ascontiguousarray(species_weights, dtype=np.float32))
+    with open(os.path.join(directory, "model.json"), "w") as f:
+        json.dump(
+            {
+                "version": version,
+                "antibiotics": antibiotics,
+                "species": species or [],
+                "preprocessing": preprocessing.__dict__,
+            },
+            f,
+            indent=2,
+        )
+    if make_current:
+        # Write-then-rename so readers never see a half-written CURRENT file
+        tmp = os.path.join(root, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(root, "CURRENT"))
+    return directory
+
+
+class ModelRegistry:
+    """Tracks the served model version and keeps loaded versions per process."""
+
+    def __init__(self, root: str = MODEL_PATH):
+        self.root = root
+        self._lock = threading.Lock()
+        self._models: Dict[str, LoadedModel] = {}
+        self._active: Optional[str] = None
+        self.ready = False
+        self.warmup_ms: Optional[float] = None
+
+    def current_version(self) -> Optional[str]:
+        """The version the model directory asks to serve, or None when none is installed."""
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        except FileNotFoundError:
+            pass
+        try:
+            versions = sorted(
+                name for name in os.listdir(self.root)
+                if os.path.isfile(os.path.join(self.root, name, "model.json"))
+            )
+        except FileNotFoundError:
+            return None
+        return versions[-1] if versions else None
+
+    @property
+    def version(self) -> str:
+        """Version currently served by this process."""
+        return self._active or MOCK_VERSION
+
+    def get(self, version: Optional[str] = None) -> Optional[LoadedModel]:
+        """
+        The loaded model for `version` (default: the active one), loading it on first use.
+
+        Returns None for the mock version.
+        """
+        version = version or self._active
+        if not version or version == MOCK_VERSION:
+            return None
+        model = self._models.get(version)
+        if model is None:
+            with self._lock:
+                model = self._models.get(version)
+                if model is None:
+                    model = load_model(os.path.join(self.root, version))
+                    self._models[version] = model
+        return model
+
+    def activate(self, version: Optional[str]) -> Optional[LoadedModel]:
+        """Load `version` (if needed) and make it the one served; older versions are released."""
+        model = self.get(version) if version else None
+        with self._lock:
+            self._active = version if model is not None else None
+            self._models = {v: m for v, m in self._models.items() if v == self._active}
+        return model
+
+    def reload_if_changed(self) -> bool:
+        """Switch to the version named by the model directory if it differs from the active one."""
+        wanted = self.current_version()
+        if wanted == self._active:
+            return False
+        self.activate(wanted)
+        return True
+
+    def snapshot(self) -> Tuple[str, PreprocessingConfig]:
+        """Active version and its preprocessing config, read together so a hot-swap cannot split them."""
+        with self._lock:
+            model = self._models.get(self._active) if self._active else None
+        if model is None:
+            return MOCK_VERSION, DEFAULT_CONFIG
+        return model.version, model.preprocessing
+
+    def status(self) -> Dict[str, Any]:
+        model = self.get()
+        return {
+            "ready": self.ready,
+            "version": self.version,
+            "model_path": self.root,
+            "loaded_at": model.loaded_at if model is not None else None,
+            "load_ms": model.load_ms if model is not None else None,
+            "warmup_ms": self.warmup_ms,
+            "memory_mapped": bool(model is not None and isinstance(model.weights, np.memmap)),
+        }
+
+
+registry = ModelRegistry()
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Resident memory of a process from /proc (Linux), split into anonymous
+    and file-backed pages; memory-mapped weights show up as file-backed and
+    are shared between processes.
+    """
+    pid = pid or os.getpid()
+    fields = {"VmRSS": "rss_kb", "RssAnon": "rss_anon_kb", "RssFile": "rss_file_kb"}
+    usage: Dict[str, Any] = {"pid": pid}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    usage[fields[name]] = int(value.split()[0])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return usage
@@ -0,0 +1,507 @@
+"""
+Streaming outbreak detection over stored predictions.
+
+Each prediction updates a handful of daily series, keyed by region and
+organism:
+
+- `cases`: predictions per day
+- `resistance`: mean per-prediction resistance rate (as in the rollups)
+- `antibiotic`: share of isolates resistant to one antibiotic
+
+A series keeps the open day's count and sum plus an EWMA baseline (mean
+and variance) and a one-sided CUSUM of standardised daily values, so an
+update is O(1) and no history is read. When a day closes, its value is
+scored against the baseline (`z`), added to the CUSUM and folded into the
+baseline; an alert is raised when the CUSUM exceeds `OUTBREAK_CUSUM_H`,
+or at once when the open day alone is `OUTBREAK_SPIKE_Z` deviations above
+the baseline, and resolved once the CUSUM falls back. Series need
+`OUTBREAK_MIN_DAYS` days of baseline, and days with too few cases or
+isolates are not scored.
+
+Alerts are stored in `surveillance_alerts`. Detector state is checkpointed
+to `outbreak_state` every `OUTBREAK_CHECKPOINT_S` and on shutdown, with the
+highest prediction `_id` seen; on start only predictions stored after the
+checkpoint are replayed (or, the first time, the last
+`OUTBREAK_BOOTSTRAP_DAYS` days).
+
+The detector sees the predictions stored by its own API process.
+"""
+
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import threading
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne
+from pymongo.database import Database
+
+from services.database import run_write
+from services.ids import new_id
+from services.records import search_key
+from services.rollups import resistance_rate
+
+
+logger = logging.getLogger(__name__)
+
+ALERTS_COLLECTION = "surveillance_alerts"
+STATE_COLLECTION = "outbreak_state"
+META_ID = "__meta__"
+
+OUTBREAK_EWMA_LAMBDA = float(os.getenv("OUTBREAK_EWMA_LAMBDA", "0.2"))
+OUTBREAK_CUSUM_K = float(os.getenv("OUTBREAK_CUSUM_K", "0.5"))
+OUTBREAK_CUSUM_H = float(os.getenv("OUTBREAK_CUSUM_H", "5"))
+OUTBREAK_SPIKE_Z = float(os.getenv("OUTBREAK_SPIKE_Z", "4"))
+OUTBREAK_MIN_DAYS = int(os.getenv("OUTBREAK_MIN_DAYS", "7"))
+OUTBREAK_MIN_CASES = int(os.getenv("OUTBREAK_MIN_CASES", "5"))
+OUTBREAK_MIN_TESTED = int(os.getenv("OUTBREAK_MIN_TESTED", "10"))
+OUTBREAK_CHECKPOINT_S = float(os.getenv("OUTBREAK_CHECKPOINT_S", "60"))
+OUTBREAK_BOOTSTRAP_DAYS = int(os.getenv("OUTBREAK_BOOTSTRAP_DAYS", "60"))
+
+COUNT, RATE = "count", "rate"
+METRIC_KINDS = {"cases": COUNT, "resistance": RATE, "antibiotic": RATE}
+
+# Empty days folded into a count baseline after a gap; longer gaps add nothing more
+MAX_GAP_DAYS = 60
+
+# Alerts kept in memory for /alerts while the database is unreachable
+RECENT_ALERTS = 1000
+
+# (metric, region, organism, antibiotic or None)
+SeriesKey = Tuple[str, str, str, Optional[str]]
+
+
+def ensure_outbreak_indexes(db: Database) -> None:
+    alerts = db[ALERTS_COLLECTION]
+    alerts.create_index([("alertId", ASCENDING)], name="alertId", unique=True)
+    alerts.create_index([("status", ASCENDING), ("raised_at", DESCENDING)], name="status_raised_at")
+
+
+class Series:
+    """Open-day accumulator, EWMA baseline and CUSUM of one daily series."""
+
+    __slots__ = ("kind", "day", "n", "total", "mean", "var", "days", "cusum", "alert", "dirty")
+
+    def __init__(self, kind: str, day: int):
+        self.kind = kind
+        self.day = day
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.var = 0.0
+        self.days = 0
+        self.cusum = 0.0
+        self.alert: Optional[Dict[str, Any]] = None
+        self.dirty = True
+
+    def value(self) -> Optional[float]:
+        """The open day's observation: its count, or its mean rate (None without data)."""
+        if self.kind == COUNT:
+            return float(self.n)
+        return self.total / self.n if self.n else None
+
+    def z(self, value: float, n: int) -> float:
+        """Deviations of a day's value above the baseline (Poisson / binomial floor on the spread)."""
+        if self.kind == COUNT:
+            return (value - self.mean) / math.sqrt(max(self.var, self.mean, 1.0))
+        p = min(max(self.mean, 0.02), 0.98)
+        return (value - self.mean) / math.sqrt(p * (1 - p) / n)
+
+    def fold(self, value: float, lam: float) -> None:
+        if self.days == 0:
+            self.mean, self.var = value, 0.0
+        else:
+            diff = value - self.mean
+            self.mean += lam * diff
+            self.var = (1 - lam) * (self.var + lam * diff * diff)
+        self.days += 1
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind, "day": self.day, "n": self.n, "total": self.total, "mean": self.mean,
+            "var": self.var, "days": self.days, "cusum": self.cusum,
+            "alertId": self.alert["alertId"] if self.alert else None,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "Series":
+        series = cls(doc["kind"], doc["day"])
+        for field in ("n", "total", "mean", "var", "days", "cusum"):
+            setattr(series, field, doc[field])
+        series.dirty = False
+        return series
+
+
+class OutbreakDetector:
+    """EWMA/CUSUM detector over all (region, organism) series, fed by the write hooks."""
+
+    def __init__(
+        self,
+        lam: float = 0.2,
+        k: float = 0.5,
+        h: float = 5.0,
+        spike_z: float = 4.0,
+        min_days: int = 7,
+        min_cases: int = 5,
+        min_tested: int = 10,
+    ):
+        self.lam = lam
+        self.k = k
+        self.h = h
+        self.spike_z = spike_z
+        self.min_days = min_days
+        self.min_cases = min_cases
+        self.min_tested = min_tested
+        self._series: Dict[SeriesKey, Series] = {}
+        self._lock = threading.Lock()
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_ALERTS)
+        self._outbox: List[Dict[str, Any]] = []
+        # Predictions replayed on restore, so the write hook does not count them twice
+        self._replayed: Set[Any] = set()
+        # Predictions flushed while a restore replays, applied once it is swapped in
+        self._restoring = False
+        self._pending: List[Dict[str, Any]] = []
+        self.watermark: Optional[ObjectId] = None
+        self.checkpoint_at: Optional[datetime] = None
+        # Checkpoints are skipped until restored, so they never overwrite saved state with a partial one
+        self.restored = False
+        # Set when the last restore failed; `checkpoint_periodically` retries it
+        self.restore_error: Optional[str] = None
+        self._counters = {"observed": 0, "late": 0, "raised": 0, "resolved": 0}
+
+    @classmethod
+    def from_env(cls) -> "OutbreakDetector":
+        return cls(
+            lam=OUTBREAK_EWMA_LAMBDA,
+            k=OUTBREAK_CUSUM_K,
+            h=OUTBREAK_CUSUM_H,
+            spike_z=OUTBREAK_SPIKE_Z,
+            min_days=OUTBREAK_MIN_DAYS,
+            min_cases=OUTBREAK_MIN_CASES,
+            min_tested=OUTBREAK_MIN_TESTED,
+        )
+
+    # Updates
+
+    def observe(self, db: Database, predictions: List[Dict[str, Any]]) -> None:
+        """Write-behind flush hook: update the series of freshly stored predictions and store alerts."""
+        with self._lock:
+            if self._restoring:
+                self._pending.extend(predictions)
+                return
+            self._observe_all(predictions)
+            outbox, self._outbox = self._outbox, []
+        self._store_alerts(db, outbox)
+
+    def _observe_all(self, predictions: List[Dict[str, Any]]) -> None:
+        for prediction in sorted(predictions, key=lambda doc: doc.get("created_at") or datetime.min):
+            if prediction.get("_id") in self._replayed:
+                continue
+            self._observe(prediction)
+
+    def _observe(self, prediction: Dict[str, Any]) -> None:
+        region = str(prediction.get("region") or "").strip()
+        organism = prediction.get("bacterialSpecies") or ""
+        _id = prediction.get("_id")
+        if isinstance(_id, ObjectId) and (self.watermark is None or _id > self.watermark):
+            self.watermark = _id
+        if not region or not organism:
+            return
+        self._counters["observed"] += 1
+        day = (prediction.get("created_at") or datetime.utcnow()).toordinal()
+        susceptible = prediction.get("susceptibleAntibiotics") or []
+        resistant = prediction.get("resistantAntibiotics") or []
+
+        self._update(("cases", region, organism, None), day, 1.0)
+        rate = resistance_rate(susceptible, resistant)
+        if rate is not None:
+            self._update(("resistance", region, organism, None), day, rate)
+        for antibiotic in susceptible:
+            self._update(("antibiotic", region, organism, antibiotic), day, 0.0)
+        for antibiotic in resistant:
+            self._update(("antibiotic", region, organism, antibiotic), day, 1.0)
+
+    def _update(self, key: SeriesKey, day: int, value: float) -> None:
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Series(METRIC_KINDS[key[0]], day)
+        if day < series.day:
+            # Older than the open day (e.g. a back-filled result): too late to score
+            self._counters["late"] += 1
+            return
+        if day > series.day:
+            self._close_day(key, series, day)
+        series.n += 1
+        series.total += value
+        series.dirty = True
+
+        # Intra-day check, so a spike alerts without waiting for the day to close
+        observed = series.value()
+        if series.alert is None and self._scorable(series, series.n, observed):
+            z = series.z(observed, series.n)
+            if z > self.spike_z:
+                self._raise(key, series, "spike", observed, z)
+
+    def _scorable(self, series: Series, n: int, value: Optional[float]) -> bool:
+        if series.days < self.min_days or value is None:
+            return False
+        return value >= self.min_cases if series.kind == COUNT else n >= self.min_tested
+
+    def _close_day(self, key: SeriesKey, series: Series, next_day: int) -> None:
+        observed = series.value()
+        if observed is not None:
+            self._score_day(key, series, observed, series.n)
+        if series.kind == COUNT:
+            for _ in range(min(next_day - series.day - 1, MAX_GAP_DAYS)):
+                self._score_day(key, series, 0.0, 1)
+        series.day, series.n, series.total = next_day, 0, 0.0
+
+    def _score_day(self, key: SeriesKey, series: Series, observed: float, n: int) -> None:
+        z = None
+        if series.days >= self.min_days and (series.kind == COUNT or n >= self.min_tested):
+            z = series.z(observed, n)
+            series.cusum = max(0.0, series.cusum + z - self.k)
+        series.fold(observed, self.lam)
+        if series.alert is None and series.cusum > self.h and observed >= (self.min_cases if series.kind == COUNT else 0):
+            self._raise(key, series, "cusum", observed, z)
+        elif series.alert is not None and series.cusum <= self.h and (z is None or z <= self.spike_z):
+            self._resolve(series)
+
+    def _raise(self, key: SeriesKey, series: Series, trigger: str, observed: float, z: Optional[float]) -> None:
+        metric, region, organism, antibiotic = key
+        now = datetime.utcnow()
+        series.alert = {
+            "alertId": new_id("ALR"),
+            "status": "active",
+            "trigger": trigger,
+            "metric": metric,
+            "region": region,
+            "organism": organism,
+            "organism_key": search_key(organism),
+            "antibiotic": antibiotic,
+            "day": date.fromordinal(series.day).isoformat(),
+            "observed": round(observed, 3),
+            "expected": round(series.mean, 3),
+            "z": round(z, 2) if z is not None else None,
+            "cusum": round(series.cusum, 2),
+            "raised_at": now,
+            "updated_at": now,
+            "resolved_at": None,
+        }
+        self._counters["raised"] += 1
+        self._recent.append(series.alert)
+        self._outbox.append(dict(series.alert))
+        logger.warning(
+            "🚨 Outbreak alert: %s %s in %s%s (observed %.3g, expected %.3g)",
+            metric, organism, region, f" / {antibiotic}" if antibiotic else "", observed, series.mean,
+        )
+
+    def _resolve(self, series: Series) -> None:
+        now = datetime.utcnow()
+        series.alert.update({"status": "resolved", "resolved_at": now, "updated_at": now})
+        self._counters["resolved"] += 1
+        self._outbox.append(dict(series.alert))
+        series.alert = None
+
+    @staticmethod
+    def _store_alerts(db: Database, alerts: List[Dict[str, Any]]) -> None:
+        if alerts:
+            db[ALERTS_COLLECTION].bulk_write(
+                [UpdateOne({"alertId": alert["alertId"]}, {"$set": alert}, upsert=True) for alert in alerts],
+                ordered=False,
+            )
+
+    # Reads
+
+    def alerts(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Recent alerts held in memory, newest first."""
+        with self._lock:
+            recent = [dict(alert) for alert in reversed(self._recent)]
+        return [alert for alert in recent if status is None or alert["status"] == status]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = sum(1 for series in self._series.values() if series.alert is not None)
+        return {
+            "series": len(self._series),
+            "active_alerts": active,
+            "watermark": str(self.watermark) if self.watermark else None,
+            "checkpoint_at": self.checkpoint_at.isoformat() if self.checkpoint_at else None,
+            "restored": self.restored,
+            "restore_error": self.restore_error,
+            **self._counters,
+        }
+
+    # Checkpoints
+
+    def checkpoint(self, db: Database) -> int:
+        """Save the series changed since the last checkpoint and the watermark (blocking)."""
+        if not self.restored:
+            return 0
+        with self._lock:
+            changed = [(key, series.to_doc()) for key, series in self._series.items() if series.dirty]
+            for key, _ in changed:
+                self._series[key].dirty = False
+            watermark = self.watermark
+            self._replayed.clear()
+        requests: List[Any] = [
+            ReplaceOne({"_id": _state_id(key)}, {"_id": _state_id(key), **doc}, upsert=True) for key, doc in changed
+        ]
+        requests.append(
+            ReplaceOne({"_id": META_ID}, {"_id": META_ID, "watermark": watermark, "saved_at": datetime.utcnow()}, upsert=True)
+        )
+        db[STATE_COLLECTION].bulk_write(requests, ordered=False)
+        self.checkpoint_at = datetime.utcnow()
+        return len(changed)
+
+    def restore(self, db: Database, bootstrap_days: int = 60, batch_size: int = 1000) -> int:
+        """
+        Load the last checkpoint and replay predictions stored after it
+        (blocking). Returns the number of predictions replayed.
+
+        The replay builds a separate detector, so write hook flushes are not
+        held up meanwhile: their predictions are queued and observed once
+        the restored state is swapped in.
+        """
+        with self._lock:
+            self._restoring = True
+        try:
+            fresh = OutbreakDetector(
+                lam=self.lam,
+                k=self.k,
+                h=self.h,
+                spike_z=self.spike_z,
+                min_days=self.min_days,
+                min_cases=self.min_cases,
+                min_tested=self.min_tested,
+            )
+            replayed = fresh._replay(db, bootstrap_days, batch_size)
+        except BaseException as e:
+            # Keep the current state and catch up on what was queued
+            with self._lock:
+                self.restore_error = f"{type(e).__name__}: {e}"
+                self._restoring = False
+                self._observe_all(self._pending)
+                self._pending = []
+                outbox, self._outbox = self._outbox, []
+            self._store_alerts(db, outbox)
+            raise
+
+        with self._lock:
+            self._series = fresh._series
+            self._recent = fresh._recent
+            self._replayed = fresh._replayed
+            self.watermark = fresh.watermark
+            for name, count in fresh._counters.items():
+                self._counters[name] += count
+            self._observe_all(self._pending)
+            self._pending = []
+            self._restoring = False
+            self.restored = True
+            self.restore_error = None
+            outbox, self._outbox = fresh._outbox + self._outbox, []
+        self._store_alerts(db, outbox)
+        return replayed
+
+    def _replay(self, db: Database, bootstrap_days: int, batch_size: int) -> int:
+        """Load the checkpoint into this (not yet shared) detector and replay the predictions after it."""
+        active = {alert["alertId"]: alert for alert in db[ALERTS_COLLECTION].find({"status": "active"}, {"_id": 0})}
+        meta = None
+        for doc in db[STATE_COLLECTION].find():
+            if doc["_id"] == META_ID:
+                meta = doc
+                continue
+            state_id = doc["_id"]
+            key = (state_id["metric"], state_id["region"], state_id["organism"], state_id["antibiotic"])
+            series = self._series[key] = Series.from_doc(doc)
+            series.alert = active.get(doc.get("alertId"))
+        self._recent.extend(sorted(active.values(), key=lambda alert: alert["raised_at"]))
+
+        if meta is not None and meta.get("watermark") is not None:
+            self.watermark = meta["watermark"]
+            query: Dict[str, Any] = {"_id": {"$gt": meta["watermark"]}}
+        elif meta is None:
+            query = {"created_at": {"$gte": datetime.utcnow() - timedelta(days=bootstrap_days)}}
+        else:
+            return 0
+
+        replayed = 0
+        for doc in db.predictions.find(query).sort("created_at", ASCENDING).batch_size(batch_size):
+            self._observe(doc)
+            self._replayed.add(doc["_id"])
+            replayed += 1
+        return replayed
+
+
+def _state_id(key: SeriesKey) -> Dict[str, Any]:
+    metric, region, organism, antibiotic = key
+    return {"metric": metric, "region": region, "organism": organism, "antibiotic": antibiotic}
+
+
+outbreaks = OutbreakDetector.from_env()
+
+
+async def checkpoint_periodically(interval_s: float, get_db: Callable[[], Optional[Database]]) -> None:
+    """
+    Checkpoint the detector every `interval_s` seconds while a database is
+    available. After a failed restore, it retries the restore instead, as
+    checkpoints stay off until one succeeds.
+    """
+    while True:
+        await asyncio.sleep(interval_s)
+        db = get_db()
+        if db is None:
+            continue
+        if outbreaks.restore_error is not None:
+            try:
+                replayed = await run_write(outbreaks.restore, db, OUTBREAK_BOOTSTRAP_DAYS)
+                logger.info("✅ Outbreak detector restored (%d predictions replayed)", replayed)
+            except Exception as e:
+                logger.warning("⚠️  Could not restore the outbreak detector: %s: %s", type(e).__name__, e)
+            continue
+        try:
+            await run_write(outbreaks.checkpoint, db)
+        except Exception as e:
+            logger.warning("⚠️  Outbreak detector checkpoint failed: %s: %s", type(e).__name__, e)
+
+
+def rebuild_outbreak_state(db: Database, bootstrap_days: int = 60) -> int:
+    """
+    Discard the checkpoint and rebuild it from the last `bootstrap_days` of
+    predictions (blocking). Open alerts are resolved first. Returns the
+    number of predictions replayed.
+    """
+    now = datetime.utcnow()
+    db[ALERTS_COLLECTION].update_many(
+        {"status": "active"}, {"$set": {"status": "resolved", "resolved_at": now, "updated_at": now}}
+    )
+    db[STATE_COLLECTION].drop()
+    detector = OutbreakDetector.from_env()
+    replayed = detector.restore(db, bootstrap_days)
+    detector.checkpoint(db)
+    return replayed
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage the outbreak detector checkpoint.")
+    parser.add_argument(
+        "command", choices=["rebuild"], help="rebuild: replay the last OUTBREAK_BOOTSTRAP_DAYS days into a new checkpoint"
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    database = client[os.getenv("DB_NAME", "amr_db")]
+    if args.command == "rebuild":
+        replayed = rebuild_outbreak_state(database, OUTBREAK_BOOTSTRAP_DAYS)
+        print(f"✅ Replayed {replayed} predictions into '{STATE_COLLECTION}'")
+    client.close()
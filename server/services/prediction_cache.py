@@ -0,0 +1,190 @@
+"""
+Content-addressed cache of prediction results.
+
+Labs re-upload the same spectrum file when a case is reopened or a batch
+is retried. The cache key is a SHA-256 over the upload bytes, the model
+version and the organism (the only form field the model sees), so a
+re-upload skips parsing, preprocessing and inference.
+
+Two tiers:
+
+1. an in-process LRU with a TTL, and
+2. the `prediction_cache` MongoDB collection, which survives restarts and
+   is shared between API processes; a TTL index expires its entries.
+
+Entries are tagged with the model version. When the registry serves a new
+version, the in-process tier is cleared and the previous version's
+documents are deleted from MongoDB; they could no longer be hit anyway
+since the version is part of the key.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from pymongo import ASCENDING
+from pymongo.database import Database
+
+from services.database import run_read, run_write
+from services.spectra import CHUNK_SIZE, MAX_UPLOAD_BYTES, UploadTooLargeError
+
+
+CACHE_COLLECTION = "prediction_cache"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+
+def upload_digest(upload: Any, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """SHA-256 of an `UploadFile`'s bytes (blocking; run it off the event loop)."""
+    digest = hashlib.sha256()
+    total = 0
+    upload.file.seek(0)
+    while True:
+        chunk = upload.file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+        digest.update(chunk)
+    upload.file.seek(0)
+    return digest.hexdigest()
+
+
+def cache_key(content_digest: str, version: str, organism: Optional[str]) -> str:
+    """Key of one (spectrum, model version, organism) combination."""
+    material = "\x00".join([version, (organism or "").strip(), content_digest])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def ensure_cache_indexes(db: Database) -> None:
+    """TTL index so MongoDB drops expired entries, plus the version used for invalidation."""
+    cache = db[CACHE_COLLECTION]
+    cache.create_index([("expires_at", ASCENDING)], name="expires_at", expireAfterSeconds=0)
+    cache.create_index([("version", ASCENDING)], name="version")
+
+
+class PredictionCache:
+    """In-process LRU with TTL in front of a MongoDB-backed second tier."""
+
+    def __init__(self, max_entries: int = PREDICTION_CACHE_SIZE, ttl_s: float = PREDICTION_CACHE_TTL_S):
+        self.max_entries = max(0, max_entries)
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._purge: Optional[asyncio.Future] = None
+        self._counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_s > 0
+
+    def _check_version(self, db: Optional[Database], version: str) -> None:
+        """Drop every entry made by another model version."""
+        if version == self._version:
+            return
+        with self._lock:
+            previous, self._version = self._version, version
+            self._entries.clear()
+            if previous is not None:
+                self._counters["invalidations"] += 1
+        if previous is not None and db is not None:
+            self._purge = asyncio.ensure_future(self._purge_store(db, previous))
+
+    async def _purge_store(self, db: Database, version: str) -> None:
+        try:
+            await run_write(db[CACHE_COLLECTION].delete_many, {"version": version})
+        except Exception:
+            # Stale entries are unreachable (the version is part of the key) and expire anyway
+            pass
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    async def get(self, db: Optional[Database], key: str, version: str) -> Optional[Dict[str, Any]]:
+        """The cached value for `key`, looking in memory first and then in MongoDB."""
+        if not self.enabled:
+            return None
+        self._check_version(db, version)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if db is not None:
+            try:
+                doc = await run_read(
+                    db[CACHE_COLLECTION].find_one,
+                    {"_id": key, "version": version, "expires_at": {"$gt": datetime.utcnow()}},
+                )
+            except Exception:
+                doc = None
+            if doc is not None:
+                remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+                self._remember(key, doc["value"], time.monotonic() + remaining)
+                with self._lock:
+                    self._counters["store_hits"] += 1
+                return doc["value"]
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    async def put(self, db: Optional[Database], key: str, version: str, value: Dict[str, Any]) -> None:
+        """Store `value` in both tiers; failures of the MongoDB tier are ignored."""
+        if not self.enabled:
+            return
+        self._check_version(db, version)
+        self._remember(key, value, time.monotonic() + self.ttl_s)
+        if db is not None:
+            try:
+                await run_write(
+                    db[CACHE_COLLECTION].replace_one,
+                    {"_id": key},
+                    {
+                        "_id": key,
+                        "version": version,
+                        "value": value,
+                        "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_s),
+                    },
+                    upsert=True,
+                )
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters since startup."""
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        hits = counters["memory_hits"] + counters["store_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "version": self._version,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+prediction_cache = PredictionCache()
@@ -0,0 +1,160 @@
+"""
+Vectorised spectrum preprocessing.
+
+Turns raw spectra into fixed-length feature vectors for the prediction
+model, in the usual MALDI-TOF order:
+
+1. trim to the configured m/z range,
+2. baseline correction (rolling-minimum baseline subtracted, clipped at 0),
+3. smoothing (centred moving average),
+4. TIC normalisation (each spectrum sums to 1 inside the range),
+5. binning into a fixed m/z grid.
+
+Every step is a NumPy array operation along the last axis, so the same code
+handles a single spectrum (1-D) and a stacked batch (2-D, one row per
+spectrum) without Python-level loops over peaks.
+"""
+
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from services.spectra import Spectrum
+
+
+@dataclass(frozen=True)
+class PreprocessingConfig:
+    """Parameters of the preprocessing pipeline; must match the model's training setup."""
+
+    mz_min: float = 2000.0
+    mz_max: float = 20000.0
+    bin_width: float = 3.0
+    baseline_window: int = 101
+    smoothing_window: int = 11
+
+    @property
+    def n_bins(self) -> int:
+        return int(np.ceil((self.mz_max - self.mz_min) / self.bin_width))
+
+    def bin_edges(self) -> np.ndarray:
+        return self.mz_min + self.bin_width * np.arange(self.n_bins + 1)
+
+
+DEFAULT_CONFIG = PreprocessingConfig()
+
+
+def _odd(window: int) -> int:
+    return window if window % 2 else window + 1
+
+
+def _rolling(values: np.ndarray, window: int, reducer: str) -> np.ndarray:
+    """Centred rolling min/mean along the last axis, edges padded with the edge value."""
+    window = _odd(max(1, window))
+    if window == 1 or values.shape[-1] == 0:
+        return values
+    half = window // 2
+    pad = [(0, 0)] * (values.ndim - 1) + [(half, half)]
+    padded = np.pad(values, pad, mode="edge")
+    if reducer == "min":
+        return _rolling_min(padded, window)
+    # Moving average via cumulative sums: O(n) regardless of window size
+    cumsum = np.cumsum(padded, axis=-1, dtype=np.float64)
+    zero = np.zeros(values.shape[:-1] + (1,))
+    cumsum = np.concatenate([zero, cumsum], axis=-1)
+    return (cumsum[..., window:] - cumsum[..., :-window]) / window
+
+
+def _rolling_min(padded: np.ndarray, window: int) -> np.ndarray:
+    """
+    Sliding-window minimum along the last axis in O(n) (van Herk/Gil-Werman).
+
+    The row is cut into blocks of `window` values; each window minimum is the
+    smaller of a block-suffix minimum and the next block's prefix minimum.
+    """
+    length = padded.shape[-1]
+    n_out = length - window + 1
+    n_blocks = -(-length // window)
+    fill = [(0, 0)] * (padded.ndim - 1) + [(0, n_blocks * window - length)]
+    blocks = np.pad(padded, fill, constant_values=np.inf).reshape(padded.shape[:-1] + (n_blocks, window))
+    prefix = np.minimum.accumulate(blocks, axis=-1).reshape(padded.shape[:-1] + (-1,))
+    suffix = np.minimum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape[:-1] + (-1,))
+    return np.minimum(suffix[..., :n_out], prefix[..., window - 1:window - 1 + n_out])
+
+
+def _trim_shared_axis(
+    mz: np.ndarray, intensity: np.ndarray, config: PreprocessingConfig
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Drop the columns outside the m/z range when all spectra share one axis.
+
+    Keeps enough points beyond each end for the baseline and smoothing
+    windows, so in-range values match processing the untrimmed spectrum.
+    """
+    margin = _odd(config.baseline_window) // 2 + _odd(config.smoothing_window) // 2
+    lo, hi = np.searchsorted(mz, [config.mz_min, config.mz_max], side="left")
+    lo, hi = max(0, lo - margin), min(mz.shape[0], hi + margin)
+    return mz[lo:hi], intensity[..., lo:hi]
+
+
+def preprocess(
+    mz: np.ndarray,
+    intensity: np.ndarray,
+    config: PreprocessingConfig = DEFAULT_CONFIG,
+) -> np.ndarray:
+    """
+    Preprocess one spectrum or a batch into binned float32 features.
+
+    `intensity` is 1-D (one spectrum) or 2-D (n_spectra x n_points). `mz` is
+    either a sorted 1-D axis shared by every row or an array of the same
+    shape as `intensity`. Returns shape (n_bins,) or (n_spectra, n_bins).
+    """
+    intensity = np.asarray(intensity, dtype=np.float64)
+    mz = np.asarray(mz, dtype=np.float64)
+    single = intensity.ndim == 1
+    if single:
+        intensity = intensity[np.newaxis, :]
+    if mz.ndim == 1:
+        mz, intensity = _trim_shared_axis(mz, intensity, config)
+        mz = np.broadcast_to(mz, intensity.shape)
+    elif single:
+        mz = mz[np.newaxis, :]
+    if mz.shape != intensity.shape:
+        raise ValueError(f"m/z shape {mz.shape} does not match intensity shape {intensity.shape}")
+
+    n_spectra = intensity.shape[0]
+    in_range = (mz >= config.mz_min) & (mz < config.mz_max)
+
+    corrected = np.clip(intensity - _rolling(intensity, config.baseline_window, "min"), 0.0, None)
+    smoothed = _rolling(corrected, config.smoothing_window, "mean")
+    smoothed = np.where(in_range, smoothed, 0.0)
+
+    tic = smoothed.sum(axis=-1, keepdims=True)
+    normalised = np.divide(smoothed, tic, out=np.zeros_like(smoothed), where=tic > 0)
+
+    n_bins = config.n_bins
+    bins = np.floor((mz - config.mz_min) / config.bin_width).astype(np.int64)
+    np.clip(bins, 0, n_bins - 1, out=bins)
+    flat = (bins + n_bins * np.arange(n_spectra)[:, np.newaxis])[in_range]
+    features = np.bincount(flat, weights=normalised[in_range], minlength=n_spectra * n_bins)
+    features = features.reshape(n_spectra, n_bins).astype(np.float32)
+    return features[0] if single else features
+
+
+def preprocess_spectra(
+    spectra: Sequence[Spectrum],
+    config: PreprocessingConfig = DEFAULT_CONFIG,
+) -> np.ndarray:
+    """
+    Preprocess parsed uploads into an (n_spectra, n_bins) float32 matrix.
+
+    Spectra that share an m/z axis (the common case for one instrument run)
+    are processed as a single 2-D batch; otherwise each is processed on its
+    own and the rows are stacked.
+    """
+    if not spectra:
+        return np.zeros((0, config.n_bins), dtype=np.float32)
+    first_mz = spectra[0].mz
+    if all(s.mz.shape == first_mz.shape and np.array_equal(s.mz, first_mz) for s in spectra):
+        return preprocess(first_mz, np.stack([s.intensity for s in spectra]), config)
+    return np.stack([preprocess(s.mz, s.intensity, config) for s in spectra])
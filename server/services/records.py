@@ -0,0 +1,200 @@
+"""
+Filtering, keyset pagination and serialisation of raw prediction records.
+
+Records are ordered newest first by (`created_at`, `_id`). A page cursor
+holds the sort key of the last record returned, and the next page starts
+strictly after it, so every page is an index range scan no matter how deep
+the client has paged (no `skip`).
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import base64
+import csv
+import io
+import itertools
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, UpdateOne
+
+from services.regions import canonical_region
+from services.responses import dumps
+
+
+SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+CSV_COLUMNS = [
+    "id",
+    "created_at",
+    "patientId",
+    "region",
+    "district",
+    "bacterialSpecies",
+    "susceptibleAntibiotics",
+    "resistantAntibiotics",
+    "confidence",
+    "patientAge",
+    "patientGender",
+    "model_version",
+]
+
+# Fields that only matter inside the API (cache keys, upload and write bookkeeping)
+_INTERNAL_FIELDS = (
+    "organism_input", "region_input", "spectrum_sha256", "stored_at", "hooks_pending", "hooks_claim",
+    "organism_key", "antibiotic_keys",
+)
+
+
+class InvalidCursorError(ValueError):
+    """The page cursor is malformed or was not issued by this API."""
+
+
+def search_key(value: Any) -> Optional[str]:
+    """
+    Trimmed, lower-cased form of an organism or antibiotic name.
+
+    Stored next to the name at write time, so filters that ignore case
+    match it exactly (and use an index) instead of with a regex.
+    """
+    if value is None:
+        return None
+    key = str(value).strip().lower()
+    return key or None
+
+
+def prediction_keys(prediction: Dict[str, Any]) -> Dict[str, Any]:
+    """`organism_key` and `antibiotic_keys` (both result lists) of a prediction document."""
+    antibiotics = (prediction.get("susceptibleAntibiotics") or []) + (prediction.get("resistantAntibiotics") or [])
+    return {
+        "organism_key": search_key(prediction.get("bacterialSpecies")),
+        "antibiotic_keys": sorted({key for key in map(search_key, antibiotics) if key}),
+    }
+
+
+def organism_keys(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """`organism_key` of a document with an `organism` field (rollup rows, outbreak alerts)."""
+    return {"organism_key": search_key(doc.get("organism"))}
+
+
+def backfill_search_keys(
+    collection: Any, keys: Callable[[Dict[str, Any]], Dict[str, Any]], batch_size: int = 1000
+) -> int:
+    """
+    Store the search keys of documents written before they existed
+    (blocking). Returns the number of documents updated.
+    """
+    updated = 0
+    operations: List[Any] = []
+    for doc in collection.find({"organism_key": {"$exists": False}}):
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": keys(doc)}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def prediction_filter(
+    region: Optional[str] = None,
+    organism: Optional[str] = None,
+    antibiotic: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Query on `predictions` for the given filters.
+
+    `region` is resolved through the gazetteer (a district name matches only
+    that district); `antibiotic` matches either result list. Names are
+    matched exactly against the canonical region and the search keys, so
+    every filter can use an index.
+    """
+    query: Dict[str, Any] = {}
+    if region:
+        location = canonical_region(region)
+        if location["district"]:
+            query["region_id"] = location["region_id"]
+        else:
+            query["region"] = location["region"]
+    if organism:
+        query["organism_key"] = search_key(organism)
+    if antibiotic:
+        query["antibiotic_keys"] = search_key(antibiotic)
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    return query
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just past `doc` in the sort order."""
+    created_at = doc.get("created_at")
+    payload = {"t": created_at.isoformat() if created_at else None, "id": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.fromisoformat(payload["t"]) if payload["t"] else None
+        return created_at, ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def after_cursor(query: Dict[str, Any], cursor: str) -> Dict[str, Any]:
+    """Restrict `query` to records that sort after `cursor` (newest first)."""
+    created_at, last_id = decode_cursor(cursor)
+    if created_at is None:
+        # Records without created_at sort last; page through them by _id alone
+        keyset: Dict[str, Any] = {"created_at": None, "_id": {"$lt": last_id}}
+    else:
+        keyset = {
+            "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": last_id}},
+                {"created_at": None},
+            ]
+        }
+    return {"$and": [query, keyset]} if query else keyset
+
+
+def serialise(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-ready copy of a prediction document, with `_id` exposed as `id`."""
+    record = {"id": str(doc["_id"])}
+    for key, value in doc.items():
+        if key == "_id" or key in _INTERNAL_FIELDS:
+            continue
+        record[key] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+
+def to_ndjson(records: List[Dict[str, Any]]) -> bytes:
+    return b"".join(dumps(record) + b"\n" for record in records)
+
+
+def to_csv(records: List[Dict[str, Any]], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    for record in records:
+        row = dict(record)
+        for name in ("susceptibleAntibiotics", "resistantAntibiotics"):
+            if isinstance(row.get(name), list):
+                row[name] = ";".join(row[name])
+        writer.writerow(row)
+    return buffer.getvalue().encode("utf-8")
+
+
+def take(cursor: Iterator[Dict[str, Any]], size: int) -> List[Dict[str, Any]]:
+    """Next `size` serialised records from a pymongo cursor (blocking)."""
+    return [serialise(doc) for doc in itertools.islice(cursor, size)]
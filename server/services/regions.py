@@ -0,0 +1,325 @@
+"""
+Region gazetteer: canonical region names, aliases and point-in-polygon lookup.
+
+The registry is loaded once from `REGIONS_PATH` (by default the bundled
+`data/regions.json`). Each region has an id, a display name, a level
+(`province` or `district`; districts name their `parent` province), a
+representative point and optional aliases and GeoJSON geometry:
+
+    {"regions": [
+        {"id": "kpk", "name": "KPK", "level": "province", "lat": 34.0, "lng": 71.5,
+         "aliases": ["khyber pakhtunkhwa", "nwfp"],
+         "geometry": {"type": "Polygon", "coordinates": [[[69.5, 31.0], ...]]}},
+        {"id": "kpk/peshawar", "name": "Peshawar", "level": "district", "parent": "kpk", ...}
+    ]}
+
+Names and aliases are normalised (case, punctuation, words like
+"province"/"district") into one dict, so resolving free text is a single
+lookup; multi-part inputs such as "Lahore, Punjab" fall back to looking up
+their parts. Polygons are bucketed into a coarse lat/lng grid, so locating
+a point only ray-casts the few polygons whose cell it falls in.
+
+Predictions are canonicalised with `canonical_region` when they are
+written: `region` holds the province display name, which the rollups and
+surveillance endpoints group by.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "regions.json")
+
+# Side of a spatial index cell in degrees
+GRID_CELL_DEG = 1.0
+
+# Districts without polygons are matched to a located point by their representative point within this radius
+DISTRICT_RADIUS_KM = 40.0
+
+# Words dropped when normalising names ("Punjab Province" -> "punjab")
+_NOISE_WORDS = {"province", "district", "division", "city", "region", "territory", "the", "of", "pakistan"}
+
+Ring = Tuple[Tuple[float, float], ...]
+
+
+def normalise(name: Any) -> str:
+    """Lower-cased name with punctuation and noise words removed ("Gilgit-Baltistan" -> "gilgit baltistan")."""
+    words = re.sub(r"[^0-9a-z]+", " ", str(name).lower()).split()
+    return " ".join(word for word in words if word not in _NOISE_WORDS)
+
+
+@dataclass(frozen=True)
+class Region:
+    id: str
+    name: str
+    level: str
+    lat: float
+    lng: float
+    parent: Optional[str] = None
+    aliases: Tuple[str, ...] = ()
+    # Outer rings of the region's polygons as (lng, lat) pairs; holes are ignored
+    rings: Tuple[Ring, ...] = field(default=(), repr=False)
+
+    @property
+    def province_id(self) -> str:
+        return self.parent or self.id
+
+
+def _outer_rings(geometry: Optional[Dict[str, Any]]) -> Tuple[Ring, ...]:
+    if not geometry:
+        return ()
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry.get('type')}")
+    return tuple(tuple((float(lng), float(lat)) for lng, lat, *_ in polygon[0]) for polygon in polygons if polygon)
+
+
+def _bbox(ring: Ring) -> Tuple[float, float, float, float]:
+    lngs = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return min(lngs), min(lats), max(lngs), max(lats)
+
+
+def _contains(ring: Ring, lng: float, lat: float) -> bool:
+    """Even-odd ray casting test of (lng, lat) against a closed or open ring."""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _ring_area(ring: Ring) -> float:
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))) / 2
+
+
+def _distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle (haversine) distance."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class RegionRegistry:
+    """In-memory gazetteer with an alias index and a grid spatial index."""
+
+    def __init__(self, regions: Sequence[Region]):
+        self.regions: Dict[str, Region] = {}
+        self._aliases: Dict[str, Region] = {}
+        self._districts: Dict[str, List[Region]] = {}
+        # cell -> [(area, bbox, ring, region)], smallest polygons first
+        self._grid: Dict[Tuple[int, int], List[Tuple[float, Tuple[float, float, float, float], Ring, Region]]] = {}
+
+        for region in regions:
+            if region.id in self.regions:
+                raise ValueError(f"Duplicate region id: {region.id}")
+            self.regions[region.id] = region
+        for region in self.regions.values():
+            if region.parent is not None:
+                if region.parent not in self.regions:
+                    raise ValueError(f"Region {region.id} has unknown parent {region.parent}")
+                self._districts.setdefault(region.parent, []).append(region)
+
+        # Provinces first so a district sharing a province's name does not shadow it
+        for region in sorted(self.regions.values(), key=lambda r: r.parent is not None):
+            for name in (region.name, region.id.rsplit("/", 1)[-1], *region.aliases):
+                self._aliases.setdefault(normalise(name), region)
+        self._aliases.pop("", None)
+
+        for region in self.regions.values():
+            for ring in region.rings:
+                self._index(region, ring)
+        for entries in self._grid.values():
+            entries.sort(key=lambda entry: entry[0])
+
+    def _index(self, region: Region, ring: Ring) -> None:
+        bbox = _bbox(ring)
+        area = _ring_area(ring)
+        min_lng, min_lat, max_lng, max_lat = bbox
+        for x in range(math.floor(min_lng / GRID_CELL_DEG), math.floor(max_lng / GRID_CELL_DEG) + 1):
+            for y in range(math.floor(min_lat / GRID_CELL_DEG), math.floor(max_lat / GRID_CELL_DEG) + 1):
+                self._grid.setdefault((x, y), []).append((area, bbox, ring, region))
+
+    @classmethod
+    def load(cls, path: str) -> "RegionRegistry":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        entries = data["regions"] if isinstance(data, dict) else data
+        return cls([
+            Region(
+                id=str(entry["id"]),
+                name=entry["name"],
+                level=entry.get("level", "district" if entry.get("parent") else "province"),
+                lat=float(entry["lat"]),
+                lng=float(entry["lng"]),
+                parent=entry.get("parent"),
+                aliases=tuple(entry.get("aliases", [])),
+                rings=_outer_rings(entry.get("geometry")),
+            )
+            for entry in entries
+        ])
+
+    @classmethod
+    def from_env(cls) -> "RegionRegistry":
+        """Load `REGIONS_PATH`, falling back to the bundled gazetteer when it is missing or empty."""
+        path = os.getenv("REGIONS_PATH", DEFAULT_REGIONS_PATH)
+        if path != DEFAULT_REGIONS_PATH and not (os.path.isfile(path) and os.path.getsize(path) > 0):
+            logger.warning("⚠️  Region gazetteer %s not found or empty; using the bundled one", path)
+            path = DEFAULT_REGIONS_PATH
+        return cls.load(path)
+
+    def provinces(self) -> Iterator[Region]:
+        return (region for region in self.regions.values() if region.parent is None)
+
+    def province(self, region: Region) -> Region:
+        return self.regions[region.province_id]
+
+    def resolve(self, name: Any) -> Optional[Region]:
+        """
+        Region named by free text, or None.
+
+        Tries the whole name, then its comma/slash separated parts (preferring
+        a district), then runs of words, longest first, so "Punjab district X"
+        still resolves to Punjab.
+        """
+        if name is None:
+            return None
+        key = normalise(name)
+        if not key:
+            return None
+        region = self._aliases.get(key)
+        if region is not None:
+            return region
+
+        parts = [normalise(part) for part in re.split(r"[,;/|()]", str(name))]
+        matches = [self._aliases[part] for part in parts if part in self._aliases]
+        if matches:
+            return min(matches, key=lambda r: r.parent is None)
+
+        words = key.split()
+        for size in range(len(words) - 1, 0, -1):
+            for offset in range(len(words) - size + 1):
+                region = self._aliases.get(" ".join(words[offset:offset + size]))
+                if region is not None:
+                    return region
+        return None
+
+    def locate(self, lat: float, lng: float) -> Optional[Region]:
+        """Most specific region containing the point, or None outside every polygon."""
+        cell = (math.floor(lng / GRID_CELL_DEG), math.floor(lat / GRID_CELL_DEG))
+        found: Optional[Region] = None
+        for _, (min_lng, min_lat, max_lng, max_lat), ring, region in self._grid.get(cell, ()):
+            if min_lng <= lng <= max_lng and min_lat <= lat <= max_lat and _contains(ring, lng, lat):
+                found = region
+                break
+        if found is None or found.parent is not None:
+            return found
+
+        # Point is in a province; refine to the nearest of its districts that has no polygon of its own
+        nearest: Optional[Tuple[float, Region]] = None
+        for district in self._districts.get(found.id, ()):
+            if district.rings:
+                continue
+            distance = _distance_km(lat, lng, district.lat, district.lng)
+            if distance <= DISTRICT_RADIUS_KM and (nearest is None or distance < nearest[0]):
+                nearest = (distance, district)
+        return nearest[1] if nearest else found
+
+
+def canonical_region(
+    region: Optional[str],
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    registry: Optional[RegionRegistry] = None,
+) -> Dict[str, Any]:
+    """
+    Region fields to store on a prediction.
+
+    An explicit region name wins; coordinates are used when no name is given
+    or it is not in the gazetteer. Unknown names are kept as entered
+    (trimmed) with no `region_id`.
+    """
+    registry = registry or regions
+    match = registry.resolve(region)
+    if match is None and lat is not None and lng is not None:
+        match = registry.locate(lat, lng)
+    if match is None:
+        text = region.strip() if isinstance(region, str) else region
+        return {"region": text or None, "district": None, "region_id": None}
+    province = registry.province(match)
+    return {
+        "region": province.name,
+        "district": match.name if match.parent is not None else None,
+        "region_id": match.id,
+    }
+
+
+def canonicalise_predictions(db: Any, batch_size: int = 1000, registry: Optional[RegionRegistry] = None) -> int:
+    """
+    Rewrite the region fields of predictions stored before canonicalisation.
+
+    Touches predictions without a `region_id` field; the original text is kept
+    in `region_input`. Returns the number of predictions updated. Rebuild the
+    rollups afterwards (`python -m services.rollups rebuild`).
+    """
+    from pymongo import UpdateOne
+
+    registry = registry or regions
+    updated = 0
+    operations: List[Any] = []
+    cursor = db.predictions.find({"region_id": {"$exists": False}}, {"region": 1, "region_input": 1})
+    for doc in cursor:
+        original = doc.get("region_input", doc.get("region"))
+        fields = canonical_region(original, registry=registry)
+        fields["region_input"] = original
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            updated += db.predictions.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += db.predictions.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+regions = RegionRegistry.from_env()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Inspect the region gazetteer or canonicalise stored predictions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    resolve_parser = subparsers.add_parser("resolve", help="resolve a region name or lat,lng")
+    resolve_parser.add_argument("query", help='a region name, or "lat,lng"')
+    subparsers.add_parser("canonicalise", help="rewrite region fields of predictions stored before canonicalisation")
+    args = parser.parse_args()
+
+    if args.command == "resolve":
+        coords = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*", args.query)
+        if coords:
+            print(json.dumps(canonical_region(None, float(coords.group(1)), float(coords.group(2)))))
+        else:
+            print(json.dumps(canonical_region(args.query)))
+    else:
+        load_dotenv()
+        client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+        database = client[os.getenv("DB_NAME", "amr_db")]
+        print(f"✅ Canonicalised {canonicalise_predictions(database)} prediction(s); now run `python -m services.rollups rebuild`")
+        client.close()
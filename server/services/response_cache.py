@@ -0,0 +1,167 @@
+"""
+Cached JSON responses with ETags for read-mostly endpoints.
+
+Entries are keyed by endpoint and query parameters and tagged with a data
+generation counter. Writers call `bump()` after storing new data, which
+makes every older entry stale at once; `SURVEILLANCE_CACHE_TTL_S` bounds
+staleness for time-relative results (e.g. "last 30 days") and for data
+written by other API processes, whose bumps this process does not see.
+
+Each entry keeps its serialised body and an ETag derived from it, so a
+client revalidating with `If-None-Match` gets a 304 without the body and,
+while the entry is fresh, without any database work. Concurrent misses for
+the same key share one computation instead of stampeding the database.
+Bodies are compressed at most once per entry and encoding, so hits cost
+no compression either.
+"""
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from fastapi import Request, Response
+
+from services.compression import COMPRESSION_MIN_BYTES, compress_async, negotiate
+from services.responses import dumps
+
+
+class _Entry:
+    __slots__ = ("generation", "expires_at", "body", "etag", "encoded")
+
+    def __init__(self, generation: int, expires_at: float, body: bytes, etag: str):
+        self.generation = generation
+        self.expires_at = expires_at
+        self.body = body
+        self.etag = etag
+        # Compressed bodies by content encoding, filled on first use
+        self.encoded: Dict[str, bytes] = {}
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison of `If-None-Match` against `etag`, as RFC 9110 requires for GET."""
+    if not header:
+        return False
+    candidates = [_opaque_tag(tag) for tag in header.split(",")]
+    return "*" in candidates or _opaque_tag(etag) in candidates
+
+
+class ResponseCache:
+    """LRU of serialised responses, invalidated by a data generation counter."""
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 300.0):
+        self.max_entries = max(0, max_entries)
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._in_flight: Dict[Tuple[Hashable, int], asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "coalesced": 0}
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            max_entries=int(os.getenv("SURVEILLANCE_CACHE_SIZE", "256")),
+            ttl_s=float(os.getenv("SURVEILLANCE_CACHE_TTL_S", "300")),
+        )
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def bump(self, *_: Any) -> None:
+        """Mark all cached responses stale (safe to call from any thread, e.g. a write hook)."""
+        with self._lock:
+            self._generation += 1
+
+    def _fresh(self, key: Hashable, generation: int) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.generation != generation or entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: Hashable, entry: _Entry) -> None:
+        with self._lock:
+            # A bump during the computation means the result may already be outdated
+            if entry.generation != self._generation or self.max_entries == 0:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _compute(self, key: Hashable, generation: int, compute: Callable[[], Awaitable[Any]]) -> _Entry:
+        body = dumps(await compute())
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        entry = _Entry(generation, time.monotonic() + self.ttl_s, body, etag)
+        self._store(key, entry)
+        return entry
+
+    def _finished(self, flight_key: Tuple[Hashable, int], task: asyncio.Task) -> None:
+        self._in_flight.pop(flight_key, None)
+        if not task.cancelled():
+            # Retrieve the exception so it is not reported as unhandled when every caller has gone
+            task.exception()
+
+    async def respond(self, request: Request, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Response:
+        """
+        Serve `key` from the cache or from `compute()`, honouring `If-None-Match`.
+
+        `compute` returns a JSON-serialisable payload; exceptions it raises
+        propagate to every request waiting on that computation and nothing
+        is cached.
+        """
+        generation = self._generation
+        entry = self._fresh(key, generation)
+        if entry is not None:
+            self._counters["hits"] += 1
+        else:
+            flight_key = (key, generation)
+            task = self._in_flight.get(flight_key)
+            if task is not None:
+                self._counters["coalesced"] += 1
+            else:
+                self._counters["misses"] += 1
+                # A task of its own, so a disconnecting first caller does not cancel it for the others
+                task = asyncio.ensure_future(self._compute(key, generation, compute))
+                self._in_flight[flight_key] = task
+                task.add_done_callback(lambda done: self._finished(flight_key, done))
+            entry = await asyncio.shield(task)
+
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        encoding = negotiate(request.headers.get("accept-encoding")) if len(entry.body) >= COMPRESSION_MIN_BYTES else None
+        if encoding is not None:
+            # Same content, different bytes: a weak validator, as for any compressed variant
+            headers["ETag"] = "W/" + entry.etag
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self._counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(content=entry.body, media_type="application/json", headers=headers)
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = entry.encoded[encoding] = await compress_async(entry.body, encoding)
+        headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {"generation": self._generation, "entries": size, "ttl_s": self.ttl_s, **self._counters}
+
+
+surveillance_cache = ResponseCache.from_env()
@@ -0,0 +1,89 @@
+"""
+JSON responses encoded with orjson.
+
+FastAPI normally runs every return value through `jsonable_encoder`, which
+walks the whole payload in Python and builds a copy, before `json.dumps`
+walks it again. Routes declared with `route_class=OrjsonRoute` skip that:
+
+- plain payloads (dicts, lists, datetimes, ObjectIds, numpy values) go
+  straight to `orjson.dumps`;
+- routes with a `response_model` validate the return value against it and
+  let pydantic write the JSON, so the model still filters the fields.
+
+Responses returned by the endpoint itself (streams, cached bodies) are
+passed through untouched. `response_model_exclude_*` options are not
+supported on these routes.
+"""
+
+from decimal import Decimal
+from typing import Any, Callable, Coroutine, Optional
+
+import asyncio
+import functools
+
+import orjson
+from bson import ObjectId
+from fastapi import Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter
+from starlette.routing import request_response
+
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(by_alias=True)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialise `content` to compact JSON bytes."""
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class OrjsonResponse(Response):
+    """`JSONResponse` rendered by orjson."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+Endpoint = Callable[..., Coroutine[Any, Any, Any]]
+
+
+def _respond_directly(endpoint: Endpoint, response_model: Any, status_code: Optional[int]) -> Endpoint:
+    adapter = TypeAdapter(response_model) if response_model is not None else None
+
+    @functools.wraps(endpoint)
+    async def call(**kwargs: Any) -> Any:
+        result = await endpoint(**kwargs)
+        if isinstance(result, Response):
+            return result
+        if adapter is None:
+            body = dumps(result)
+        else:
+            body = adapter.dump_json(adapter.validate_python(result, from_attributes=True), by_alias=True)
+        return Response(content=body, status_code=status_code or 200, media_type="application/json")
+
+    return call
+
+
+class OrjsonRoute(APIRoute):
+    """API route whose return values are encoded by orjson (or pydantic), bypassing `jsonable_encoder`."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().__init__(path, endpoint, **kwargs)
+        if asyncio.iscoroutinefunction(endpoint):
+            # Dependencies were resolved from the original signature; only the call changes
+            self.dependant.call = _respond_directly(endpoint, self.response_model, self.status_code)
+            self.app = request_response(self.get_route_handler())
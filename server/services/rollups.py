@@ -0,0 +1,226 @@
+"""
+Incrementally maintained surveillance rollups.
+
+Every prediction contributes to one document in `surveillance_rollups`,
+keyed by (region, organism, day), holding the number of cases and the sum
+of per-prediction resistance rates. The surveillance endpoints aggregate
+these rows instead of scanning the raw `predictions` collection.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import argparse
+import logging
+import os
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.database import Database
+
+from services.records import search_key
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "surveillance_rollups"
+
+
+def region_key(region: Any) -> Optional[str]:
+    """Normalise a free-text region to the lower-cased key used for grouping."""
+    if region is None:
+        return None
+    key = str(region).strip().lower()
+    return key or None
+
+
+def resistance_rate(susceptible: List[str], resistant: List[str]) -> Optional[float]:
+    """Resistant / (susceptible + resistant), or None when no antibiotic was tested."""
+    total = len(susceptible) + len(resistant)
+    if total == 0:
+        return None
+    return len(resistant) / total
+
+
+def resistance_rate_expr() -> Dict[str, Any]:
+    """
+    Aggregation counterpart of `resistance_rate` for a prediction document.
+
+    Evaluates to null when the prediction lists no antibiotics so that
+    `$avg` skips it.
+    """
+    resistant = {"$size": {"$ifNull": ["$resistantAntibiotics", []]}}
+    susceptible = {"$size": {"$ifNull": ["$susceptibleAntibiotics", []]}}
+    total = {"$add": [resistant, susceptible]}
+    return {
+        "$cond": [
+            {"$gt": [total, 0]},
+            {"$divide": [resistant, total]},
+            None,
+        ]
+    }
+
+
+def ensure_rollup_indexes(db: Database) -> None:
+    """Create the unique rollup key and the day index used by range queries."""
+    rollups = db[ROLLUP_COLLECTION]
+    rollups.create_index(
+        [("region", ASCENDING), ("organism", ASCENDING), ("day", ASCENDING)],
+        name="region_organism_day",
+        unique=True,
+    )
+    rollups.create_index([("day", DESCENDING)], name="day")
+    # Organism filters match the lower-cased name exactly
+    rollups.create_index([("organism_key", ASCENDING), ("day", DESCENDING)], name="organism_key_day")
+
+
+def _rollup_increment(prediction: Dict[str, Any]) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """Rollup key (region, organism, day) and `$inc` document for one prediction."""
+    created_at: datetime = prediction.get("created_at") or datetime.utcnow()
+    rate = resistance_rate(
+        prediction.get("susceptibleAntibiotics") or [],
+        prediction.get("resistantAntibiotics") or [],
+    )
+    key = (
+        region_key(prediction.get("region")),
+        prediction.get("bacterialSpecies") or None,
+        datetime(created_at.year, created_at.month, created_at.day),
+    )
+    return key, {
+        "cases": 1,
+        "rated_cases": 0 if rate is None else 1,
+        "resistance_rate_sum": rate or 0.0,
+    }
+
+
+def _rollup_filter(key: Tuple[Any, ...]) -> Dict[str, Any]:
+    region, organism, day = key
+    return {"region": region, "organism": organism, "day": day}
+
+
+def _rollup_update(key: Tuple[Any, ...], inc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"$inc": inc, "$setOnInsert": {"organism_key": search_key(key[1])}}
+
+
+def record_prediction(db: Database, prediction: Dict[str, Any]) -> None:
+    """
+    Add a freshly inserted prediction to its rollup row.
+
+    Uses a single atomic `$inc` upsert, so concurrent workers can record
+    predictions for the same region/organism/day without coordination.
+    """
+    key, inc = _rollup_increment(prediction)
+    db[ROLLUP_COLLECTION].update_one(_rollup_filter(key), _rollup_update(key, inc), upsert=True)
+
+
+def record_predictions(db: Database, predictions: List[Dict[str, Any]]) -> None:
+    """
+    Batch counterpart of `record_prediction` for bulk inserts.
+
+    Increments for the same rollup row are combined first and the upserts
+    are sent in one unordered `bulk_write`.
+    """
+    increments: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for prediction in predictions:
+        key, inc = _rollup_increment(prediction)
+        total = increments.setdefault(key, {"cases": 0, "rated_cases": 0, "resistance_rate_sum": 0.0})
+        for field, value in inc.items():
+            total[field] += value
+
+    if increments:
+        db[ROLLUP_COLLECTION].bulk_write(
+            [UpdateOne(_rollup_filter(key), _rollup_update(key, inc), upsert=True) for key, inc in increments.items()],
+            ordered=False,
+        )
+
+
+def rebuild_rollups(db: Database) -> int:
+    """
+    Recompute `surveillance_rollups` from the full `predictions` history.
+
+    The aggregation writes with `$out`, which swaps the collection in
+    atomically and keeps its indexes. Predictions still waiting for their
+    `record_predictions` hook are left out, as the hook adds them; other
+    predictions recorded while the rebuild runs are not included, so run
+    it when ingest is quiet. Returns the number of rollup rows written.
+    """
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"hooks_pending": {"$ne": "record_predictions"}}},
+        {
+            "$project": {
+                "region": {
+                    "$cond": [
+                        {"$eq": [{"$type": "$region"}, "string"]},
+                        {"$toLower": {"$trim": {"input": "$region"}}},
+                        None,
+                    ]
+                },
+                "organism": {
+                    "$cond": [
+                        {"$eq": [{"$ifNull": ["$bacterialSpecies", ""]}, ""]},
+                        None,
+                        "$bacterialSpecies",
+                    ]
+                },
+                "day": {"$dateTrunc": {"date": "$created_at", "unit": "day"}},
+                "resistance_rate": resistance_rate_expr(),
+            }
+        },
+        {
+            "$group": {
+                "_id": {
+                    "region": {"$cond": [{"$eq": ["$region", ""]}, None, "$region"]},
+                    "organism": "$organism",
+                    "day": "$day",
+                },
+                "cases": {"$sum": 1},
+                "rated_cases": {"$sum": {"$cond": [{"$eq": ["$resistance_rate", None]}, 0, 1]}},
+                "resistance_rate_sum": {"$sum": {"$ifNull": ["$resistance_rate", 0]}},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "region": "$_id.region",
+                "organism": "$_id.organism",
+                "organism_key": {
+                    "$cond": [
+                        {"$eq": ["$_id.organism", None]},
+                        None,
+                        {"$toLower": {"$trim": {"input": "$_id.organism"}}},
+                    ]
+                },
+                "day": "$_id.day",
+                "cases": 1,
+                "rated_cases": 1,
+                "resistance_rate_sum": 1,
+            }
+        },
+        {"$out": ROLLUP_COLLECTION},
+    ]
+    db.predictions.aggregate(pipeline, allowDiskUse=True)
+    ensure_rollup_indexes(db)
+    return db[ROLLUP_COLLECTION].count_documents({})
+
+
+def backfill_if_empty(db: Database) -> None:
+    """Build the rollups on first start against a database that already has predictions."""
+    if db[ROLLUP_COLLECTION].estimated_document_count() == 0 and db.predictions.estimated_document_count() > 0:
+        logger.info("⏳ Building surveillance rollups from existing predictions...")
+        rows = rebuild_rollups(db)
+        logger.info("✅ Built %d surveillance rollup rows", rows)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage the surveillance rollup collection.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute rollups from all predictions")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    database = client[os.getenv("DB_NAME", "amr_db")]
+    if args.command == "rebuild":
+        print(f"✅ Wrote {rebuild_rollups(database)} rollup rows to '{ROLLUP_COLLECTION}'")
+    client.close()
@@ -0,0 +1,257 @@
+"""
+Dynamic micro-batching in front of the inference model.
+
+Concurrent `/api/prediction/run` requests each submit one feature vector.
+The scheduler collects them into micro-batches — up to `max_batch_size`
+rows, waiting at most `max_wait_ms` after the first row arrives — and runs
+each batch through `predict_batch` in a process pool, so inference neither
+holds the GIL of the API process nor blocks its event loop. Every caller
+awaits a future resolved with its own row of the batch result.
+
+Each row carries the model version its features were preprocessed for;
+batches never mix versions, so a hot-swap in the middle of a batch window
+cannot pair old-model features with the new model.
+"""
+
+from collections import Counter
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from services.inference import predict_batch
+from services.models import ModelRegistry, registry
+
+
+logger = logging.getLogger(__name__)
+
+QueueItem = Tuple[np.ndarray, Optional[str], Optional[str], asyncio.Future]
+
+
+class InferenceScheduler:
+    """Collects single predictions into micro-batches and runs them off the event loop."""
+
+    def __init__(
+        self,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        workers: int = 2,
+        start_method: str = "spawn",
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.workers = workers
+        self.start_method = start_method
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight: set = set()
+        self._batch_sizes: Counter = Counter()
+        self._requests = 0
+        self._busy_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "InferenceScheduler":
+        return cls(
+            max_batch_size=int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("INFERENCE_MAX_WAIT_MS", "5")),
+            workers=int(os.getenv("INFERENCE_WORKERS", "2")),
+            start_method=os.getenv("INFERENCE_START_METHOD", "spawn"),
+        )
+
+    def _new_executor(self) -> Executor:
+        if self.workers > 0:
+            # "spawn" (the default) keeps workers independent of the API process's threads
+            context = multiprocessing.get_context(self.start_method)
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        # INFERENCE_WORKERS=0: run in a thread instead, e.g. for debugging
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    @property
+    def running(self) -> bool:
+        return self._collector is not None and not self._collector.done()
+
+    def start(self) -> None:
+        """Start the worker pool and the batch collector on the running loop."""
+        if self.running:
+            return
+        if self._executor is None:
+            self._executor = self._new_executor()
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max(1, self.workers))
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        """Stop collecting, let in-flight batches finish and shut the pool down."""
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                *_, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Inference scheduler stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def submit(
+        self, features: np.ndarray, organism: Optional[str], version: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Queue one feature vector and wait for its prediction."""
+        if not self.running:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((features, organism, version, future))
+        return await future
+
+    async def predict_many(
+        self,
+        features: np.ndarray,
+        organisms: Sequence[Optional[str]],
+        version: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Run an already-assembled batch (e.g. a whole plate) directly in the pool."""
+        if not self.running:
+            self.start()
+        return await self._run_batch(features, list(organisms), version)
+
+    async def _run_batch(
+        self, features: np.ndarray, organisms: List[Optional[str]], version: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        async with self._slots:
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self._executor, predict_batch, features, organisms, version)
+            except BrokenExecutor:
+                # A worker died (e.g. OOM-killed); replace the pool for later batches
+                self._executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+                raise
+            self._busy_seconds += time.perf_counter() - started
+        self._batch_sizes[len(organisms)] += 1
+        self._requests += len(organisms)
+        return results
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[QueueItem] = [await self._queue.get()]
+            try:
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                # Wait for a free worker before dispatching, so requests arriving
+                # meanwhile join the next batch instead of queueing in the pool.
+                await self._slots.acquire()
+                self._slots.release()
+            except asyncio.CancelledError:
+                # Stopping: run what was already taken off the queue, so stop() waits for it
+                self._dispatch_all(batch)
+                raise
+            self._dispatch_all(batch)
+
+    def _dispatch_all(self, batch: List[QueueItem]) -> None:
+        by_version: Dict[Optional[str], List[QueueItem]] = {}
+        for item in batch:
+            by_version.setdefault(item[2], []).append(item)
+        for version, items in by_version.items():
+            task = asyncio.create_task(self._dispatch(items, version))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[QueueItem], version: Optional[str]) -> None:
+        try:
+            features = np.stack([features for features, _, _, _ in batch])
+            results = await self._run_batch(features, [organism for _, organism, _, _ in batch], version)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def warm_up(self, models: ModelRegistry = registry) -> float:
+        """
+        Run one tiny batch per worker so every pool process is spawned and has
+        the active model mapped before real traffic arrives. Returns elapsed ms.
+        """
+        if not self.running:
+            self.start()
+        version, config = models.snapshot()
+        started = time.perf_counter()
+        features = np.zeros((1, config.n_bins), dtype=np.float32)
+        # Concurrent batches force the pool to start all of its workers
+        await asyncio.gather(*(
+            self.predict_many(features, [None], version) for _ in range(max(1, self.workers))
+        ))
+        return round((time.perf_counter() - started) * 1000, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and batch-size statistics since startup."""
+        batches = sum(self._batch_sizes.values())
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_in_flight": len(self._in_flight),
+            "requests": self._requests,
+            "batches": batches,
+            "avg_batch_size": round(self._requests / batches, 2) if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            "busy_seconds": round(self._busy_seconds, 3),
+        }
+
+
+scheduler = InferenceScheduler.from_env()
+
+
+async def activate_model(version: Optional[str], models: ModelRegistry = registry) -> Dict[str, Any]:
+    """
+    Load `version` in the API process, then warm every inference worker on it.
+
+    The registry is marked ready only once the workers have the model mapped,
+    so `/health` reports not-ready while a cold start is still in progress.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, models.activate, version)
+    models.warmup_ms = await scheduler.warm_up(models)
+    models.ready = True
+    return models.status()
+
+
+async def watch_model_directory(interval_s: float, models: ModelRegistry = registry) -> None:
+    """Poll the model directory and hot-swap when `CURRENT` names a new version."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            if await loop.run_in_executor(None, models.reload_if_changed):
+                models.warmup_ms = await scheduler.warm_up(models)
+                logger.info("🔁 Serving model version %s", models.version)
+        except Exception as e:
+            logger.warning("⚠️  Model reload failed: %s: %s", type(e).__name__, e)
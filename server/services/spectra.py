@@ -0,0 +1,310 @@
+"""
+Streaming parsers for uploaded mass-spectrometry files.
+
+Uploads are read in fixed-size chunks and converted straight into
+contiguous float64 m/z and intensity arrays, so the raw text of a large
+MALDI-TOF export is never held in memory at once. Supported formats:
+
+- peak lists as CSV / TSV (optionally with a header row),
+- Bruker-style whitespace separated text exports (with `#` comments),
+- mzML (the first spectrum; 32/64-bit, optionally zlib-compressed arrays).
+
+Oversized or malformed uploads are rejected as soon as they are detected.
+"""
+
+from array import array
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import base64
+import codecs
+import io
+import os
+import xml.etree.ElementTree as ET
+import zlib
+
+import numpy as np
+
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "64")) * 1024 * 1024)
+CHUNK_SIZE = 1024 * 1024
+
+# Non-numeric lines tolerated before the first data row (titles, column names, metadata)
+MAX_HEADER_LINES = 64
+
+# PSI-MS controlled vocabulary accessions used by mzML binary data arrays
+_MZ_ARRAY = "MS:1000514"
+_INTENSITY_ARRAY = "MS:1000515"
+_FLOAT32 = "MS:1000521"
+_FLOAT64 = "MS:1000523"
+_ZLIB = "MS:1000574"
+
+
+class SpectrumParseError(ValueError):
+    """The upload is not a readable spectrum."""
+
+
+class UploadTooLargeError(SpectrumParseError):
+    """The upload exceeds the configured size limit."""
+
+
+@dataclass
+class Spectrum:
+    """A single mass spectrum as parallel, contiguous float64 arrays."""
+
+    mz: np.ndarray
+    intensity: np.ndarray
+    format: str
+
+    @property
+    def n_points(self) -> int:
+        return int(self.mz.shape[0])
+
+
+class _ChunkReader:
+    """Pull fixed-size chunks from a binary stream while enforcing the size limit."""
+
+    def __init__(self, stream: Any, max_bytes: int, chunk_size: int):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    def read(self) -> bytes:
+        chunk = self.stream.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.max_bytes:
+            raise UploadTooLargeError(
+                f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit"
+            )
+        return chunk
+
+
+def _detect_format(filename: str, head: bytes) -> str:
+    """Guess the file format from its extension and first bytes."""
+    name = (filename or "").lower()
+    if b"\x00" in head:
+        raise SpectrumParseError("Binary uploads are not supported; export the spectrum as text or mzML")
+    stripped = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+    if name.endswith(".mzml") or stripped.startswith(b"<?xml") or stripped.startswith(b"<mzML") or b"<mzML" in head:
+        return "mzml"
+    if name.endswith(".tsv"):
+        return "tsv"
+    if name.endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+def _delimiter_for(line: str) -> Optional[str]:
+    """Column delimiter of a data row: semicolon, tab, comma, or None for whitespace."""
+    for delimiter in (";", "\t", ","):
+        if delimiter in line:
+            return delimiter
+    return None
+
+
+def _is_data_row(line: str) -> bool:
+    fields = line.replace(",", " ").replace(";", " ").split()
+    if len(fields) < 2:
+        return False
+    try:
+        float(fields[0])
+        float(fields[1])
+    except ValueError:
+        return False
+    return True
+
+
+def _parse_text(reader: _ChunkReader, first_chunk: bytes, detected: str) -> Spectrum:
+    """Parse a delimited peak list chunk by chunk into float64 arrays."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    mz = array("d")
+    intensity = array("d")
+    delimiter: Optional[str] = None
+    in_header = True
+    header_lines = 0
+    pending = ""
+    chunk = first_chunk
+
+    while True:
+        final = not chunk
+        try:
+            pending += decoder.decode(chunk, final=final)
+        except UnicodeDecodeError:
+            raise SpectrumParseError("Upload is not valid UTF-8 text")
+
+        if final:
+            complete, pending = pending, ""
+        else:
+            cut = pending.rfind("\n")
+            complete, pending = pending[: cut + 1], pending[cut + 1:]
+
+        if in_header and complete:
+            lines = complete.splitlines(keepends=True)
+            consumed = 0
+            for line in lines:
+                text = line.strip()
+                if not text or text.startswith("#"):
+                    consumed += 1
+                    continue
+                if _is_data_row(text):
+                    delimiter = _delimiter_for(text)
+                    in_header = False
+                    break
+                consumed += 1
+                header_lines += 1
+                if header_lines > MAX_HEADER_LINES:
+                    raise SpectrumParseError("No numeric m/z / intensity rows found near the start of the file")
+            complete = "".join(lines[consumed:])
+
+        if not in_header and complete.strip():
+            try:
+                block = np.loadtxt(
+                    io.StringIO(complete),
+                    delimiter=delimiter,
+                    comments="#",
+                    usecols=(0, 1),
+                    dtype=np.float64,
+                    ndmin=2,
+                )
+            except ValueError as e:
+                raise SpectrumParseError(f"Malformed peak list row: {e}")
+            mz.frombytes(np.ascontiguousarray(block[:, 0]).tobytes())
+            intensity.frombytes(np.ascontiguousarray(block[:, 1]).tobytes())
+
+        if final:
+            break
+        chunk = reader.read()
+
+    if not mz:
+        raise SpectrumParseError("File contains no m/z / intensity rows")
+
+    fmt = detected
+    if fmt == "text":
+        fmt = {",": "csv", ";": "csv", "\t": "tsv"}.get(delimiter or "", "bruker_txt")
+    return _finish(np.frombuffer(mz, dtype=np.float64), np.frombuffer(intensity, dtype=np.float64), fmt)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _decode_binary_array(element: ET.Element) -> Optional[tuple]:
+    """Return (kind, values) for an mzML <binaryDataArray>, or None if it is neither m/z nor intensity."""
+    accessions = {
+        child.get("accession")
+        for child in element
+        if _local_name(child.tag) == "cvParam"
+    }
+    if _MZ_ARRAY in accessions:
+        kind = "mz"
+    elif _INTENSITY_ARRAY in accessions:
+        kind = "intensity"
+    else:
+        return None
+
+    binary = next((child for child in element if _local_name(child.tag) == "binary"), None)
+    if binary is None:
+        raise SpectrumParseError("mzML binaryDataArray has no <binary> element")
+    try:
+        raw = base64.b64decode((binary.text or "").strip(), validate=True)
+        if _ZLIB in accessions:
+            raw = zlib.decompress(raw)
+    except (ValueError, zlib.error) as e:
+        raise SpectrumParseError(f"Invalid mzML binary data: {e}")
+
+    dtype = "<f4" if _FLOAT32 in accessions else "<f8"
+    if _FLOAT32 not in accessions and _FLOAT64 not in accessions:
+        raise SpectrumParseError("mzML binary array has an unsupported numeric type")
+    if len(raw) % np.dtype(dtype).itemsize:
+        raise SpectrumParseError("mzML binary array length does not match its numeric type")
+    return kind, np.frombuffer(raw, dtype=dtype).astype(np.float64)
+
+
+def _parse_mzml(reader: _ChunkReader, first_chunk: bytes) -> Spectrum:
+    """Stream an mzML document and decode the arrays of its first spectrum."""
+    parser = ET.XMLPullParser(events=("start", "end"))
+    arrays: dict = {}
+    seen_root = False
+    chunk = first_chunk
+
+    while chunk:
+        try:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                name = _local_name(element.tag)
+                if event == "start":
+                    if not seen_root and name not in ("mzML", "indexedmzML"):
+                        raise SpectrumParseError("XML upload is not an mzML document")
+                    seen_root = True
+                    continue
+                if name == "binaryDataArray":
+                    decoded = _decode_binary_array(element)
+                    if decoded is not None:
+                        arrays.setdefault(decoded[0], decoded[1])
+                    element.clear()
+                elif name == "spectrum":
+                    if "mz" in arrays and "intensity" in arrays:
+                        return _finish(arrays["mz"], arrays["intensity"], "mzml")
+                    arrays.clear()
+                    element.clear()
+        except ET.ParseError as e:
+            raise SpectrumParseError(f"Malformed mzML: {e}")
+        chunk = reader.read()
+
+    raise SpectrumParseError("mzML file contains no spectrum with m/z and intensity arrays")
+
+
+def _finish(mz: np.ndarray, intensity: np.ndarray, fmt: str) -> Spectrum:
+    """Validate parsed arrays and return them sorted by m/z."""
+    if mz.shape != intensity.shape:
+        raise SpectrumParseError("m/z and intensity arrays differ in length")
+    if mz.size == 0:
+        raise SpectrumParseError("Spectrum is empty")
+    if not (np.isfinite(mz).all() and np.isfinite(intensity).all()):
+        raise SpectrumParseError("Spectrum contains non-finite values")
+    if np.any(mz[1:] < mz[:-1]):
+        order = np.argsort(mz, kind="stable")
+        mz, intensity = mz[order], intensity[order]
+    return Spectrum(
+        mz=np.ascontiguousarray(mz, dtype=np.float64),
+        intensity=np.ascontiguousarray(intensity, dtype=np.float64),
+        format=fmt,
+    )
+
+
+def parse_spectrum_stream(
+    stream: Any,
+    filename: str = "",
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = CHUNK_SIZE,
+) -> Spectrum:
+    """
+    Parse a spectrum from a binary file-like object, reading it in chunks.
+
+    Raises `UploadTooLargeError` once more than `max_bytes` have been read and
+    `SpectrumParseError` for anything that is not a readable spectrum.
+    """
+    reader = _ChunkReader(stream, max_bytes, chunk_size)
+    first_chunk = reader.read()
+    if not first_chunk:
+        raise SpectrumParseError("Uploaded file is empty")
+
+    fmt = _detect_format(filename, first_chunk[:4096])
+    if fmt == "mzml":
+        return _parse_mzml(reader, first_chunk)
+    return _parse_text(reader, first_chunk, fmt)
+
+
+def read_upload(upload: Any, max_bytes: int = MAX_UPLOAD_BYTES) -> Spectrum:
+    """
+    Parse a FastAPI `UploadFile` (blocking; run it off the event loop).
+
+    The declared size, when known, is checked before reading any data.
+    """
+    size: Optional[int] = getattr(upload, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+    upload.file.seek(0)
+    return parse_spectrum_stream(upload.file, upload.filename or "", max_bytes=max_bytes)
+
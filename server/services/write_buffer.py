@@ -0,0 +1,475 @@
+"""
+Write-behind persistence for predictions and prescriptions.
+
+Request handlers enqueue documents and return without waiting for MongoDB.
+A background task drains the bounded queue and writes each collection's
+documents with one `insert_many(ordered=False)`, as soon as
+`WRITE_BATCH_SIZE` documents are waiting or `WRITE_FLUSH_INTERVAL_MS`
+after the first one arrived.
+
+- Backpressure: when `WRITE_QUEUE_SIZE` documents are queued, `enqueue`
+  waits for the writer to catch up instead of growing memory.
+- Transient errors (dropped connections, primary failover) are retried
+  with backoff.
+- When the database is unreachable, or the app runs without one, batches
+  are appended to a local JSON-lines spill file, which is replayed once
+  writes succeed again. Documents get their `_id` before the first
+  attempt, so a replay of an already-stored document is a no-op.
+- Each insert attempt stamps its documents with `stored_at`, so
+  incremental exports can follow what reached MongoDB, including
+  documents replayed long after they were created.
+- Documents of collections with `on_flush` hooks are stored with the
+  names of the hooks they still need (`hooks_pending`) and a claim token
+  (`hooks_claim`); both are removed once the hooks have run. When a retry
+  or a replay finds a document already stored by an earlier attempt of
+  the same write, whose hooks never ran (e.g. `AutoReconnect` after the
+  server applied the insert), the hooks run for it then.
+- Hooks that fail stay in `hooks_pending`. `reconcile_hooks` (run every
+  `WRITE_RECONCILE_S` by `reconcile_periodically`) retries them, and any
+  other document whose claim is older than `WRITE_HOOK_LEASE_S`, e.g.
+  one stored by a process that died before running its hooks.
+- `pause_hooks()` holds hook runs (e.g. while the rollups are rebuilt from
+  scratch) until `resume_hooks(db)`; documents stay marked pending meanwhile.
+- `stop()` drains the queue on shutdown.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import asyncio
+import logging
+import os
+import threading
+
+from bson import ObjectId, json_util
+from pymongo import UpdateMany
+from pymongo.database import Database
+from pymongo.errors import AutoReconnect, BulkWriteError, ServerSelectionTimeoutError
+
+from services.database import run_write
+
+
+DUPLICATE_KEY = 11000
+
+# Names of the on_flush hooks a stored document still needs, and the token of whoever runs them
+HOOKS_PENDING = "hooks_pending"
+HOOKS_CLAIM = "hooks_claim"
+
+WRITE_RECONCILE_S = float(os.getenv("WRITE_RECONCILE_S", "60"))
+WRITE_HOOK_LEASE_S = float(os.getenv("WRITE_HOOK_LEASE_S", "300"))
+
+logger = logging.getLogger(__name__)
+
+PendingWrite = Tuple[str, Dict[str, Any]]
+FlushHook = Callable[[Database, List[Dict[str, Any]]], Any]
+
+
+class WriteBehindBuffer:
+    """Bounded queue of inserts flushed in batches by a background task."""
+
+    def __init__(
+        self,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval_ms: float = 200.0,
+        max_retries: int = 3,
+        spill_path: Optional[str] = None,
+        hook_lease_s: float = 300.0,
+    ):
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.max_retries = max(0, max_retries)
+        self.spill_path = spill_path
+        self.hook_lease = timedelta(seconds=max(0.0, hook_lease_s))
+        self._hooks: Dict[str, Dict[str, FlushHook]] = {}
+        self._get_db: Callable[[], Optional[Database]] = lambda: None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._spill_lock = threading.Lock()
+        self._replaying: Optional[asyncio.Lock] = None
+        self._paused = False
+        self._held: List[Tuple[str, List[Dict[str, Any]]]] = []
+        self._counters = {
+            "enqueued": 0, "written": 0, "duplicates": 0, "failed": 0, "retries": 0, "spilled": 0, "replayed": 0,
+            "hooks_failed": 0, "hooks_reconciled": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "WriteBehindBuffer":
+        # A per-user state directory, outside the source tree
+        state_home = os.getenv("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+        default_spill = os.path.join(state_home, "amr-server", "pending_writes.jsonl")
+        return cls(
+            max_queue=int(os.getenv("WRITE_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("WRITE_BATCH_SIZE", "500")),
+            flush_interval_ms=float(os.getenv("WRITE_FLUSH_INTERVAL_MS", "200")),
+            max_retries=int(os.getenv("WRITE_MAX_RETRIES", "3")),
+            spill_path=os.getenv("WRITE_SPILL_PATH", default_spill) or None,
+            hook_lease_s=WRITE_HOOK_LEASE_S,
+        )
+
+    def on_flush(self, collection: str, hook: FlushHook) -> None:
+        """Run `hook(db, docs)` (blocking, on the write pool) after documents of `collection` are stored."""
+        self._hooks.setdefault(collection, {})[hook_name(hook)] = hook
+
+    def track(self, collection: str, docs: Iterable[Dict[str, Any]]) -> None:
+        """
+        Mark documents about to be inserted as needing this collection's hooks.
+
+        A document keeps its claim token across attempts (and spill
+        replays), which is how a later attempt recognises its own earlier write.
+        """
+        names = list(self._hooks.get(collection, {}))
+        if not names:
+            return
+        claim = ObjectId()
+        for doc in docs:
+            doc.setdefault(HOOKS_PENDING, names)
+            doc.setdefault(HOOKS_CLAIM, claim)
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and not self._writer.done()
+
+    def start(self, get_db: Callable[[], Optional[Database]]) -> None:
+        """Start the background writer; `get_db` returns the current database handle or None."""
+        if self.running:
+            return
+        self._get_db = get_db
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def stop(self) -> None:
+        """Stop the writer and flush (or spill) everything still queued."""
+        if self.running:
+            # The sentinel lets the writer flush the batch it is collecting, then exit
+            await self._queue.put(None)
+            await self._writer
+        self._writer = None
+        if self._queue is not None:
+            pending: List[PendingWrite] = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    pending.append(item)
+            for offset in range(0, len(pending), self.batch_size):
+                await self._flush(pending[offset:offset + self.batch_size])
+        if self._held:
+            # Still marked pending in the database; the next reconcile runs them
+            logger.warning("⚠️  Stopped with post-write hooks held for %d batch(es)", len(self._held))
+        self._paused = False
+        self._held = []
+
+    def pause_hooks(self) -> None:
+        """Hold post-write hooks until `resume_hooks`, e.g. while the rollups they update are rebuilt."""
+        self._paused = True
+
+    async def resume_hooks(self, db: Database) -> None:
+        """Run the hooks held since `pause_hooks` and stop holding new ones."""
+        self._paused = False
+        held, self._held = self._held, []
+        for collection, docs in held:
+            await self.run_hooks(db, collection, docs)
+
+    async def enqueue(self, collection: str, doc: Dict[str, Any]) -> None:
+        """Queue one document for insertion, waiting while the queue is full."""
+        doc.setdefault("_id", ObjectId())
+        if not self.running:
+            # Not started (e.g. a script importing the routers): write through
+            await self._flush([(collection, doc)])
+            return
+        await self._queue.put((collection, doc))
+        self._counters["enqueued"] += 1
+
+    async def enqueue_many(self, collection: str, docs: List[Dict[str, Any]]) -> None:
+        for doc in docs:
+            await self.enqueue(collection, doc)
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        await self.replay_spill()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch: List[PendingWrite] = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                if await self._flush(batch):
+                    await self.replay_spill()
+            except Exception as e:
+                # Keep the writer alive; the batch is lost only if spilling failed too
+                logger.warning("⚠️  Write-behind flush failed: %s: %s", type(e).__name__, e)
+
+    async def _flush(self, batch: List[PendingWrite]) -> bool:
+        """Write a batch grouped by collection; returns False if anything had to be spilled."""
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for collection, doc in batch:
+            by_collection.setdefault(collection, []).append(doc)
+        stored = True
+        for collection, docs in by_collection.items():
+            if not await self._insert(collection, docs):
+                await asyncio.get_running_loop().run_in_executor(None, self._spill, collection, docs)
+                stored = False
+        return stored
+
+    async def _insert(self, collection: str, docs: List[Dict[str, Any]]) -> bool:
+        """Insert with retries; returns False when the database is unavailable."""
+        self.track(collection, docs)
+        for attempt in range(self.max_retries + 1):
+            db = self._get_db()
+            if db is None:
+                return False
+            stored_at = datetime.utcnow()
+            for doc in docs:
+                doc["stored_at"] = stored_at
+            try:
+                await run_write(db[collection].insert_many, docs, ordered=False)
+                inserted, duplicates = docs, []
+            except BulkWriteError as e:
+                inserted, duplicates = self._partially_inserted(docs, e)
+            except ServerSelectionTimeoutError:
+                # No reachable server: spill now rather than hold up the queue
+                return False
+            except AutoReconnect:
+                # Failover or dropped connection (includes NetworkTimeout, NotPrimaryError)
+                if attempt == self.max_retries:
+                    return False
+                self._counters["retries"] += 1
+                await self._sleep(attempt)
+                continue
+            except Exception as e:
+                logger.warning("⚠️  Could not write %s: %s: %s", collection, type(e).__name__, e)
+                return False
+            self._counters["written"] += len(inserted)
+            await self.run_hooks(db, collection, inserted)
+            if duplicates:
+                await self._run_unfinished_hooks(db, collection, duplicates)
+            return True
+        return False
+
+    def _partially_inserted(
+        self, docs: List[Dict[str, Any]], error: BulkWriteError
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Documents stored despite per-document errors, and the duplicates (earlier writes being replayed)."""
+        failed = set()
+        duplicates = []
+        for write_error in error.details.get("writeErrors", []):
+            failed.add(write_error["index"])
+            if write_error.get("code") == DUPLICATE_KEY:
+                self._counters["duplicates"] += 1
+                duplicates.append(docs[write_error["index"]])
+            else:
+                self._counters["failed"] += 1
+                logger.warning("⚠️  Dropped unwritable document: %s", write_error.get("errmsg"))
+        return [doc for index, doc in enumerate(docs) if index not in failed], duplicates
+
+    async def _run_unfinished_hooks(self, db: Database, collection: str, duplicates: List[Dict[str, Any]]) -> None:
+        """Run the hooks still pending on duplicates stored by an earlier attempt of the same write."""
+        by_claim: Dict[Any, List[Any]] = {}
+        for doc in duplicates:
+            if doc.get(HOOKS_CLAIM) is not None:
+                by_claim.setdefault(doc[HOOKS_CLAIM], []).append(doc["_id"])
+        for claim, ids in by_claim.items():
+            # Still holding this write's token: nobody else has run (or is running) their hooks
+            stored = await run_write(
+                claim_documents, db[collection], {"_id": {"$in": ids}, HOOKS_CLAIM: claim, HOOKS_PENDING: {"$exists": True}}
+            )
+            if stored:
+                logger.info("🔁 Running post-write hooks for %d %s document(s) stored by an earlier attempt", len(stored), collection)
+                await self.run_hooks(db, collection, stored)
+
+    async def run_hooks(self, db: Database, collection: str, docs: List[Dict[str, Any]]) -> None:
+        """
+        Run the `on_flush` hooks for stored documents of `collection` (also
+        for other writers, e.g. bulk ingest, which call `track` first).
+
+        Tracked documents only get the hooks they still need; afterwards
+        their `hooks_pending` is cleared, or cut down to the hooks that failed.
+        """
+        if not docs:
+            return
+        if self._paused:
+            self._held.append((collection, docs))
+            return
+        hooks = self._hooks.get(collection, {})
+        failed = set()
+        for name, hook in hooks.items():
+            targets = [doc for doc in docs if name in doc.get(HOOKS_PENDING, hooks)]
+            if not targets:
+                continue
+            try:
+                await run_write(hook, db, targets)
+            except Exception as e:
+                failed.add(name)
+                self._counters["hooks_failed"] += len(targets)
+                logger.warning("⚠️  Post-write hook %s for %s failed: %s: %s", name, collection, type(e).__name__, e)
+
+        remaining: Dict[Tuple[str, ...], List[Any]] = {}
+        for doc in docs:
+            if HOOKS_PENDING in doc:
+                # Names of hooks no longer registered are dropped
+                left = tuple(name for name in doc[HOOKS_PENDING] if name in failed)
+                remaining.setdefault(left, []).append(doc["_id"])
+        if remaining:
+            requests = [
+                UpdateMany({"_id": {"$in": ids}}, {"$set": {HOOKS_PENDING: list(left)}} if left else {"$unset": {HOOKS_PENDING: "", HOOKS_CLAIM: ""}})
+                for left, ids in remaining.items()
+            ]
+            try:
+                await run_write(db[collection].bulk_write, requests, ordered=False)
+            except Exception as e:
+                logger.warning("⚠️  Could not mark post-write hooks done for %s: %s: %s", collection, type(e).__name__, e)
+
+    async def reconcile_hooks(self, db: Database) -> int:
+        """
+        Run the hooks still pending on documents whose claim has expired:
+        hooks that failed, and writes whose process stopped before running
+        them. Returns the number of documents handled.
+        """
+        handled = 0
+        if self._paused:
+            return handled
+        for collection in list(self._hooks):
+            while True:
+                expired = ObjectId.from_datetime(datetime.utcnow() - self.hook_lease)
+                query = {HOOKS_PENDING: {"$exists": True}, HOOKS_CLAIM: {"$lt": expired}}
+                ids = await run_write(find_ids, db[collection], query, self.batch_size)
+                if not ids:
+                    break
+                stored = await run_write(claim_documents, db[collection], {**query, "_id": {"$in": ids}})
+                if stored:
+                    await self.run_hooks(db, collection, stored)
+                    handled += len(stored)
+                if len(ids) < self.batch_size:
+                    break
+        if handled:
+            self._counters["hooks_reconciled"] += handled
+            logger.info("🔁 Reran post-write hooks for %d document(s)", handled)
+        return handled
+
+    @staticmethod
+    async def _sleep(attempt: int) -> None:
+        await asyncio.sleep(min(5.0, 0.1 * (2 ** attempt)))
+
+    def _spill(self, collection: str, docs: List[Dict[str, Any]]) -> None:
+        if not self.spill_path:
+            self._counters["failed"] += len(docs)
+            logger.warning("⚠️  Database unavailable; dropped %d %s document(s)", len(docs), collection)
+            return
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for doc in docs:
+                    f.write(json_util.dumps({"collection": collection, "doc": doc}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self._counters["spilled"] += len(docs)
+
+    def _take_spill(self) -> List[PendingWrite]:
+        """
+        Move the spill file aside and read it back (blocking).
+
+        The moved-aside file is kept until `_finish_replay`, so a crash
+        during the replay replays it again on the next start.
+        """
+        if not self.spill_path:
+            return []
+        replaying = self.spill_path + ".replay"
+        with self._spill_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return []
+                os.replace(self.spill_path, replaying)
+        pending: List[PendingWrite] = []
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json_util.loads(line)
+                    pending.append((record["collection"], record["doc"]))
+        return pending
+
+    def _finish_replay(self) -> None:
+        """Delete the replayed spill file once every record is stored or spilled again (blocking)."""
+        replaying = self.spill_path + ".replay"
+        if os.path.exists(replaying):
+            os.remove(replaying)
+
+    async def replay_spill(self) -> None:
+        """Write back documents spilled while the database was unavailable (e.g. once it reconnects)."""
+        if self._get_db() is None:
+            return
+        if self._replaying is None:
+            self._replaying = asyncio.Lock()
+        async with self._replaying:
+            await self._replay_spill()
+
+    async def _replay_spill(self) -> None:
+        try:
+            pending = await asyncio.get_running_loop().run_in_executor(None, self._take_spill)
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️  Could not read spilled writes: %s: %s", type(e).__name__, e)
+            return
+        if pending:
+            self._counters["replayed"] += len(pending)
+            logger.info("🔁 Replaying %d spilled write(s)", len(pending))
+        for offset in range(0, len(pending), self.batch_size):
+            # Anything that fails again goes back to the spill file
+            await self._flush(pending[offset:offset + self.batch_size])
+        if self.spill_path:
+            await asyncio.get_running_loop().run_in_executor(None, self._finish_replay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            **self._counters,
+        }
+
+
+def hook_name(hook: FlushHook) -> str:
+    """Stable name of a flush hook, as recorded in `hooks_pending`."""
+    return getattr(hook, "__qualname__", None) or repr(hook)
+
+
+def find_ids(collection: Any, query: Dict[str, Any], limit: int) -> List[Any]:
+    """`_id`s of up to `limit` documents matching `query` (blocking)."""
+    return [doc["_id"] for doc in collection.find(query, {"_id": 1}).limit(limit)]
+
+
+def claim_documents(collection: Any, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Take over the documents matching `query` with a new claim token and return them (blocking)."""
+    claim = ObjectId()
+    collection.update_many(query, {"$set": {HOOKS_CLAIM: claim}})
+    return list(collection.find({HOOKS_CLAIM: claim}))
+
+
+write_buffer = WriteBehindBuffer.from_env()
+
+
+async def reconcile_periodically(interval_s: float, get_db: Callable[[], Optional[Database]]) -> None:
+    """Retry pending post-write hooks every `interval_s` seconds while a database is available."""
+    while True:
+        await asyncio.sleep(interval_s)
+        db = get_db()
+        if db is None:
+            continue
+        try:
+            await write_buffer.reconcile_hooks(db)
+        except Exception as e:
+            logger.warning("⚠️  Post-write hook reconcile failed: %s: %s", type(e).__name__, e)
@@ -0,0 +1,40 @@
+"""
+Shared fixtures. Tests run against mongomock, which lacks some aggregation
+operators (e.g. `$dateTrunc`); tests needing them take the `mongod`
+fixture, which uses `TEST_MONGODB_URI` and is skipped when it is not set.
+"""
+
+import os
+import sys
+
+# Settings the app's modules read at import time
+os.environ.setdefault("INFERENCE_WORKERS", "0")
+os.environ["WRITE_SPILL_PATH"] = ""
+os.environ.setdefault("MONGODB_URI", "mongodb://127.0.0.1:1/")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock
+import pytest
+
+
+@pytest.fixture
+def db():
+    """An empty in-memory database."""
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def mongod():
+    """An empty database on the mongod at `TEST_MONGODB_URI`, dropped afterwards."""
+    uri = os.getenv("TEST_MONGODB_URI")
+    if not uri:
+        pytest.skip("TEST_MONGODB_URI is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    database = client[f"amr_test_{os.getpid()}"]
+    client.drop_database(database.name)
+    yield database
+    client.drop_database(database.name)
+    client.close()
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from services.ingest import validate_batch
+
+
+NOW = datetime(2026, 6, 1, 12)
+
+
+def test_valid_record_becomes_a_prediction_document():
+    valid, errors = validate_batch([(1, {
+        "recordId": "LAB-1",
+        "organism": " Escherichia coli ",
+        "susceptible": "Amikacin; Meropenem",
+        "resistantAntibiotics": ["Ciprofloxacin"],
+        "collectedAt": "2026-05-31T22:00:00+02:00",
+        "region": "lahore",
+        "patientAge": "42",
+    })], "lis-a", NOW)
+
+    assert errors == []
+    [(line, doc)] = valid
+    assert line == 1
+    assert doc["bacterialSpecies"] == "Escherichia coli"
+    assert doc["susceptibleAntibiotics"] == ["Amikacin", "Meropenem"]
+    assert doc["created_at"] == datetime(2026, 5, 31, 20)
+    assert doc["region"] == "Punjab" and doc["district"] == "Lahore"
+    assert doc["patientAge"] == 42
+    assert doc["ingest_key"] == "lis-a:LAB-1"
+    assert doc["ingested_at"] == NOW
+    assert doc["organism_key"] == "escherichia coli"
+    assert doc["antibiotic_keys"] == ["amikacin", "ciprofloxacin", "meropenem"]
+
+
+def test_created_at_defaults_to_now():
+    valid, _ = validate_batch([(1, {"recordId": 7, "bacterialSpecies": "E. coli", "resistant": ["Ampicillin"]})], "s", NOW)
+    assert valid[0][1]["created_at"] == NOW
+
+
+def test_every_problem_of_a_record_is_reported():
+    valid, errors = validate_batch([(3, {
+        "bacterialSpecies": "",
+        "susceptibleAntibiotics": ["Amikacin"],
+        "resistantAntibiotics": ["Amikacin"],
+        "created_at": "2027-01-01",
+        "latitude": 123,
+        "patientAge": "old",
+    })], "s", NOW)
+
+    assert valid == []
+    [report] = errors
+    assert report["line"] == 3 and report["recordId"] is None
+    assert report["errors"] == [
+        "recordId is required",
+        "bacterialSpecies is required",
+        "created_at is in the future",
+        "latitude must be between -90 and 90",
+        "patientAge must be an integer",
+        "listed as both susceptible and resistant: Amikacin",
+    ]
+
+
+def test_invalid_rows_do_not_affect_the_rest_of_the_batch():
+    rows = [
+        (1, {"recordId": "a", "bacterialSpecies": "E. coli", "resistant": "Ampicillin"}),
+        (2, ["not", "an", "object"]),
+        (3, {"recordId": "b", "bacterialSpecies": "E. coli"}),
+        (4, {"recordId": "c", "bacterialSpecies": "E. coli", "susceptible": 5}),
+    ]
+    valid, errors = validate_batch(rows, "s", NOW)
+
+    assert [line for line, _ in valid] == [1]
+    assert errors == [
+        {"line": 2, "recordId": None, "errors": ["record must be an object"]},
+        {"line": 3, "recordId": "b", "errors": ["no antibiotic results"]},
+        {"line": 4, "recordId": "c", "errors": [
+            "susceptibleAntibiotics must be a list or a ';'-separated string",
+            "no antibiotic results",
+        ]},
+    ]
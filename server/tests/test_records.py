@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from services.records import (
+    SORT,
+    InvalidCursorError,
+    after_cursor,
+    encode_cursor,
+    prediction_filter,
+    prediction_keys,
+)
+
+
+def _page_through(db, query, size):
+    """Every record matching `query`, fetched in pages of `size` the way the API pages."""
+    seen = []
+    cursor = None
+    while True:
+        page_query = after_cursor(query, cursor) if cursor else query
+        page = list(db.predictions.find(page_query).sort(SORT).limit(size))
+        seen.extend(doc["_id"] for doc in page)
+        if len(page) < size:
+            return seen
+        cursor = encode_cursor(page[-1])
+
+
+@pytest.fixture
+def records(db):
+    base = datetime(2026, 5, 1, 12)
+    docs = []
+    # Three records per timestamp, so pages break inside runs of ties
+    for minutes in (0, 0, 0, 5, 5, 5, 10):
+        docs.append({"_id": ObjectId(), "created_at": base + timedelta(minutes=minutes), "region": "Punjab"})
+    # Legacy records without created_at sort last
+    for _ in range(3):
+        docs.append({"_id": ObjectId(), "created_at": None, "region": "Punjab"})
+    docs.append({"_id": ObjectId(), "region": "Sindh"})
+    db.predictions.insert_many(docs)
+    return docs
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 100])
+def test_paging_returns_every_record_once_in_order(db, records, size):
+    expected = [doc["_id"] for doc in db.predictions.find({}).sort(SORT)]
+    assert _page_through(db, {}, size) == expected
+    assert len(expected) == len(records)
+
+
+def test_paging_keeps_the_filter(db, records):
+    query = prediction_filter(region="punjab")
+    paged = _page_through(db, query, 2)
+    assert len(paged) == 10
+    assert set(paged) == {doc["_id"] for doc in records if doc["region"] == "Punjab"}
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(InvalidCursorError):
+        after_cursor({}, "not-a-cursor")
+
+
+def test_filters_match_names_exactly_on_their_keys(db):
+    stored = {"bacterialSpecies": " Escherichia coli", "susceptibleAntibiotics": ["Amikacin "], "resistantAntibiotics": ["CIPROFLOXACIN"]}
+    stored.update(prediction_keys(stored))
+    db.predictions.insert_one(stored)
+
+    assert stored["organism_key"] == "escherichia coli"
+    assert stored["antibiotic_keys"] == ["amikacin", "ciprofloxacin"]
+    assert prediction_filter(organism="ESCHERICHIA COLI ") == {"organism_key": "escherichia coli"}
+    assert db.predictions.count_documents(prediction_filter(organism="escherichia Coli", antibiotic="Ciprofloxacin")) == 1
+    assert db.predictions.count_documents(prediction_filter(antibiotic="Cipro")) == 0
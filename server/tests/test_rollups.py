@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import mongomock
+from bson import ObjectId
+
+from services.rollups import ROLLUP_COLLECTION, rebuild_rollups, record_prediction, record_predictions
+
+
+def _prediction(region: Any, organism: Any, created_at: datetime, susceptible: List[str], resistant: List[str]) -> Dict[str, Any]:
+    return {
+        "_id": ObjectId(),
+        "region": region,
+        "bacterialSpecies": organism,
+        "created_at": created_at,
+        "susceptibleAntibiotics": susceptible,
+        "resistantAntibiotics": resistant,
+    }
+
+
+PREDICTIONS = [
+    _prediction("Punjab", "E. coli", datetime(2026, 3, 1, 8), ["Amikacin"], ["Ciprofloxacin"]),
+    _prediction(" punjab ", "E. coli", datetime(2026, 3, 1, 23, 59), ["Amikacin", "Meropenem"], []),
+    _prediction("PUNJAB", "E. coli", datetime(2026, 3, 2, 0, 0), [], ["Ampicillin"]),
+    _prediction("Sindh", "Klebsiella pneumoniae", datetime(2026, 3, 1, 12), [], []),
+    _prediction(None, "", datetime(2026, 3, 1, 12), ["Amikacin"], ["Ampicillin", "Ciprofloxacin"]),
+]
+
+
+def _expected(predictions: List[Dict[str, Any]]) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    """Rollup rows computed independently of the module under test."""
+    rows: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for p in predictions:
+        region = p["region"].strip().lower() if p["region"] else None
+        day = p["created_at"].replace(hour=0, minute=0, second=0, microsecond=0)
+        row = rows.setdefault(
+            (region or None, p["bacterialSpecies"] or None, day),
+            {"cases": 0, "rated_cases": 0, "resistance_rate_sum": 0.0},
+        )
+        tested = len(p["susceptibleAntibiotics"]) + len(p["resistantAntibiotics"])
+        row["cases"] += 1
+        if tested:
+            row["rated_cases"] += 1
+            row["resistance_rate_sum"] += len(p["resistantAntibiotics"]) / tested
+    return rows
+
+
+def _rows(db) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    return {
+        (row["region"], row["organism"], row["day"]): {
+            "cases": row["cases"],
+            "rated_cases": row["rated_cases"],
+            "resistance_rate_sum": round(row["resistance_rate_sum"], 9),
+        }
+        for row in db[ROLLUP_COLLECTION].find()
+    }
+
+
+def _rounded(rows: Dict[Tuple[Any, ...], Dict[str, Any]]) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    return {key: {**row, "resistance_rate_sum": round(row["resistance_rate_sum"], 9)} for key, row in rows.items()}
+
+
+def test_record_predictions_matches_expected_rows(db):
+    record_predictions(db, PREDICTIONS)
+    assert _rows(db) == _rounded(_expected(PREDICTIONS))
+
+
+def test_record_predictions_matches_one_at_a_time(db):
+    record_predictions(db, PREDICTIONS[:2])
+    record_predictions(db, PREDICTIONS[2:])
+    other = mongomock.MongoClient().db
+    for prediction in PREDICTIONS:
+        record_prediction(other, prediction)
+    assert _rows(db) == _rows(other)
+
+
+def test_rows_carry_the_organism_key(db):
+    record_predictions(db, PREDICTIONS)
+    keys = {row["organism"]: row["organism_key"] for row in db[ROLLUP_COLLECTION].find()}
+    assert keys == {"E. coli": "e. coli", "Klebsiella pneumoniae": "klebsiella pneumoniae", None: None}
+
+
+def test_rebuild_matches_incremental_rollups(mongod):
+    mongod.predictions.insert_many([dict(p) for p in PREDICTIONS])
+    record_predictions(mongod, PREDICTIONS)
+    incremental = _rows(mongod)
+    rebuild_rollups(mongod)
+    assert _rows(mongod) == incremental
+
+
+def test_rebuild_leaves_out_predictions_pending_their_hook(mongod):
+    pending = dict(PREDICTIONS[0], _id=ObjectId(), hooks_pending=["record_predictions"])
+    mongod.predictions.insert_many([dict(p) for p in PREDICTIONS] + [pending])
+    rebuild_rollups(mongod)
+    # The hook adds it afterwards
+    record_predictions(mongod, [pending])
+    assert _rows(mongod) == _rounded(_expected(PREDICTIONS + [pending]))
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import mongomock.collection
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+from services.write_buffer import HOOKS_CLAIM, HOOKS_PENDING, WriteBehindBuffer
+
+
+# Hooks are recorded in hooks_pending by name, so they live at module level like the app's
+CALLS = []
+BROKEN = []
+
+
+def record_predictions(db, docs):
+    CALLS.append(sorted(doc["n"] for doc in docs))
+
+
+def record_antibiogram(db, docs):
+    if BROKEN:
+        raise RuntimeError("write concern timeout")
+    CALLS.append(("antibiogram", len(docs)))
+
+
+def _docs(count):
+    return [{"_id": ObjectId(), "n": n} for n in range(count)]
+
+
+@pytest.fixture
+def calls():
+    CALLS.clear()
+    BROKEN.clear()
+    return CALLS
+
+
+@pytest.fixture
+def buffer(tmp_path, calls):
+    buffer = WriteBehindBuffer(spill_path=str(tmp_path / "pending_writes.jsonl"), max_retries=1, hook_lease_s=0)
+    buffer.on_flush("predictions", record_predictions)
+    return buffer
+
+
+def _connect(buffer, db):
+    buffer._get_db = lambda: db
+
+
+def test_spilled_writes_are_replayed_once_the_database_is_back(buffer, db, calls, tmp_path):
+    _connect(buffer, None)
+    assert asyncio.run(buffer._flush([("predictions", doc) for doc in _docs(3)])) is False
+    assert (tmp_path / "pending_writes.jsonl").exists()
+
+    _connect(buffer, db)
+    asyncio.run(buffer.replay_spill())
+
+    assert db.predictions.count_documents({}) == 3
+    assert calls == [[0, 1, 2]]
+    assert not list(tmp_path.iterdir())
+    # Hooks done: the bookkeeping fields are gone
+    assert db.predictions.count_documents({HOOKS_PENDING: {"$exists": True}}) == 0
+    assert db.predictions.count_documents({HOOKS_CLAIM: {"$exists": True}}) == 0
+
+
+def test_replay_after_a_crash_runs_the_hooks_of_stored_documents(buffer, db, calls):
+    _connect(buffer, db)
+    docs = _docs(3)
+    buffer.track("predictions", docs)
+    # Two documents reached MongoDB, then the process stopped before their hooks ran
+    db.predictions.insert_many([dict(doc) for doc in docs[:2]])
+    buffer._spill("predictions", docs)
+
+    asyncio.run(buffer.replay_spill())
+
+    assert sorted(n for call in calls for n in call) == [0, 1, 2]
+    # A second replay of the same documents finds their hooks done
+    calls.clear()
+    buffer._spill("predictions", docs)
+    asyncio.run(buffer.replay_spill())
+    assert calls == []
+
+
+def test_retry_after_an_applied_insert_runs_the_hooks(buffer, db, calls, monkeypatch):
+    _connect(buffer, db)
+    insert_many = mongomock.collection.Collection.insert_many
+    failures = [AutoReconnect("connection closed")]
+
+    def applied_then_lost(self, docs, *args, **kwargs):
+        result = insert_many(self, docs, *args, **kwargs)
+        if failures:
+            raise failures.pop()
+        return result
+
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", applied_then_lost)
+    assert asyncio.run(buffer._insert("predictions", _docs(2))) is True
+    assert calls == [[0, 1]]
+    assert buffer.stats()["duplicates"] == 2
+
+
+def test_failed_hooks_stay_pending_until_reconciled(buffer, db, calls):
+    _connect(buffer, db)
+    BROKEN.append(True)
+    buffer.on_flush("predictions", record_antibiogram)
+    asyncio.run(buffer._insert("predictions", _docs(2)))
+    assert calls == [[0, 1]]
+    assert db.predictions.count_documents({HOOKS_PENDING: ["record_antibiogram"]}) == 2
+
+    BROKEN.clear()
+    # Claims are ObjectIds, so they expire with one-second resolution
+    time.sleep(1.1)
+    assert asyncio.run(buffer.reconcile_hooks(db)) == 2
+    assert calls == [[0, 1], ("antibiogram", 2)]
+    assert db.predictions.count_documents({HOOKS_PENDING: {"$exists": True}}) == 0
+
+
+def test_paused_hooks_run_on_resume(buffer, db, calls):
+    _connect(buffer, db)
+    buffer.pause_hooks()
+    asyncio.run(buffer._insert("predictions", _docs(2)))
+    assert calls == []
+    assert db.predictions.count_documents({HOOKS_PENDING: "record_predictions"}) == 2
+
+    asyncio.run(buffer.resume_hooks(db))
+    assert calls == [[0, 1]]